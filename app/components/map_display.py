@@ -11,3 +11,35 @@ def display_folium_map(map):
     else:
         st.warning("No data available to display")
 
+
+def display_clickable_map(map, key: str, width: int = 700, height: int = 500):
+    """Display a folium map and return the (lat, lon) of the last click on it, None until it's clicked"""
+    if map is None:
+        st.warning("No data available to display")
+        return None
+
+    # Only the clicks come back, so panning and zooming don't rerun the page
+    output = st_folium(map, key=key, width=width, height=height, returned_objects=["last_clicked"])
+    clicked = (output or {}).get("last_clicked")
+    return None if clicked is None else (clicked["lat"], clicked["lng"])
+
+
+def display_profile(records: list[dict]):
+    """Table of the Map's stage timings for the last run (see core/profiling.py)"""
+    if not records:
+        st.caption("Nothing was recomputed on this run")
+        return
+
+    rows = []
+    for record in records:
+        rows.append({
+            "stage": " " * record["depth"] + record["stage"],
+            "wall (s)": round(record["wall_s"], 4),
+            "cpu (s)": round(record["cpu_s"], 4),
+            "peak (MB)": None if record["alloc_mb"] is None else round(record["alloc_mb"], 1),
+            "rows": record["rows"],
+        })
+
+    total = sum(record["wall_s"] for record in records if record["depth"] == 0)
+    st.caption(f"{total:.3f} s in Map stages")
+    st.dataframe(rows, hide_index=True, use_container_width=True)
@@ -1,47 +1,89 @@
 import streamlit as st
 from windwatch.app.utilities import load_folium_map
-from windwatch.app.components.map_display import display_folium_map
+from windwatch.app.components.map_display import display_clickable_map, display_profile
+from windwatch.app.worker import MapWorker
 from windwatch.core.map import Map
 import numpy as np
+import calendar
 
 
 
-def show(map: Map = None):
+def get_worker(map: Map = None, map_kwargs: dict = None) -> MapWorker:
+    ''' This session's MapWorker, a new one if the Map (or its arguments) changed '''
+    source = st.session_state.get("map_worker_source")
+    same = source is map if map is not None else source == map_kwargs
+    if "map_worker" not in st.session_state or not same:
+        st.session_state.map_worker = MapWorker(map=map, map_kwargs=map_kwargs)
+        st.session_state.map_worker_source = map if map is not None else dict(map_kwargs)
+    return st.session_state.map_worker
+
+
+def search_sites(num_sites: int, min_spacing: float):
+    ''' "Find Best Sites" callback: asks for the site search and switches the layer to show it '''
+    st.session_state.site_search = {"k": int(num_sites), "min_spacing": min_spacing * 1000}
+    st.session_state.map_layer = "Best Sites"
+
+
+@st.fragment(run_every=0.5)
+def show_progress(worker: MapWorker, shown_generation: int, shown_error: str):
+    ''' Polls the worker while it's busy, and reruns the whole page once there's something new to show '''
+    if worker.busy:
+        text = worker.label + (f" ({worker.stage})" if worker.stage else "")
+        st.progress(worker.progress, text=text)
+        return
+
+    generation = worker.result["generation"] if worker.result is not None else 0
+    if generation != shown_generation or worker.error != shown_error or worker.info is None:
+        st.rerun()
 
-    # Set up state
-    if "prev_bird_slider" not in st.session_state:
-        st.session_state.prev_bird_slider = 50
 
-    if "prev_wind_slider" not in st.session_state:
-        st.session_state.prev_wind_slider = 50
+def show(map: Map = None, map_kwargs: dict = None):
+    '''
+    Map page. The Map is only ever updated by a background MapWorker, so the controls stay live
+    while it works: the last finished map stays on screen and newer slider values replace older
+    ones that haven't finished. Pass an existing Map, or map_kwargs to build one in the background.
+    '''
 
+    worker = get_worker(map, map_kwargs)
+
+    # Read once, so what's drawn and what the progress poll compares against always match
+    error, info, result = worker.error, worker.info, worker.result
+    if error:
+        st.error("The map update failed")
+        st.code(error)
+
+    if info is None:
+        # Still building the map, nothing to draw controls from yet
+        if worker.busy:
+            show_progress(worker, 0, error)
+        return
+
+    # Set up state
     if "map_subject" not in st.session_state:
         st.session_state.map_subject = "value"
 
     if "map_header" not in st.session_state:
         st.session_state.map_header = "Site Value Map"
 
+    if "site_search" not in st.session_state:
+        st.session_state.site_search = None  # set by "Find Best Sites", PSO until then
 
-    st.header(st.session_state.map_header)
-
-    map.run_pso()
+    if "query_point" not in st.session_state:
+        st.session_state.query_point = None  # (lat, lon) of the last click on the map
 
-    map.update_folium_map(st.session_state.map_subject)
-    data = map.folium_map
-    display_folium_map(data)
-    
+    # Controls first. They only describe what the map should look like, the worker does the rest
     with st.sidebar:
         st.header("Controls")
-        
+
         st.markdown("---")
-                
+
         bird_slider = st.select_slider(
             "Bird Impact Risk",
             options=np.arange(1, 101, 1),
             value=50,
             key="bird_slider"
         )
-        
+
         wind_slider = st.select_slider(
             "Wind Energy Potential",
             options=np.arange(1, 101, 1),
@@ -49,48 +91,197 @@ def show(map: Map = None):
             key="wind_slider"
         )
 
-        if bird_slider != st.session_state.prev_bird_slider:
-            st.session_state.prev_bird_slider = bird_slider
-            map.calculate_cost_value(new_coefficients={"birdRisk": int(bird_slider)})
+        coefficients = {"birdRisk": int(bird_slider), "windSpeed": int(wind_slider)}
+
+        # Turbine yield, only there if the Map was given rasters for several hub heights
+        hub_height, turbine = None, None
+        if info["hub_heights"]:
+            coefficients["power"] = int(st.select_slider(
+                "Turbine Energy Yield",
+                options=np.arange(0, 101, 1),
+                value=0,
+                key="power_slider"
+            ))
+
+            with st.expander("Turbine"):
+                hub_height = st.selectbox(
+                    "Hub height (m)",
+                    info["hub_heights"],
+                    index=info["hub_heights"].index(info["hub_height"]),
+                    key="hub_height"
+                )
+                turbine = st.selectbox(
+                    "Power curve",
+                    info["turbines"],
+                    index=info["turbines"].index(info["turbine"]),
+                    key="turbine"
+                )
+
+        # Sensitivity of each species, only recombines the per-species risk layers
+        species_weights = None
+        if len(info["species"]) > 1:
+            with st.expander("Species sensitivity"):
+                species_weights = {}
+                for code in info["species"]:
+                    species_weights[code] = st.slider(
+                        info["species_names"][code],
+                        min_value=0.0,
+                        max_value=5.0,
+                        value=float(info["species_weights"][code]),
+                        step=0.1,
+                        key=f"species_{code}"
+                    )
 
-        if wind_slider != st.session_state.prev_wind_slider:  
-            st.session_state.prev_wind_slider = wind_slider
-            map.calculate_cost_value(new_coefficients={"windSpeed": int(wind_slider)})
-        
         # Add some space
         st.markdown("##")
-        
 
+        # Grid sizes in meters. An adaptive grid's is its biggest cell, min_grid_size times a power of 2
+        if info["adaptive"]:
+            resolution_label = "Largest cell size (km)"
+            resolution_options = [info["min_grid_size"] * 2 ** level for level in range(1, 6)]
+        else:
+            resolution_label = "Grid resolution (km)"
+            resolution_options = [1000, 5000, 10000, 20000]
+        # The Map's own size is always an option, so the first request doesn't switch it to another one
+        resolution_options = sorted(set(resolution_options) | {info["grid_size"]})
+        resolution = st.selectbox(
+            resolution_label,
+            resolution_options,
+            index=resolution_options.index(info["grid_size"]),
+            format_func=lambda size: f"{size / 1000:g}",
+            key="resolution"
+        )
+
+        st.markdown("##")
+
+        # Bird risk from only some of the sightings, sliced out of the Map's month x year cube
+        time_window = None
+        if info["years"]:
+            months = st.select_slider(
+                "Sighting months",
+                options=list(calendar.month_abbr)[1:],
+                value=("Jan", "Dec"),
+                key="months"
+            )
+            years = st.slider(
+                "Sighting years",
+                min_value=info["years"][0],
+                max_value=info["years"][-1],
+                value=(info["years"][0], info["years"][-1]),
+                key="years"
+            ) if len(info["years"]) > 1 else (info["years"][0],) * 2
+
+            month_numbers = tuple(list(calendar.month_abbr).index(month) for month in months)
+            time_window = {"months": month_numbers, "years": tuple(years)}
+
+        st.markdown("##")
+
+
+        # The layer is a widget key, so the best sites stay selected through reruns until another layer is picked
         selected_layer = st.selectbox(
             "Select map layer",
-            ["Site Value", "Bird Risk", "Wind Potential"]
+            ["Site Value", "Bird Risk", "Wind Potential"] + (["Capacity Factor"] if info["hub_heights"] else []) +
+            ["Pareto Front", "Robust Sites"] + (["Excluded Areas"] if info["exclusions"] else []) +
+            (["Best Sites"] if st.session_state.site_search else []),
+            key="map_layer"
         )
 
         if selected_layer == "Bird Risk":
             st.session_state.map_subject = "birdRisk"
-            st.session_state.map_header = f"{map.comName} Sighting Map"
+            st.session_state.map_header = f"{info['comName']} Sighting Map"
 
-        elif selected_layer == "Wind Speed":
+        elif selected_layer == "Wind Potential":
             st.session_state.map_subject = "windSpeed"
             st.session_state.map_header = "Wind Speed Map"
 
+        elif selected_layer == "Capacity Factor":
+            st.session_state.map_subject = "capacityFactor"
+            st.session_state.map_header = f"Capacity Factor ({turbine} at {hub_height} m)"
+
         elif selected_layer == "Site Value":
             st.session_state.map_subject = "value"
             st.session_state.map_header = "Site Value Map"
 
-        st.markdown("##")
+        elif selected_layer == "Pareto Front":
+            st.session_state.map_subject = "pareto"
+            st.session_state.map_header = "Sites No Other Site Beats On Every Layer"
 
-        PSOButton = st.button("Find Best Sites", key="btn_PSO")
+        elif selected_layer == "Robust Sites":
+            st.session_state.map_subject = "robustness"
+            st.session_state.map_header = "Best Site Across All Slider Settings"
 
-        if PSOButton:
-            map.run_pso()
+        elif selected_layer == "Excluded Areas":
+            st.session_state.map_subject = "excluded"
+            st.session_state.map_header = f"Excluded Areas ({', '.join(info['exclusions'])})"
+
+        elif selected_layer == "Best Sites":
             st.session_state.map_subject = "pso"
-            st.session_state.map_header = "Best Site"
+            st.session_state.map_header = "Best Sites" if st.session_state.site_search["k"] > 1 else "Best Site"
+
+        # One PNG overlay instead of one polygon per cell, for fine grids
+        fast_render = st.checkbox("Fast map rendering", value=info["cells"] > 20000, key="fast_render")
+
+        st.markdown("##")
+
+        num_sites = st.number_input("Number of sites", min_value=1, max_value=50, value=1, key="num_sites")
+        min_spacing = st.number_input("Minimum spacing (km)", min_value=0, max_value=200, value=10, key="min_spacing")
+
+        st.button("Find Best Sites", key="btn_PSO", on_click=search_sites, args=(num_sites, min_spacing))
+
+        st.markdown("##")
+
+        # Timings of whatever the Map recomputed for the map on screen, shown at the bottom of the sidebar
+        show_profile = st.checkbox("Show debug profile", value=False, key="show_profile")
+        track_memory = show_profile and st.checkbox("Track memory (slower)", value=False, key="track_memory")
+
+
+    # Every Map call is a no-op unless its inputs changed, so resubmitting only redoes what's needed
+    worker.submit({
+        "coefficients": coefficients,
+        "hub_height": hub_height,
+        "turbine": turbine,
+        "species_weights": species_weights,
+        "grid_size": resolution,
+        "time_window": time_window,
+        "site_search": st.session_state.site_search,
+        "subject": st.session_state.map_subject,
+        "header": st.session_state.map_header,
+        "render_mode": "image" if fast_render else "geojson",
+        "lookup": st.session_state.query_point,
+        "track_memory": track_memory,
+    })
+
+    # The last finished map stays up while a newer one is computed
+    if worker.busy:
+        show_progress(worker, 0 if result is None else result["generation"], error)
+    elif worker.result is not result or worker.error != error:
+        # Finished while this run was drawing the controls
+        st.rerun()
+    if result is None:
+        return
+
+    st.header(result["request"]["header"])
+
+    # Clicking a cell looks it up on the grid (a straight lat/lon -> cell index, no spatial join)
+    clicked = display_clickable_map(result["folium_map"], key="map_click")
+    if clicked is not None and clicked != st.session_state.query_point:
+        st.session_state.query_point = clicked
+        st.rerun()
+
+    cell = result["lookup"]
+    if cell is None:
+        st.caption("Click the map to see the values of a cell")
+    elif cell['cell'].iloc[0] < 0:
+        st.warning("That point is outside the grid")
+    else:
+        lat, lon = result["request"]["lookup"]
+        st.caption(f"Cell at {lat:.4f}, {lon:.4f}")
+        st.dataframe(cell, hide_index=True)
 
-        if PSOButton:
-            # TODO
-            # call function to find PSO
-            # update map with new folium map (1's and 0's)
-            pass
+    if result["sweep_table"] is not None:
+        st.caption("Share of all 100 x 100 bird/wind slider settings each site comes out best for")
+        st.dataframe(result["sweep_table"], hide_index=True)
 
-        
+    if show_profile:
+        with st.sidebar.expander("Stage profile", expanded=True):
+            display_profile(result["profile"])
@@ -0,0 +1,161 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from windwatch.core.map import Map
+from windwatch.core.profiling import print_hook
+
+
+class MapWorker:
+    ''' Runs a Map's updates on one background thread, so the page stays responsive while they run '''
+
+    '''
+    The page turns its widget values into a request dict and submits it. Requests run one at a
+    time in order, and only the latest one matters. A request that hasn't started yet is dropped
+    when a newer one arrives. A running one stops at its next step, which is always between two
+    Map calls, so the Map is never left half updated. The page keeps showing the result of the
+    last request that ran to the end until a newer one finishes.
+
+    attributes
+    - map: the Map (None until the build finishes), only used from the worker thread once the worker exists
+    - generation: id of the latest request, older ones stop at their next step
+    - latest_request: last request submitted, submitting an identical one again does nothing
+    - result: snapshot of the last finished request (its generation, folium map, tables, cell lookup, profile), None before
+      the first one. update_folium_map makes a new folium map rather than changing one, so the page can draw it from its thread
+    - info: what the page needs to draw its widgets (species, years, hub heights, ...), None until the map exists
+    - progress, label: share of the running request's steps that are done, and what it's working on
+    - stage: the last Map stage that finished (from a profiler hook)
+    - error: traceback of the last request that failed, None if it went through
+    '''
+
+    def __init__(self, map: Map = None, map_kwargs: dict = None):
+        ''' Wraps an existing Map, or builds one from Map(**map_kwargs) in the background '''
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="map-worker")
+        self.lock = threading.Lock()
+        self.future = None
+
+        self.map = map
+        self.generation = 0
+        self.latest_request = None
+        self.result = None
+        self.info = None
+        self.progress = 0.0
+        self.label = ""
+        self.stage = ""
+        self.error = None
+
+        if map is not None:
+            map.profiler.add_hook(self.__on_stage)
+            self.info = self.__info()
+        else:
+            self.label = "Building map"
+            self.future = self.executor.submit(self.__build, map_kwargs)
+
+    @property
+    def busy(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+    def submit(self, request: dict) -> bool:
+        ''' Queues a request (dropping any queued older one), returns False if it's the same as the last one '''
+        with self.lock:
+            if request == self.latest_request:
+                return False
+
+            self.latest_request = request
+            self.generation += 1
+
+            # Not started yet, so it can just be dropped. A running one notices the new generation itself
+            if self.future is not None:
+                self.future.cancel()
+            self.future = self.executor.submit(self.__run, self.generation, request)
+
+        return True
+
+    def __on_stage(self, record: dict):
+        ''' Profiler hook, so the page can show which Map stage just finished '''
+        self.stage = record['stage']
+
+    def __build(self, map_kwargs: dict):
+        kwargs = dict(map_kwargs)
+        hooks = kwargs.pop('profile_hooks', None)
+        try:
+            self.map = Map(**kwargs, profile_hooks=([print_hook] if hooks is None else list(hooks)) + [self.__on_stage])
+            self.info = self.__info()
+        except Exception:
+            self.error = traceback.format_exc()
+
+    def __run(self, generation: int, request: dict):
+        ''' Applies a request to the Map step by step, giving up as soon as a newer one comes in '''
+        map = self.map
+        self.error = None
+        map.profiler.reset()
+        map.profiler.track_memory = request['track_memory']
+
+        steps = [("Scoring", lambda: map.calculate_cost_value(request['coefficients']))]
+        if request['hub_height'] is not None:
+            steps.append(("Switching turbine", lambda: map.update_power_curve(request['hub_height'], request['turbine'])))
+        if request['species_weights']:
+            steps.append(("Weighting species", lambda: map.update_species_weights(request['species_weights'])))
+        steps.append(("Changing resolution", lambda: map.update_resolution(request['grid_size'])))
+        if request['time_window'] is not None:
+            steps.append(("Filtering sightings", lambda: map.update_time_window(**request['time_window'])))
+
+        if request['site_search']:
+            steps.append(("Finding best sites", lambda: map.find_best_sites(**request['site_search'])))
+        else:
+            steps.append(("Running PSO", lambda: map.run_pso()))
+
+        if request['subject'] == "pareto":
+            steps.append(("Finding the Pareto front", map.find_pareto_front))
+        elif request['subject'] == "robustness":
+            steps.append(("Sweeping coefficients", map.coefficient_sweep))
+
+        steps.append(("Drawing map", lambda: map.update_folium_map(request['subject'], render_mode=request['render_mode'])))
+
+        try:
+            for i, (label, step) in enumerate(steps):
+                if generation != self.generation:
+                    return
+                self.progress, self.label = i / len(steps), label
+                step()
+
+            result = {
+                'generation': generation,
+                'request': request,
+                'folium_map': map.folium_map,
+                'sweep_table': map.sweep_table if request['subject'] == "robustness" else None,
+                'lookup': map.get_cell_values(*request['lookup']) if request['lookup'] else None,
+                'profile': map.profiler.summary(),
+            }
+            info = self.__info()
+        except Exception:
+            if generation == self.generation:
+                self.error = traceback.format_exc()
+            return
+
+        # Only the latest request gets to replace what's on screen
+        with self.lock:
+            if generation == self.generation:
+                self.result, self.info = result, info
+                self.progress, self.label = 1.0, ""
+
+    def __info(self) -> dict:
+        ''' Plain copies of the Map attributes the page draws its widgets from '''
+        map = self.map
+        return {
+            'comName': map.comName,
+            'species': list(map.species),
+            'species_names': dict(map.species_names),
+            'species_weights': map.get_species_weights(),
+            'years': [int(year) for year in map.years],
+            'grid_size': map.grid_size,
+            'cells': len(map.gdf),
+            'adaptive': map.adaptive,
+            'min_grid_size': map.min_grid_size,
+            'hub_heights': list(map.hub_heights),
+            'hub_height': map.hub_height,
+            'turbines': list(map.turbines),
+            'turbine': map.turbine,
+            'exclusions': list(map.exclusions),
+            'coord_range': [map.lat_min, map.lat_max, map.lon_min, map.lon_max],
+        }
@@ -0,0 +1,225 @@
+'''
+Scaling benchmark for the Map pipeline.
+
+Generates synthetic sightings and a wind raster, then times every stage (grid build, bird risk,
+wind speed, cost value, PSO, site search, folium render and a full Map build) for each
+combination of sighting count and grid size, with the peak memory of each stage.
+
+Run from the repo root, e.g.
+    python -m benchmarks.bench_map --sightings 1000 100000 --grid-sizes 50000 5000 1000
+
+Timings only compare on the same machine, so no baseline is committed. Store one from the commit
+you want to compare against, then check later changes against it with the same arguments:
+    git checkout main && python -m benchmarks.bench_map --output benchmarks/baseline.json
+    git checkout my-branch && python -m benchmarks.bench_map --baseline benchmarks/baseline.json   # exits 1 on a regression
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+from core.datasets import read_points, read_raster_points
+from core.grid import Grid
+from core.kernels import bin_sightings, kernel_sum
+from core.map import Map
+from core.pso import run_pso
+from core.render import image_overlay_map
+from core.scoring import Scorer
+from core.sites import select_sites
+
+from .synthetic import WELLICOME_RANGE, make_sightings, make_wind_raster
+
+
+def measure(fn, memory: bool = True):
+    ''' Runs fn timed (wall and CPU), then once more under tracemalloc for its peak allocation '''
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = fn()
+    stats = {'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu}
+
+    if memory:
+        tracemalloc.start()
+        fn()
+        stats['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    return result, stats
+
+
+def normalize(values: np.ndarray) -> np.ndarray:
+    span = values.max() - values.min()
+    return (values - values.min()) / span if span else np.zeros_like(values)
+
+
+def run_case(sightings_path: str, wind_path: str, num_sightings: int, grid_size: int, args) -> list[dict]:
+    ''' All stages for one (sightings, grid size) combination '''
+    lat_min, lat_max, lon_min, lon_max = WELLICOME_RANGE
+    boundary = shapely.box(lon_min, lat_min, lon_max, lat_max)
+    case = f"sightings={num_sightings},grid={grid_size}"
+    rows = []
+
+    def record(stage, fn, skip_reason=None):
+        row = {'case': case, 'stage': stage, 'sightings': num_sightings, 'grid_size': grid_size}
+        if skip_reason:
+            rows.append({**row, 'status': 'skipped', 'reason': skip_reason})
+            print(f"{case:32} {stage:16} skipped ({skip_reason})")
+            return None
+        try:
+            result, stats = measure(fn, memory=not args.no_memory)
+        except MemoryError:
+            rows.append({**row, 'status': 'error', 'reason': 'MemoryError'})
+            print(f"{case:32} {stage:16} MemoryError")
+            return None
+        rows.append({**row, 'status': 'ok', 'cells': cells, **stats})
+        print(f"{case:32} {stage:16} {stats['wall_s']:9.4f} s" + (f" {stats['peak_mb']:9.1f} MB" if 'peak_mb' in stats else ""))
+        return result
+
+    def grid_build():
+        grid = Grid.from_boundary(boundary, grid_size)
+        grid.bounds
+        return grid, grid.to_gdf("EPSG:4326")
+
+    cells = 0
+    grid, grid_gdf = record('grid_build', grid_build)
+    cells = len(grid)
+
+    def bird_risk():
+        data = read_points(sightings_path, ['howMany'])
+        transformer = Transformer.from_crs("EPSG:4326", grid.crs, always_xy=True)
+        xy = np.column_stack(transformer.transform(data['lon'].to_numpy(np.float64), data['lat'].to_numpy(np.float64)))
+        # Same sighting squares the Map uses, so the pairs stop growing with the sighting count
+        positions, counts = bin_sightings(xy, data['howMany'].to_numpy(np.float64), args.sighting_bin_size)
+        return kernel_sum(cKDTree(positions), counts, cKDTree(grid.centroids), grid_size, args.bird_radius)
+
+    # Every occupied square pairs with every cell within the radius, skip combinations that can't fit in memory
+    squares = min(num_sightings, len(grid) * grid_size ** 2 / args.sighting_bin_size ** 2)
+    pairs = squares * np.pi * (args.bird_radius + grid_size) ** 2 / grid_size ** 2
+    bird = record('bird_risk', bird_risk, f"~{pairs:.1e} sighting/cell pairs" if pairs > args.max_pairs else None)
+
+    def wind_speed():
+        x, y, values = read_raster_points(wind_path, grid.crs)
+        sums, counts = grid.zonal_sum(grid.index_of(x, y), values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            wind = sums / counts
+        return np.where(np.isnan(wind), np.nanmin(wind), wind)
+
+    wind = record('wind_speed', wind_speed)
+
+    if bird is None:
+        bird = np.zeros(cells)
+    scorer = Scorer({'birdRisk': normalize(bird), 'windSpeed': normalize(wind)})
+    values = record('cost_value', lambda: scorer.score({'birdRisk': 50, 'windSpeed': 50}))
+    value_grid = values.reshape(grid.shape)
+
+    record('pso', lambda: run_pso(value_grid, seed=0))
+    record('site_search', lambda: select_sites(value_grid, k=10, min_spacing=10000 / grid_size))
+    record('folium_image', lambda: image_overlay_map(grid, value_grid, 'value').get_root().render())
+
+    def folium_geojson():
+        gdf = grid_gdf.copy()
+        gdf['value'] = values
+        return gdf.explore(column='value', cmap='YlOrRd', tooltip=True).get_root().render()
+
+    record('folium_geojson', folium_geojson, f"over {args.geojson_limit} cells" if cells > args.geojson_limit else None)
+
+    def map_build():
+        return Map(WELLICOME_RANGE, grid_size, sightings_path, wind_path,
+                   wind_speed_mode="raster", render_mode="image", base_grid_size=grid_size,
+                   sighting_bin_size=args.sighting_bin_size, profile_hooks=[])
+
+    record('map_build', map_build, "skipped with bird_risk" if pairs > args.max_pairs else None)
+
+    return rows
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float, min_delta: float) -> list[dict]:
+    ''' Stages that got slower than threshold x their baseline time (and by more than min_delta seconds) '''
+    with open(baseline_path) as f:
+        baseline = {(row['case'], row['stage']): row for row in json.load(f)['results'] if row['status'] == 'ok'}
+
+    regressions = []
+    for row in results:
+        base = baseline.get((row['case'], row['stage']))
+        if row['status'] != 'ok' or base is None:
+            continue
+        row['baseline_wall_s'] = base['wall_s']
+        row['ratio'] = row['wall_s'] / base['wall_s'] if base['wall_s'] else float('inf')
+        if row['ratio'] > threshold and row['wall_s'] - base['wall_s'] > min_delta:
+            regressions.append(row)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sightings', type=int, nargs='+', default=[1000, 100000], help="sighting counts (1k to 10M)")
+    parser.add_argument('--grid-sizes', type=int, nargs='+', default=[50000, 10000, 5000, 1000], help="cell sizes in meters")
+    parser.add_argument('--bird-radius', type=float, default=30000)
+    parser.add_argument('--sighting-bin-size', type=float, default=250, help="sightings are added up per square this size")
+    parser.add_argument('--format', choices=['parquet', 'jsonl'], default='parquet', help="synthetic sightings file format")
+    parser.add_argument('--data-dir', default=None, help="where to write the synthetic data (temp dir by default)")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', default=None, help="results file to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="slowdown ratio that counts as a regression")
+    parser.add_argument('--min-delta', type=float, default=0.005, help="ignore slowdowns smaller than this (seconds)")
+    parser.add_argument('--max-pairs', type=float, default=5e7, help="skip bird risk above this many square/cell pairs")
+    parser.add_argument('--geojson-limit', type=int, default=100000, help="skip the geojson render above this many cells")
+    parser.add_argument('--no-memory', action='store_true', help="don't measure peak memory (halves the run time)")
+    args = parser.parse_args(argv)
+
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline at {args.baseline}, create one first with --output {args.baseline}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        wind_path = make_wind_raster(os.path.join(data_dir, "wind.tif"))
+
+        results = []
+        for num_sightings in args.sightings:
+            sightings_path = os.path.join(data_dir, f"sightings_{num_sightings}.{args.format}")
+            if not os.path.exists(sightings_path):
+                make_sightings(num_sightings, sightings_path)
+
+            for grid_size in args.grid_sizes:
+                results += run_case(sightings_path, wind_path, num_sightings, grid_size, args)
+
+    output = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold, args.min_delta)
+        output['baseline'] = args.baseline
+        output['regressions'] = [(row['case'], row['stage']) for row in regressions]
+
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"results written to {args.output}")
+
+    for row in regressions:
+        print(f"REGRESSION {row['case']} {row['stage']}: {row['wall_s']:.4f} s vs {row['baseline_wall_s']:.4f} s ({row['ratio']:.2f}x)")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
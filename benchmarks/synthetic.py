@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+
+
+''' Synthetic inputs shaped like the processed eBird and Global Wind Atlas data, at any size '''
+
+WELLICOME_RANGE = [49.0000, 52.833333, -114.0000, -110.0000]
+
+FERRUGINOUS_HAWK = ("ferhaw", "Ferruginous Hawk", "Buteo regalis")
+
+
+def make_sightings(num_sightings: int,
+                   output_path: str,
+                   coord_range: list[float] = WELLICOME_RANGE,
+                   num_hotspots: int = 200,
+                   seed: int = 0,
+                   chunk_size: int = 1_000_000,
+                   species: list[tuple[str, str, str]] = [FERRUGINOUS_HAWK]) -> str:
+    '''
+    Writes num_sightings processed-schema sightings (.jsonl or .parquet) and returns the path.
+    Most sightings are clustered around random hotspots like real eBird data, the rest are uniform.
+    species is a list of (speciesCode, comName, sciName), each sighting gets one of them at random.
+    Written chunk_size rows at a time, so 10M sightings don't need 10M rows in memory.
+    '''
+    from data_prep.process_data import BIRD_DTYPES, ProcessedWriter
+
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lon_min, lon_max = coord_range
+    hotspots = np.column_stack([rng.uniform(lat_min, lat_max, num_hotspots), rng.uniform(lon_min, lon_max, num_hotspots)])
+    dates = pd.date_range("2015-03-01", "2024-10-31", freq="D")
+    dates = dates[(dates.month >= 3) & (dates.month <= 10)].strftime("%Y-%m-%d %H:%M").to_numpy()
+
+    with ProcessedWriter(output_path, BIRD_DTYPES, lat_band=0.05) as writer:
+        for start in range(0, num_sightings, chunk_size):
+            n = min(chunk_size, num_sightings - start)
+
+            # 80% within ~10 km of a hotspot, 20% anywhere in the box
+            clustered = rng.random(n) < 0.8
+            centre = hotspots[rng.integers(0, num_hotspots, n)]
+            lat = np.where(clustered, centre[:, 0] + rng.normal(0, 0.09, n), rng.uniform(lat_min, lat_max, n))
+            lon = np.where(clustered, centre[:, 1] + rng.normal(0, 0.13, n), rng.uniform(lon_min, lon_max, n))
+            inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+
+            no_count = rng.random(n) < 0.1
+            code, com_name, sci_name = np.array(species)[rng.integers(0, len(species), n)].T
+            writer.write(pd.DataFrame({
+                "speciesCode": code,
+                "comName": com_name,
+                "sciName": sci_name,
+                "obsDt": dates[rng.integers(0, len(dates), n)],
+                "howMany": np.where(no_count, 1, rng.geometric(0.6, n)),
+                "noCount": no_count.astype(int),
+                "lat": lat,
+                "lon": lon,
+            })[inside])
+
+    return output_path
+
+
+def make_wind_raster(output_path: str,
+                     coord_range: list[float] = WELLICOME_RANGE,
+                     resolution: float = 0.01,
+                     seed: int = 0) -> str:
+    '''
+    Writes a float32 EPSG:4326 GeoTIFF like the one process_wind_speed_data produces (smooth field
+    plus noise, m/s) and returns the path. Map's "raster" wind mode reads it directly.
+    '''
+    rng = np.random.default_rng(seed)
+    lat_min, lat_max, lon_min, lon_max = coord_range
+    width = int(np.ceil(round((lon_max - lon_min) / resolution, 6)))
+    height = int(np.ceil(round((lat_max - lat_min) / resolution, 6)))
+
+    y, x = np.mgrid[0:height, 0:width] / max(height, width)
+    wind = 6 + 1.5 * np.sin(6 * x) * np.cos(4 * y) + 0.3 * rng.standard_normal((height, width))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with rasterio.open(output_path, "w", driver="GTiff", dtype="float32", count=1, width=width, height=height,
+                       crs="EPSG:4326", transform=from_origin(lon_min, lat_max, resolution, resolution)) as dst:
+        dst.write(wind.astype(np.float32), 1)
+
+    return output_path
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+
+CACHE_VERSION = 5  # bump when the stored layout changes, so old entries are never read
+
+
+class LayerCache:
+    ''' Content-addressed on-disk store of computed Map layers '''
+
+    '''
+    Each entry is a directory named after its key holding one .npy file per array plus a
+    meta.json, so arrays can be memory-mapped on load instead of read and parsed.
+    Once the total size goes over max_bytes the least recently used entries are deleted.
+
+    attributes
+    - cache_dir: directory holding the entries
+    - max_bytes: size bound for all entries together
+    '''
+
+    def __init__(self, cache_dir: str, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+        ''' Hash of a file's contents (not its name or mtime) '''
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def make_key(self, input_paths: list[str], **params) -> str:
+        ''' Key from the input file contents plus every parameter that changes the result '''
+        payload = {
+            "version": CACHE_VERSION,
+            "inputs": [self.file_hash(path) for path in input_paths],
+            "params": params,
+        }
+        return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=20).hexdigest()
+
+    def load(self, key: str) -> tuple[dict[str, np.ndarray], dict] | None:
+        ''' Memory-mapped arrays and metadata of an entry, or None on a miss '''
+        entry = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+        arrays = {name: np.load(os.path.join(entry, f"{name}.npy"), mmap_mode="r") for name in meta["arrays"]}
+
+        # Touch it so eviction sees it as recently used
+        os.utime(meta_path)
+
+        return arrays, meta
+
+    def save(self, key: str, arrays: dict[str, np.ndarray], meta: dict) -> None:
+        ''' Writes an entry (atomically, so a crash never leaves a half written one) and evicts old ones '''
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry):
+            return
+
+        tmp = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({**meta, "arrays": list(arrays.keys()), "created": time.time()}, f)
+
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process saved the same key first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self) -> None:
+        ''' Deletes least recently used entries until the cache fits in max_bytes '''
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, name, "meta.json")
+            if name.startswith(".") or not os.path.exists(meta_path):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            entries.append((os.path.getmtime(meta_path), size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
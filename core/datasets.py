@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import rasterio
+from pyproj import Transformer
+
+
+def bbox_with_margin(coord_range: list[float], margin: float = 0) -> list[float]:
+    ''' Grows [lat_min, lat_max, lon_min, lon_max] by margin meters on every side (approximate, in degrees) '''
+    lat_min, lat_max, lon_min, lon_max = coord_range
+    dlat = margin / 111_320
+    dlon = margin / (111_320 * np.cos(np.radians(max(abs(lat_min), abs(lat_max)))))
+    return [lat_min - dlat, lat_max + dlat, lon_min - dlon, lon_max + dlon]
+
+
+def read_points(path: str, columns: list[str], coord_range: list[float] = None) -> pd.DataFrame:
+    '''
+    Loads a processed dataset (.parquet or .jsonl) with lat/lon columns, keeping only the given
+    columns and the rows inside coord_range [lat_min, lat_max, lon_min, lon_max].
+
+    For Parquet only the requested columns are decoded and the bounding box is pushed down to
+    the reader, so row groups outside it are skipped entirely.
+    '''
+    columns = list(dict.fromkeys(columns + ['lat', 'lon']))
+
+    if path.endswith(".parquet"):
+        filters = None
+        if coord_range is not None:
+            lat_min, lat_max, lon_min, lon_max = coord_range
+            filters = [
+                ('lat', '>=', lat_min), ('lat', '<=', lat_max),
+                ('lon', '>=', lon_min), ('lon', '<=', lon_max),
+            ]
+        return pd.read_parquet(path, engine="pyarrow", columns=columns, filters=filters)
+
+    data = pd.read_json(path, lines=True)[columns]
+    if coord_range is not None:
+        lat_min, lat_max, lon_min, lon_max = coord_range
+        data = data[
+            (data['lat'] >= lat_min) & (data['lat'] <= lat_max) &
+            (data['lon'] >= lon_min) & (data['lon'] <= lon_max)
+        ]
+    return data.reset_index(drop=True)
+
+
+def read_raster_points(tif_path: str, crs) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ''' Pixel centres of a single band raster projected to crs, and their values (NaN pixels dropped) '''
+    with rasterio.open(tif_path) as src:
+        band = src.read(1).astype(np.float64)
+        transform = src.transform
+        src_crs = src.crs
+
+    # Pixel centres straight from the affine transform
+    rows, cols = np.indices(band.shape)
+    xs, ys = transform * (cols.ravel() + 0.5, rows.ravel() + 0.5)
+
+    values = band.ravel()
+    valid = ~np.isnan(values)
+
+    transformer = Transformer.from_crs(src_crs, crs, always_xy=True)
+    x, y = transformer.transform(xs[valid], ys[valid])
+
+    return np.asarray(x), np.asarray(y), values[valid]
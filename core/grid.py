@@ -0,0 +1,211 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from functools import cached_property
+from pyproj import CRS, Transformer
+from shapely.geometry import Polygon
+
+
+UTM_MAX_OFFSET = 6  # degrees from the zone's central meridian a region can reach and still use UTM
+
+
+def region_crs(boundary: Polygon) -> CRS:
+    '''
+    Meters-based crs for one lattice over a WGS84 region: its UTM zone if the region stays within
+    UTM_MAX_OFFSET degrees of that zone's central meridian (scale error under ~0.3%), otherwise an
+    Albers equal-area projection centred on the region, so provinces or countries still get one grid
+    instead of a UTM zone stretched far past its edges.
+    '''
+    lon_min, lat_min, lon_max, lat_max = boundary.bounds
+    utm = gpd.GeoSeries([boundary], crs="EPSG:4326").estimate_utm_crs()
+
+    central_meridian = 6 * int(utm.utm_zone[:-1]) - 183
+    if max(abs(lon_min - central_meridian), abs(lon_max - central_meridian)) <= UTM_MAX_OFFSET:
+        return utm
+
+    # Standard parallels at 1/6 and 5/6 of the latitude range keep the scale error smallest
+    span = lat_max - lat_min
+    return CRS.from_dict({
+        'proj': 'aea',
+        'lat_0': (lat_min + lat_max) / 2,
+        'lon_0': (lon_min + lon_max) / 2,
+        'lat_1': lat_min + span / 6,
+        'lat_2': lat_max - span / 6,
+        'datum': 'WGS84',
+        'units': 'm',
+    })
+
+
+class Grid:
+    ''' Regular square lattice in a projected (UTM) coordinate system '''
+
+    '''
+    attributes
+    - crs: projected CRS the lattice is defined in (meters)
+    - xmin, ymin: lower left corner of the first cell
+    - size: side length of each square in meters
+    - rows, cols: number of cells along y and x
+    - bounds: (rows * cols, 4) array of [minx, miny, maxx, maxy] per cell
+    - centroids: (rows * cols, 2) array of [x, y] per cell
+    - from_wgs84, to_wgs84: lon/lat <-> lattice crs transformers
+
+    Cells are numbered row by row starting at the south-west corner, so
+    index = row * cols + col. This is the same order as the Map gdf index.
+    '''
+
+    def __init__(self, crs, xmin: float, ymin: float, xmax: float, ymax: float, size: int):
+        self.crs = crs
+        self.xmin = float(xmin)
+        self.ymin = float(ymin)
+        self.size = size
+
+        # Same number of steps as np.arange(min, max, size), so the last partial row/col is still covered
+        self.cols = max(int(np.ceil((xmax - xmin) / size)), 1)
+        self.rows = max(int(np.ceil((ymax - ymin) / size)), 1)
+
+    @classmethod
+    def from_boundary(cls, boundary: Polygon, size: int, crs=None):
+        ''' Builds the lattice covering a WGS84 boundary, in region_crs(boundary) unless a crs is given '''
+        if crs is None:
+            crs = region_crs(boundary)
+
+        # Edges are densified first, parallels are curved once projected so the corners alone miss a sliver.
+        # Densifying the bounding box rather than the polygon itself, since a self-crossing ring (like Map's
+        # boundary, whose corners aren't in ring order) loses a corner in segmentize
+        box = shapely.box(*boundary.bounds)
+        boundary_gdf = gpd.GeoDataFrame(geometry=[shapely.segmentize(box, 0.05)], crs="EPSG:4326")
+        xmin, ymin, xmax, ymax = boundary_gdf.to_crs(crs).total_bounds
+        return cls(crs, xmin, ymin, xmax, ymax, size)
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    @property
+    def shape(self):
+        return (self.rows, self.cols)
+
+    @property
+    def xmax(self):
+        return self.xmin + self.cols * self.size
+
+    @property
+    def ymax(self):
+        return self.ymin + self.rows * self.size
+
+    @cached_property
+    def bounds(self) -> np.ndarray:
+        x0 = self.xmin + np.arange(self.cols) * self.size
+        y0 = self.ymin + np.arange(self.rows) * self.size
+        # indexing='ij' keeps y as the outer (row) dimension
+        yy, xx = np.meshgrid(y0, x0, indexing='ij')
+
+        bounds = np.empty((len(self), 4), dtype=np.float64)
+        bounds[:, 0] = xx.ravel()
+        bounds[:, 1] = yy.ravel()
+        bounds[:, 2] = bounds[:, 0] + self.size
+        bounds[:, 3] = bounds[:, 1] + self.size
+        return bounds
+
+    @cached_property
+    def centroids(self) -> np.ndarray:
+        return (self.bounds[:, :2] + self.bounds[:, 2:]) / 2
+
+    def window(self, row_start: int, row_stop: int, col_start: int, col_stop: int):
+        ''' Grid of a rectangular block of this one's cells (same crs and lattice), e.g. one tile '''
+        sub = Grid(self.crs, self.xmin + col_start * self.size, self.ymin + row_start * self.size,
+                   self.xmin + col_stop * self.size, self.ymin + row_stop * self.size, self.size)
+        sub.rows, sub.cols = row_stop - row_start, col_stop - col_start
+        return sub
+
+    def coarsen(self, factor: int):
+        ''' Grid with cells factor times bigger, sharing the same south-west corner '''
+        coarse = Grid(self.crs, self.xmin, self.ymin, self.xmax, self.ymax, self.size * factor)
+        # Set exactly (not through float division) so block_sum output always lines up
+        coarse.rows = -(-self.rows // factor)
+        coarse.cols = -(-self.cols // factor)
+        return coarse
+
+    def to_gdf(self, crs="EPSG:4326") -> gpd.GeoDataFrame:
+        ''' Creates one polygon per cell (in a single vectorized call) and projects them to crs '''
+        cells = shapely.box(*self.bounds.T)
+        gdf = gpd.GeoDataFrame(geometry=cells, crs=self.crs)
+        if crs is not None:
+            gdf = gdf.to_crs(crs)
+        return gdf
+
+    def index_of(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        ''' Flat cell index of each projected (x, y) point, -1 where the point falls outside the lattice '''
+        col = np.floor((np.asarray(x) - self.xmin) / self.size)
+        row = np.floor((np.asarray(y) - self.ymin) / self.size)
+        # Compared as floats so NaN/inf (points the projection can't handle) just count as outside
+        inside = (col >= 0) & (col < self.cols) & (row >= 0) & (row < self.rows)
+        return np.where(inside, row * self.cols + col, -1).astype(np.int64)
+
+    @cached_property
+    def from_wgs84(self) -> Transformer:
+        return Transformer.from_crs("EPSG:4326", self.crs, always_xy=True)
+
+    @cached_property
+    def to_wgs84(self) -> Transformer:
+        return Transformer.from_crs(self.crs, "EPSG:4326", always_xy=True)
+
+    def project(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        ''' Projects WGS84 lat/lon arrays to the lattice crs (x, y) '''
+        x, y = self.from_wgs84.transform(np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64))
+        return np.asarray(x), np.asarray(y)
+
+    def cell_of(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        (row, col, index) of the cell under each WGS84 point, in one projection + affine step.
+        All three are -1 for points outside the lattice.
+        '''
+        index = self.index_of(*self.project(lat, lon))
+        row, col = self.row_col(index)
+        return row, col, index
+
+    def row_col(self, index: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        ''' (row, col) of flat cell indices, -1 stays -1 '''
+        index = np.asarray(index, dtype=np.int64)
+        row, col = np.divmod(index, self.cols)
+        outside = index < 0
+        return np.where(outside, -1, row), np.where(outside, -1, col)
+
+    def centre_of(self, index: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        ''' WGS84 (lat, lon) of the centre of each flat cell index (NaN for -1) '''
+        row, col = self.row_col(index)
+        outside = row < 0
+        x = np.where(outside, np.nan, self.xmin + (col + 0.5) * self.size)
+        y = np.where(outside, np.nan, self.ymin + (row + 0.5) * self.size)
+        lon, lat = self.to_wgs84.transform(x, y)
+        return np.asarray(lat), np.asarray(lon)
+
+    def zonal_sum(self, index: np.ndarray, values: np.ndarray,
+                  bins: np.ndarray = None, num_bins: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Per-cell sum and count of values, given each value's flat cell index (-1 is dropped).
+        With bins (e.g. the month of each value) they're (cells, num_bins) instead of (cells,).
+        '''
+        keep = index >= 0
+        if bins is None:
+            sums = np.bincount(index[keep], weights=values[keep], minlength=len(self))
+            counts = np.bincount(index[keep], minlength=len(self))
+            return sums, counts
+
+        flat = index[keep] * num_bins + bins[keep]
+        sums = np.bincount(flat, weights=values[keep], minlength=len(self) * num_bins)
+        counts = np.bincount(flat, minlength=len(self) * num_bins)
+        return sums.reshape(len(self), num_bins), counts.reshape(len(self), num_bins)
+
+
+def block_sum(values: np.ndarray, factor: int) -> np.ndarray:
+    ''' Sums factor x factor blocks of a (rows, cols, ...) array, zero-padding the last partial blocks '''
+    if factor == 1:
+        return values
+
+    rows, cols = values.shape[:2]
+    coarse_rows, coarse_cols = -(-rows // factor), -(-cols // factor)
+
+    padded = np.zeros((coarse_rows * factor, coarse_cols * factor) + values.shape[2:], dtype=values.dtype)
+    padded[:rows, :cols] = values
+
+    return padded.reshape(coarse_rows, factor, coarse_cols, factor, *values.shape[2:]).sum(axis=(1, 3))
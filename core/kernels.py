@@ -0,0 +1,123 @@
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+
+''' Distance-decay kernels, all equal to 1 at distance 0 and cut off at the radius '''
+KERNELS = {
+    "disc": lambda d, radius: np.ones_like(d),                   # flat circle (Watson 2020 style buffer)
+    "linear": lambda d, radius: 1 - d / radius,                   # cone
+    "gaussian": lambda d, radius: np.exp(-4.5 * (d / radius) ** 2),  # sigma = radius / 3
+}
+
+
+def kernel_weights(d: np.ndarray, radius: float, kernel: str = "disc") -> np.ndarray:
+    ''' Kernel value for each distance d (meters), 0 beyond the radius '''
+    assert kernel in KERNELS, f"Unknown kernel '{kernel}', expected one of {list(KERNELS)}"
+    weights = KERNELS[kernel](d, radius)
+    return np.where(d <= radius, weights, 0.0)
+
+
+def bin_sightings(xy: np.ndarray, counts: np.ndarray, bin_size: float = None,
+                  bins: np.ndarray = None, num_bins: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Adds up the sightings in each bin_size square (lattice anchored at the crs origin) and puts
+    them at their count-weighted centre, so kernel_sum pairs occupied squares with cells instead of
+    every sighting with every cell. The pairs then stop growing with the number of sightings once the
+    squares fill up, for at most bin_size * sqrt(2) of error in a sighting's distance (none for a
+    square whose sightings are all at one spot, like a hotspot). With no bin_size only sightings at
+    exactly the same spot are merged, which changes nothing.
+
+    :return: (squares, 2) positions of the occupied squares, and their summed counts, (squares,) or a
+             sparse (squares, num_bins) matrix if bins are given (kernel_sum takes either as counts)
+    '''
+    if bin_size is None:
+        centres, square = np.unique(np.asarray(xy, dtype=np.float64), axis=0, return_inverse=True)
+    else:
+        squares, square = np.unique(np.floor(np.asarray(xy) / bin_size).astype(np.int64), axis=0, return_inverse=True)
+        square = square.ravel()
+        # Weighted by count, plain mean for squares whose counts add up to 0
+        total = np.bincount(square, weights=counts, minlength=len(squares))
+        weights = np.where(total[square] > 0, counts, 1.0)
+        centres = np.column_stack([np.bincount(square, weights=weights * xy[:, axis], minlength=len(squares))
+                                   for axis in (0, 1)])
+        centres /= np.bincount(square, weights=weights, minlength=len(squares))[:, np.newaxis]
+    square = square.ravel()
+
+    if bins is None:
+        return centres, np.bincount(square, weights=counts, minlength=len(centres))
+
+    binned = sparse.coo_matrix((counts, (square, bins)), shape=(len(centres), num_bins)).tocsr()
+    binned.sum_duplicates()
+    return centres, binned
+
+
+def kernel_sum(sightings_tree: cKDTree,
+               counts: np.ndarray,
+               cells_tree: cKDTree,
+               cell_size: float,
+               radius: float,
+               kernel: str = "disc",
+               bins: np.ndarray = None,
+               num_bins: int = 1,
+               max_pairs: int = 5_000_000) -> np.ndarray:
+    '''
+    Kernel-weighted sum of sighting counts around every cell.
+
+    The distance used is from the sighting to the closest point of the (square) cell, so the
+    "disc" kernel counts exactly the sightings whose radius circle touches the cell, like
+    buffering each sighting and intersecting it with the grid used to. That holds for the positions
+    it's given, squares from bin_sightings with a bin_size are only within bin_size * sqrt(2) of
+    their sightings.
+
+    Sightings are paired with cells a chunk at a time, sized so a chunk has about max_pairs
+    (sighting, cell) pairs, so memory stays flat however many sightings and cells there are.
+
+    :param sightings_tree: KD-tree of sighting (x, y) positions in the grid crs
+    :param counts: howMany of each sighting, same order as the tree data, or a (sightings, num_bins)
+                   array/sparse matrix of counts per bin (e.g. from bin_sightings) instead of bins
+    :param cells_tree: KD-tree of cell centroids
+    :param cell_size: side length of each cell in meters
+    :param bins: optional bin (e.g. month) of each sighting, the sums are then kept apart per bin
+    :return: array with one value per cell, in the same order as cells_tree.data,
+             or (cells, num_bins) if bins (or 2D counts) are given (summing over the bins gives the plain result)
+    '''
+    half = cell_size / 2
+    max_distance = radius + half * np.sqrt(2)
+
+    if bins is not None:
+        counts = sparse.csr_matrix((counts, (np.arange(len(counts)), bins)), shape=(len(counts), num_bins))
+    binned = np.ndim(counts) == 2
+    out = np.zeros((cells_tree.n, counts.shape[1]) if binned else cells_tree.n)
+
+    # Cells one sighting can reach at most, which sets how many sightings fit in a chunk
+    reach = max(np.pi * max_distance ** 2 / cell_size ** 2, 1)
+    step = max(int(max_pairs // reach), 1)
+
+    for start in range(0, sightings_tree.n, step):
+        tree = sightings_tree if step >= sightings_tree.n else cKDTree(sightings_tree.data[start:start + step])
+        chunk = counts[start:start + step]
+
+        # Every (sighting, cell) pair whose centroids are close enough that the circle could reach the cell
+        pairs = tree.sparse_distance_matrix(cells_tree, max_distance=max_distance, output_type='ndarray')
+        s, c = pairs['i'], pairs['j']
+
+        # Distance from the sighting to the nearest edge of the cell (0 if it's inside)
+        offset = np.abs(tree.data[s] - cells_tree.data[c]) - half
+        d = np.hypot(*np.clip(offset, 0, None).T)
+
+        weights = kernel_weights(d, radius, kernel)
+        if not binned:
+            out += np.bincount(c, weights=chunk[s] * weights, minlength=cells_tree.n)
+            continue
+
+        # (cells, sightings) kernel weights times (sightings, bins) counts, so each pair is touched once
+        # however many bins there are, and only the bins a sighting actually has count
+        sums = sparse.csr_matrix((weights, (c, s)), shape=(cells_tree.n, tree.n)) @ chunk
+        if sparse.issparse(sums):
+            sums = sums.tocoo()
+            out[sums.row, sums.col] += sums.data
+        else:
+            out += sums
+
+    return out
@@ -1,9 +1,30 @@
+import math
+import tempfile
 import geopandas as gpd
 import numpy as np
 from shapely.geometry import Polygon, Point
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
 import branca.colormap as cm
+from pyproj import CRS
+import shapely
+from scipy.spatial import cKDTree
+
+from .cache import LayerCache
+from .datasets import read_points, read_raster_points, bbox_with_margin
+from .grid import Grid, block_sum
+from .pyramid import LayerPyramid
+from .kernels import kernel_sum, bin_sightings
+from .tiling import tiled_kernel_sum, tiled_centre_kernel_sum
+from .timewindow import month_prefix, window_sum
+from .scoring import Scorer
+from .power import TURBINES, PowerCurve, capacity_factors
+from .masks import polygon_mask, slope_mask
+from .quadtree import Quadtree, refine
+from .profiling import StageProfiler, print_hook
+from .pso import run_pso
+from .render import image_overlay_map
+from .sites import select_sites
 
 
 
@@ -12,23 +33,91 @@ class Map:
 
     ''' 
     attributes 
-    - gdf: GeoDataFrame itself
+    - gdf: GeoDataFrame itself (a plain DataFrame of the same columns until the geometry is needed, see level_geometry)
     - coord_range: list of coordinates [lat_min, lat_max, lon_min, lon_max]
     - boundary: shapely polygon representing the outside edges/corners
     - grid_size: side length of each square in meters
-    - bird_risk_gdf: contains the circles around bird observations (only updated if radius changes)
+    - sightings_xy, sightings_count: bird observation positions (grid crs) and counts as numpy arrays
+    - species, species_names: species codes in the sighting data (sorted) and their common names
+    - sightings_species: index into species of each sighting
+    - species_weights: species code -> sensitivity weight used to combine the per-species risk (1 by default)
+    - species_risk: (cells, species) risk of each species for the current time window, before weighting
+    - sightings_bin: month bin of each sighting, (year - years[0]) * 12 + month - 1, or len(years) * 12 if it has no date
+    - years: the years the sightings span, the time cube has len(years) * 12 month bins plus one for undated sightings
+    - bird_risk_prefix: (cells, species, years + 1, 13) cumulative sums of the kernel spread risk over years
+      and months, so the risk for any time window is a few array lookups per cell (see core/timewindow.py).
+      When tiled it's a np.memmap on a temp file, filled a tile at a time
+    - bird_risk_undated: (cells, species) risk from sightings without a usable date, only counted when there's no time window
+    - time_window: None (all sightings) or {'months': (first, last), 'years': (first, last)}, both inclusive
+    - sighting_bin_size: optional, sightings are added up per square of this many meters (at their count-weighted centre)
+      before the kernel pairs them with cells, so its cost stops growing with the number of sightings, for up to
+      sighting_bin_size * sqrt(2) of error in each distance. None (the default) only merges identical spots, which is exact
+    - sighting_positions, sighting_bin_counts, sighting_totals: centres of the occupied squares, their (squares, species * time bins)
+      sparse counts and their total counts, see kernels.bin_sightings
+    - sightings_tree, cells_tree: KD-trees over sighting_positions and the cell centroids, reused when the radius changes
+    - bird_radius, bird_kernel: distance (meters) and decay kernel used to spread each sighting's risk
+    - tile_cells, num_workers: if tile_cells is set, bird risk is computed in tiles of that many cells a side
+      with halos, spread over num_workers processes (see core/tiling.py). Each tile's species x month risk goes
+      straight into bird_risk_prefix on disk, so only one tile's worth is ever in memory and what's left in RAM
+      is a few values per cell. Adaptive grids are always tiled (64 fine cells a side by default), in this process
     - wind_speed_gdf: contains the wind speed observation points (shouldn't have to be updated)
+    - wind_speed_mode: "sjoin" joins the jsonl points to the cells, "raster" bins the processed GeoTIFF pixels directly.
+      They only disagree on the pixels within a few cm of a cell edge, so on the Wellicome box 5 km cells differ by at
+      most ~0.01 normalized and 1 km cells (about one pixel each) by up to the whole range in under 0.1% of cells
+    - wind_speed_pixels: (x, y, windSpeed) arrays of the wind points/pixel centres in the grid's crs
+    - hub_height_paths: hub height (m) -> processed wind raster for that height (see get_wind_speed_data), empty for no power layer
+    - hub_heights, turbines: the heights in hub_height_paths (sorted) and turbine name -> PowerCurve (core/power.py)
+    - hub_height, turbine: the combination shown in the 'power' column and used for scoring
+    - weibull_k: shape of the wind speed distribution assumed around each cell's mean
+    - capacity_factors: (hub heights, cells, turbines) expected capacity factor of every combination
+    - hub_wind_sum, hub_wind_count: (cells, hub heights) wind totals at the current grid_size
+    - exclusions: name -> (rows, cols) bool mask on the pyramid's base grid, True where nothing can be built
+    - excluded: (cells,) bool array at the current grid_size (a cell is out when most of it is excluded), None if no masks
     - output_path: path to store the output GeoDataFrame
+    - grid: Grid describing the lattice behind the gdf (rows, cols, cell_bounds and cell_centroids come from it),
+      in the region's UTM zone, or an equal-area projection for regions too wide for one zone (see grid.region_crs).
+      In adaptive mode it's a Quadtree instead, the gdf has one row per leaf and rows, cols are its fine grid's
+    - adaptive: grid_size is the coarsest cell size, and cells are only split down to min_grid_size (a power of 2
+      times smaller) where birdRisk or windSpeed at one of a cell's 4 children differs from the cell's own by more
+      than refine_threshold of their range, where the wind of the fine cells inside it spreads (standard deviation) by more than
+      that, or where a cell has more than refine_sightings sightings (see core/quadtree.py). The leaves are picked when
+      a grid_size is first used, from the total risk of all sightings, and kept when the radius, time window or weights change.
+      The gdf and scoring have one row per leaf, value_grid, batch_cost_values and the image render are still fine-grid rasters
+    - quadtrees: cache of grid_size -> Quadtree in adaptive mode
+    - pyramid: LayerPyramid of sighting counts and wind sums/counts binned on the base_grid_size grid
+    - sighting_counts, wind_sum, wind_count: those totals at the current grid_size, one value per cell
+    - level_geometry: grid_size -> WGS84 cell polygons, only built once something needs them (the geojson render,
+      the wind sjoin, saving the gdf), see __add_geometry. Until then the gdf has no geometry column
     - folium: folium map object
+    - cache: LayerCache the computed layers are saved to/loaded from (None if no cache_dir)
+    - versions, stage_keys: dirty tracking, see __is_fresh/__mark_computed
+    - folium_html: rendered folium_map, reused until the map changes
+    - scorer: Scorer holding the normalized layers as one numpy array (None until needed)
+    - value_grid: (rows, cols) array of the current 'value' column, used by the site search (leaves painted on the fine grid in adaptive mode)
+    - sweep_table: DataFrame of the sites coefficient_sweep found, one row per site
+    - profiler: StageProfiler timing every stage below (wall/CPU time, memory, rows), see core/profiling.py
 
     methods
     - __init__: constructor
     - __generate_map: generates the initial map from coordinates and data
-    TODO - update_resolution: regenerates the map with a new grid_size
-    TODO - update_coefficient: updates the cost function and the map's 'value' attribute
-    TODO - find_best_locations: does the PSO to find good locations for a wind farm
-    TODO - get gdf index from coordinate
+    - update_bird_radius: recomputes birdRisk for a new radius/kernel without rebuilding anything
+    - update_time_window: birdRisk from only the sightings in some months/years, straight from the time cube
+    - update_species_weights: recombines the per-species risk with new weights (no spatial recomputation)
+    - update_resolution: switches to a new grid_size using the pyramid (no raw data re-read)
+    - update_power_curve: switches the hub height/turbine behind the 'power' column (no recomputation)
+    - add_protected_areas, add_slope_limit, add_exclusion: masks cells out of scoring and site search
+      (no bird/wind recomputation), remove_exclusion takes one away again
+    - calculate_cost_value: updates the coefficients and the map's 'value' attribute
+    - batch_cost_values: value grids for many coefficient pairs at once
+    - run_pso: vectorized (optionally seeded, multi-swarm) PSO for the best location on value_grid
+    - find_best_sites: exact top-k cells with a minimum spacing, fills the same 'pso' column
+    - find_pareto_front: cells no other cell beats on every scored layer, fills the 'pareto' column
+    - coefficient_sweep: best site for every coefficient pair at once, fills the 'robustness' column
+    - get_cell_index: (row, col, gdf index) of batches of lat/lon points, no spatial join
+    - get_cell_centre: lat/lon of the centre of gdf indices
+    - get_cell_values: the gdf rows under batches of lat/lon points
     TODO - The gdfs of each data source should be stored for recalculation with tuning
+    - get_folium_html: cached HTML of the folium map
     - Plus getters
     '''
 
@@ -37,6 +126,24 @@ class Map:
                  bird_data_path: str, 
                  wind_speed_data_path: str, 
                  output_path = None,  
+                 wind_speed_mode: str = "sjoin",
+                 bird_kernel: str = "disc",
+                 base_grid_size: int = 1000,
+                 render_mode: str = "geojson",
+                 cache_dir: str = None,
+                 profile_hooks: list = None,
+                 track_memory: bool = False,
+                 species_weights: dict = None,
+                 tile_cells: int = None,
+                 num_workers: int = None,
+                 sighting_bin_size: float = None,
+                 hub_height_paths: dict[int, str] = None,
+                 turbines: dict[str, PowerCurve] = None,
+                 weibull_k: float = 2.0,
+                 adaptive: bool = False,
+                 min_grid_size: int = None,
+                 refine_threshold: float = 0.05,
+                 refine_sightings: float = 100,
                  *args, **kwargs):
         # Generates a GeoDataFrame from boundary coordinates, grid size, data, and 
         self.coord_range = coord_range
@@ -49,15 +156,60 @@ class Map:
             (self.lon_min, self.lat_min)
         ])
         self.grid_size = grid_size
+        self.base_grid_size = base_grid_size  # finest pyramid level, grid sizes that are multiples of it are cheap
         self.output_path = output_path
+        self.wind_speed_mode = wind_speed_mode  # "sjoin" (jsonl points) or "raster" (processed GeoTIFF)
         self.folium_map = None
+        self.cache = LayerCache(cache_dir) if cache_dir else None  # computed layers, keyed by input hashes + parameters
+        self.render_mode = render_mode  # "geojson" (one polygon per cell) or "image" (one PNG overlay)
         self.comName = ""
         self.scaler = MinMaxScaler(feature_range=(0, 1))
+        self.scorer = None  # built from the normalized layers on first use, reset when a layer changes
         self.bird_radius = 30000  #3385 # according to Watson 2020
+        self.bird_kernel = bird_kernel  # "disc", "linear" or "gaussian" (see core/kernels.py)
+        self.tile_cells = tile_cells  # None computes bird risk in one go
+        self.sighting_bin_size = sighting_bin_size
+        self.num_workers = num_workers
+        self.time_window = None  # all sightings, see update_time_window
+        self.species_weights = dict(species_weights or {})  # species code -> weight, missing species get 1
+
+        # Power layer, only built when rasters for some hub heights are given
+        self.hub_height_paths = dict(sorted((hub_height_paths or {}).items()))
+        self.hub_heights = list(self.hub_height_paths)
+        self.turbines = dict(turbines or TURBINES)
+        self.weibull_k = weibull_k
+        self.hub_height = min(self.hub_heights, key=lambda height: abs(height - 100)) if self.hub_heights else None
+        self.turbine = next(iter(self.turbines))
+        self.capacity_factors = None
+
+        # Adaptive grid: grid_size is the biggest leaf, split down to min_grid_size where the layers vary
+        self.adaptive = adaptive
+        self.min_grid_size = min_grid_size or base_grid_size
+        self.refine_threshold = refine_threshold
+        self.refine_sightings = refine_sightings
+        self.quadtrees = {}
+
+        # Exclusion masks, added after the layers are built (see add_exclusion)
+        self.exclusions = {}
+        self.excluded = None
 
         # Set default coefficients
         self.bird_risk_coefficient = 50 # 1-100
         self.wind_speed_coefficient = 50
+        self.power_coefficient = 0  # off until asked for, so the default value is bird vs wind only
+
+        # Dirty tracking: each column's version goes up whenever it's recomputed, and each stage
+        # remembers the inputs it was last computed with so an identical call can be skipped
+        self.versions = dict.fromkeys(['birdRisk', 'windSpeed', 'power', 'capacityFactor', 'excluded', 'value', 'pso',
+                                       'pareto', 'robustness', 'folium'], 0)
+        self.stage_keys = {}
+        self.pso_result = None
+        self.sites = None
+        self.sweep_table = None
+        self.folium_html = None
+
+        # Stage timings go to these hooks (one printed line per stage by default)
+        self.profiler = StageProfiler(hooks=[print_hook] if profile_hooks is None else profile_hooks, track_memory=track_memory)
 
         self.__initialize_map(bird_data_path, wind_speed_data_path)
 
@@ -69,250 +221,992 @@ class Map:
                 self.bird_risk_coefficient = new_coefficients[factor]
             elif factor == 'windSpeed':
                 self.wind_speed_coefficient = new_coefficients[factor]
+            elif factor == 'power':
+                self.power_coefficient = new_coefficients[factor]
+
+        # Nothing to do if neither the coefficients nor the layers changed
+        key = (self.versions['birdRisk'], self.versions['windSpeed'], self.versions['power'], self.versions['excluded'],
+               self.bird_risk_coefficient, self.wind_speed_coefficient, self.power_coefficient)
+        if self.__is_fresh('value', key):
+            return None
+
+        with self.profiler.stage('cost_value', rows=len(self.gdf), **self.get_coefficients()):
+            # wind * windCoef + power * powerCoef - bird * birdCoef, normalized to [0,1] in one pass
+            values = self.get_scorer().score(self.get_coefficients())
+            self.gdf['value'] = values
+
+            # (rows, cols) view for the site search, indexed [y, x], where excluded cells are -inf so they're never picked
+            self.value_grid = self.__raster(values)
+            if self.excluded is not None:
+                self.value_grid = self.value_grid + self.exclusion_penalty
+
+        self.__mark_computed('value', key)
+    
+        return None
 
-        print(f"bird risk coefficient: {self.bird_risk_coefficient}")
-        print(f"wind speed coefficient: {self.wind_speed_coefficient}")
 
-        self.gdf['value'] = (
-            self.gdf['windSpeed'] * 1 -
-            self.gdf['birdRisk'] * 1
-        )
+    def batch_cost_values(self, weights: np.ndarray) -> np.ndarray:
+        '''
+        Scores many coefficient pairs at once without touching the gdf.
 
-        # Normalize the value column to [0,1]
-        self.gdf['value'] = self.scaler.fit_transform(self.gdf['value'].values.reshape(-1, 1)).flatten()
-    
-        return None
+        :param weights: (n, 2) array of [birdRisk, windSpeed] coefficients, or (n, 3) with power as well
+        :return: (n, rows, cols) stack of [0,1] value grids (the fine grid in adaptive mode)
+        '''
+        weights = np.atleast_2d(weights)
+        columns = dict(zip(['birdRisk', 'windSpeed', 'power'], weights.T))
+
+        scorer = self.get_scorer()
+        ordered = np.column_stack([columns.get(name, np.zeros(len(weights))) for name in scorer.names])
+
+        return self.__raster(scorer.score_batch(ordered))
+
+
+    def get_coefficients(self) -> dict:
+        return {'birdRisk': self.bird_risk_coefficient, 'windSpeed': self.wind_speed_coefficient, 'power': self.power_coefficient}
+
+
+    def get_cell_index(self, lat, lon) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        (row, col, index) of the cell under each lat/lon point, where index is the gdf index.
+        Takes scalars or arrays (millions of points is fine), all three are -1 outside the grid.
+        In adaptive mode row and col are on the fine grid and index is the leaf.
+        '''
+        return self.grid.cell_of(lat, lon)
+
+
+    def get_cell_centre(self, index) -> tuple[np.ndarray, np.ndarray]:
+        ''' (lat, lon) of the centre of each gdf index '''
+        return self.grid.centre_of(index)
+
+
+    def get_cell_values(self, lat, lon, columns: list[str] = None) -> pd.DataFrame:
+        ''' The gdf's columns (all but the geometry by default) for the cell under each point, NaN outside the grid '''
+        if columns is None:
+            columns = [column for column in self.gdf.columns if column != 'geometry']
+
+        _, _, index = self.get_cell_index(np.atleast_1d(lat), np.atleast_1d(lon))
+        values = self.gdf[columns].reindex(index)
+        values.insert(0, 'cell', index)
+        return values.reset_index(drop=True)
+
+
+    def get_scorer(self) -> Scorer:
+        ''' Returns the cached Scorer, rebuilding it if a layer changed since the last call '''
+        if self.scorer is None:
+            layers = {
+                'birdRisk': self.gdf['birdRisk'].to_numpy(),
+                'windSpeed': self.gdf['windSpeed'].to_numpy(),
+            }
+            if self.hub_heights:
+                layers['power'] = self.gdf['power'].to_numpy()
+            self.scorer = Scorer(layers, mask=None if self.excluded is None else ~self.excluded)
+        return self.scorer
     
 
-    def update_folium_map(self, new_subject: str):
-        ''' Changes the folium map subject '''
+    def update_folium_map(self, new_subject: str, render_mode: str = None):
+        '''
+        Changes the folium map subject (reuses the current map if that column hasn't changed).
+        render_mode "geojson" draws every cell as a polygon with a tooltip, "image" draws the layer as
+        one PNG overlay with a click lookup, which stays the same size however fine the grid is.
+        '''
 
-        # colormap = cm.LinearColormap(
-        #     colors=['white', 'yellow', 'red'],
-        #     vmin=0,
-        #     vmax=1,
-        # )
+        if render_mode is not None:
+            self.render_mode = render_mode
+
+        key = (new_subject, self.versions.get(new_subject), self.render_mode)
+        if self.__is_fresh('folium', key):
+            return
+
+        with self.profiler.stage('folium', rows=len(self.gdf), subject=new_subject, render_mode=self.render_mode):
+            if self.render_mode == "image":
+                layer = self.__raster(self.gdf[new_subject].to_numpy(dtype=np.float64))
+                self.folium_map = image_overlay_map(self.grid.fine if self.adaptive else self.grid, layer, new_subject)
+
+            else:
+                # colormap = cm.LinearColormap(
+                #     colors=['white', 'yellow', 'red'],
+                #     vmin=0,
+                #     vmax=1,
+                # )
+
+                self.__add_geometry()
+                self.folium_map = self.gdf.explore(
+                    column=new_subject,
+                    cmap='YlOrRd', 
+                    legend=True,
+                    tooltip=True,
+                    style_kwds={'fillOpacity': 0.5, 'weight': 0, 'color': None},
+                )
 
-        
-        self.folium_map = self.gdf.explore(
-            column=new_subject,
-            cmap='YlOrRd', 
-            legend=True,
-            tooltip=True,
-            style_kwds={'fillOpacity': 0.5, 'weight': 0, 'color': None},
-        )
+            self.folium_html = None
+
+        self.__mark_computed('folium', key)
 
         return
+
+
+    def get_folium_html(self) -> str:
+        ''' Rendered HTML of the current folium map, only rendered again after the map changes '''
+        if self.folium_html is None:
+            with self.profiler.stage('render_html') as record:
+                self.folium_html = self.folium_map.get_root().render()
+                record['html_mb'] = round(len(self.folium_html) / 2 ** 20, 2)
+        return self.folium_html
         
-    def run_pso(self, num_particles=30, max_iter=100, w=0.5, c1=1.5, c2=1.5):
-        ''' Runs PSO and populates the 'pso' column of the gdf with 1 for the best location and 0 for others '''
-
-        def get_fitness(pos):
-            # pos is the dataframe index
-            x, y = np.clip(pos.astype(int), [0, 0], [self.cols - 1, self.rows - 1])
-            index = int(y * self.cols + x)
-            return self.gdf["value"].iloc[index]
-        
-        # Initialize particle positions and velocities
-        positions = np.random.rand(num_particles, 2) * [self.cols, self.rows]  # [x, y]
-        velocities = np.random.randn(num_particles, 2)
-
-        # Initialize personal and global bests
-        pBest = positions.copy()
-        pBest_scores = np.array([get_fitness(p) for p in positions])
-        gBest = pBest[np.argmax(pBest_scores)]
-        gBest_score = np.max(pBest_scores)
-
-        # Do pso
-        for _ in range(max_iter):
-            r1, r2 = np.random.rand(2)
-
-            for i in range(num_particles):
-                velocities[i] = (
-                    w * velocities[i]
-                    + c1 * r1 * (pBest[i] - positions[i])
-                    + c2 * r2 * (gBest - positions[i])
-                )
-                positions[i] += velocities[i]
-                positions[i] = np.clip(positions[i], [0, 0], [self.cols - 1, self.rows - 1])
-
-                fitness = get_fitness(positions[i])
-                if fitness > pBest_scores[i]:
-                    pBest[i] = positions[i]
-                    pBest_scores[i] = fitness
-                    if fitness > gBest_score:
-                        gBest = positions[i]
-                        gBest_score = fitness
-
-        best_x = int(gBest[0])
-        best_y = int(gBest[1])
-        best_index = best_y * self.cols + best_x
-        print(f"Best position: {best_x}, {best_y} with score: {gBest_score}")
+    def run_pso(self, num_particles=30, max_iter=100, w=0.5, c1=1.5, c2=1.5,
+                seed=None, num_swarms=1, patience=20):
+        '''
+        Runs PSO and populates the 'pso' column of the gdf with 1 for the best location and 0 for others.
+        Returns ((x, y), index, score), index is -1 (and nothing is marked) if every cell is excluded.
+        '''
+
+        # Same value grid and parameters as last time, keep that result
+        key = ('pso', self.versions['value'], num_particles, max_iter, w, c1, c2, seed, num_swarms, patience)
+        if self.__is_fresh('pso', key):
+            return self.pso_result
+
+        with self.profiler.stage('pso', rows=self.value_grid.size) as record:
+            (best_x, best_y), gBest_score = run_pso(
+                self.value_grid,
+                num_particles=num_particles,
+                max_iter=max_iter,
+                w=w, c1=c1, c2=c2,
+                seed=seed,
+                num_swarms=num_swarms,
+                patience=patience,
+            )
+
+            # Only fails to find a cell when every cell is excluded
+            best_index = self.__cell_at(best_x, best_y) if np.isfinite(gBest_score) else -1
+            record['best'] = (best_x, best_y)
+            record['score'] = round(float(gBest_score), 4)
+            if best_index < 0:
+                record['note'] = "no cell left to search, every cell is excluded"
 
         # Update the gdf with the best position
         self.gdf['pso'] = 0
-        self.gdf.loc[best_index, 'pso'] = 1
+        if best_index >= 0:
+            self.gdf.loc[best_index, 'pso'] = 1
+
+        self.pso_result = (best_x, best_y), best_index, gBest_score
+        self.__mark_computed('pso', key)
         
-        return (best_x, best_y), best_index, gBest_score
+        return self.pso_result
+
+
+
+    def find_best_sites(self, k: int = 1, min_spacing: float = 0):
+        ''' 
+        Deterministic alternative to run_pso: the k best cells, at least min_spacing meters apart.
+        Populates the 'pso' column of the gdf with 1 for the selected cells and 0 for others.
+        Returns a list of ((x, y), index, score), best first.
+        '''
+
+        key = ('sites', self.versions['value'], k, min_spacing)
+        if self.__is_fresh('pso', key):
+            return self.sites
+
+        with self.profiler.stage('site_search', rows=self.value_grid.size, k=k):
+            values = self.value_grid
+            if self.adaptive:
+                # Only the centre of each leaf is a candidate, so a big leaf can't take up several of the k sites
+                values = np.full(self.value_grid.shape, -np.inf)
+                values.flat[self.grid.representatives] = self.value_grid.flat[self.grid.representatives]
+
+            picks = select_sites(values, k=k, min_spacing=min_spacing / self.grid.size)
 
+        sites = []
+        for x, y in picks:
+            sites.append(((x, y), self.__cell_at(x, y), float(self.value_grid[y, x])))
+
+        self.gdf['pso'] = 0
+        self.gdf.loc[[index for _, index, _ in sites], 'pso'] = 1
+
+        self.sites = sites
+        self.__mark_computed('pso', key)
+
+        return sites
+
+
+    def find_pareto_front(self) -> np.ndarray:
+        '''
+        Indices of the Pareto-optimal cells: no other cell has both a lower birdRisk and a higher windSpeed
+        (and power, when there's a power layer). Whatever the coefficients, the best site is one of these.
+        Excluded cells are left out. Sets the 'pareto' column to 1 for them.
+        '''
+
+        key = (self.versions['birdRisk'], self.versions['windSpeed'], self.versions['power'], self.versions['excluded'])
+        if self.__is_fresh('pareto', key):
+            return self.get_scorer().pareto_front()
+
+        with self.profiler.stage('pareto', rows=len(self.gdf)) as record:
+            front = self.get_scorer().pareto_front()
+            record['front'] = len(front)
+
+        self.gdf['pareto'] = 0
+        self.gdf.loc[front, 'pareto'] = 1
+        self.__mark_computed('pareto', key)
+
+        return front
+
+
+    def coefficient_sweep(self, coefficients: list[int] = range(1, 101)) -> pd.DataFrame:
+        '''
+        Finds the best site for every (birdRisk, windSpeed) coefficient pair in one batch, so you don't
+        have to drag the sliders to see how the best site moves. The power coefficient stays where it is.
+
+        Sets the 'robustness' column to the share of pairs each cell is the best site for, and returns
+        (and keeps in sweep_table) one row per site: its share of the pairs, position, layer values
+        and the range of wind/bird coefficient ratios it wins for, most robust first.
+        '''
+
+        coefficients = tuple(coefficients)
+        key = (self.versions['birdRisk'], self.versions['windSpeed'], self.versions['power'], self.versions['excluded'],
+               self.power_coefficient, coefficients)
+        if self.__is_fresh('robustness', key):
+            return self.sweep_table
+
+        bird, wind = (grid.ravel() for grid in np.meshgrid(coefficients, coefficients))
+
+        with self.profiler.stage('coefficient_sweep', rows=len(self.gdf), pairs=len(bird)):
+            # Only the ratio of the coefficients matters, and the winner is always on the Pareto front
+            scorer = self.get_scorer()
+            columns = {'birdRisk': bird, 'windSpeed': wind, 'power': np.full(len(bird), self.power_coefficient)}
+            best = scorer.best_cells(np.column_stack([columns[name] for name in scorer.names]))
+
+            share = np.bincount(best, minlength=len(self.gdf)) / len(best)
+            self.gdf['robustness'] = share
+
+            ratio = pd.Series(wind / bird).groupby(best).agg(['min', 'max'])
+            sites = ratio.index.to_numpy()
+            lat, lon = self.get_cell_centre(sites)
+            rows, cols = self.grid.row_col(sites)
+
+            self.sweep_table = pd.DataFrame({
+                'cell': sites,
+                'share': share[sites],
+                'row': rows,
+                'col': cols,
+                'lat': lat,
+                'lon': lon,
+                'birdRisk': self.gdf['birdRisk'].to_numpy()[sites],
+                'windSpeed': self.gdf['windSpeed'].to_numpy()[sites],
+                **({'capacityFactor': self.gdf['capacityFactor'].to_numpy()[sites]} if self.hub_heights else {}),
+                'minWindBirdRatio': ratio['min'].to_numpy(),
+                'maxWindBirdRatio': ratio['max'].to_numpy(),
+            }).sort_values('share', ascending=False, ignore_index=True)
+
+        self.__mark_computed('robustness', key)
+
+        return self.sweep_table
+
+
+    def update_bird_radius(self, new_radius: float = None, new_kernel: str = None):
+        ''' Recomputes birdRisk (and the value column) for a new radius in meters and/or kernel '''
+
+        if (new_radius in (None, self.bird_radius)) and (new_kernel in (None, self.bird_kernel)):
+            return None
+
+        if new_radius is not None:
+            self.bird_radius = new_radius
+        if new_kernel is not None:
+            self.bird_kernel = new_kernel
+
+        with self.profiler.stage('update_bird_radius', radius=self.bird_radius, kernel=self.bird_kernel):
+            self.__update_bird_risk()
+            self.calculate_cost_value()
+
+        return None
+
+
+    def update_time_window(self, months: tuple[int, int] = None, years: tuple[int, int] = None):
+        '''
+        Only counts sightings from these months (1-12, inclusive, (11, 2) wraps around new year)
+        and years (inclusive) in birdRisk, then recalculates the value column.
+        None (or the full range) for both goes back to all sightings.
+        '''
+
+        if not len(self.years):
+            with self.profiler.stage('update_time_window') as record:
+                record['note'] = "no sighting dates to filter on"
+            return None
+
+        months = tuple(months) if months is not None else (1, 12)
+        years = tuple(years) if years is not None else (int(self.years[0]), int(self.years[-1]))
+        everything = months == (1, 12) and years[0] <= self.years[0] and years[1] >= self.years[-1]
+        window = None if everything else {'months': months, 'years': years}
+
+        if window == self.time_window:
+            return None
+
+        self.time_window = window
+        with self.profiler.stage('update_time_window', **(window or {})):
+            self.__apply_time_window()
+            self.calculate_cost_value()
+
+        return None
+
+
+    def update_species_weights(self, new_weights: dict):
+        ''' Sets the sensitivity weight of some species (code -> weight) and recalculates birdRisk and value '''
+
+        weights = {**self.species_weights, **new_weights}
+        if all(weights.get(code, 1.0) == self.species_weights.get(code, 1.0) for code in self.species):
+            self.species_weights = weights
+            return None
+
+        self.species_weights = weights
+        with self.profiler.stage('update_species_weights', rows=len(self.gdf)):
+            self.__combine_species()
+            self.calculate_cost_value()
+
+        return None
+
+
+    def get_species_weights(self) -> dict:
+        return {code: self.species_weights.get(code, 1.0) for code in self.species}
+
+
+    def update_power_curve(self, hub_height: int = None, turbine: str = None):
+        ''' Shows and scores another hub height and/or turbine, all combinations are already computed '''
+
+        assert self.hub_heights, "No hub height rasters were given, so there's no power layer"
+        assert hub_height in [None] + self.hub_heights, f"hub_height must be one of {self.hub_heights}"
+        assert turbine in [None] + list(self.turbines), f"turbine must be one of {list(self.turbines)}"
+
+        if hub_height in (None, self.hub_height) and turbine in (None, self.turbine):
+            return None
+
+        self.hub_height = hub_height if hub_height is not None else self.hub_height
+        self.turbine = turbine if turbine is not None else self.turbine
+
+        with self.profiler.stage('update_power_curve', hub_height=self.hub_height, turbine=self.turbine):
+            self.__select_power()
+            self.calculate_cost_value()
+
+        return None
+
+
+    def add_protected_areas(self, path: str, name: str = "protected", all_touched: bool = False):
+        ''' Excludes the cells inside the polygons of a local file (shapefile, GeoPackage, GeoJSON, ...) '''
+        mask = self.__cached_mask(path, dict(kind="polygons", all_touched=all_touched),
+                                  lambda base: polygon_mask(base, path, all_touched))
+        self.add_exclusion(name, mask)
+
+
+    def add_slope_limit(self, dem_path: str, max_slope: float = 10, name: str = "slope", oversample: int = 4):
+        ''' Excludes the cells whose mean slope (from a local DEM GeoTIFF) is over max_slope degrees '''
+        mask = self.__cached_mask(dem_path, dict(kind="slope", max_slope=max_slope, oversample=oversample),
+                                  lambda base: slope_mask(base, dem_path, max_slope, oversample))
+        self.add_exclusion(name, mask)
+
+
+    def add_exclusion(self, name: str, mask: np.ndarray):
+        '''
+        Adds (or replaces) a mask of the pyramid's base grid, True where nothing can be built, and
+        recalculates value. Bird risk, wind and power are left as they are.
+        '''
+        base = self.pyramid.base
+        mask = np.asarray(mask, dtype=bool).reshape(base.shape)
+
+        with self.profiler.stage('add_exclusion', mask=name, excluded=int(mask.sum())):
+            self.exclusions[name] = mask
+            self.__apply_exclusions()
+            self.calculate_cost_value()
+
+        return None
+
+
+    def remove_exclusion(self, name: str):
+        if self.exclusions.pop(name, None) is None:
+            return None
+
+        with self.profiler.stage('remove_exclusion', mask=name):
+            self.__apply_exclusions()
+            self.calculate_cost_value()
+
+        return None
 
 
     def __update_bird_risk(self):
-        ''' Adds a birdRisk column to the Map's gdf based on bird observations '''
+        ''' Rebuilds the species x month x year bird risk cube for the current grid, radius and kernel, then birdRisk from it '''
+
+        num_species, num_time_bins = len(self.species), len(self.years) * 12 + 1
+
+        with self.profiler.stage('bird_risk', rows=len(self.gdf), sightings=len(self.sightings_count),
+                                 bins=num_species * num_time_bins):
+            # Sum of bird counts within bird_radius of each cell, weighted by the kernel, kept apart per species
+            # and month in the same pass (sighting_bin_counts has a column per bin). Risk is linear in the counts,
+            # so any time window or species weighting is just a weighted sum over these bins
+            if self.adaptive or self.tile_cells:
+                # Each tile's (tile cells, species x time bins) result goes straight to prefix sums on disk,
+                # so the full cube never exists
+                num_cells, num_years = len(self.grid), len(self.years)
+                out = (self.__scratch_array((num_cells, num_species, num_years + 1, 13)), np.zeros((num_cells, num_species)))
+
+                def reduce(cube):
+                    return month_prefix(cube.reshape(len(cube), num_species, num_time_bins), num_years)
+
+                if self.adaptive:
+                    # Every leaf is scored like a fine cell at its centre, a tile of tile_cells fine cells a side at a time
+                    tiled_centre_kernel_sum(
+                        self.sighting_positions,
+                        self.sighting_bin_counts,
+                        self.cell_centroids,
+                        self.grid.size,
+                        self.bird_radius,
+                        self.bird_kernel,
+                        tile_size=(self.tile_cells or 64) * self.grid.size,
+                        out=out,
+                        reduce=reduce,
+                    )
+                else:
+                    # Same result, but only one tile's sighting/cell pairs in memory per worker
+                    tiled_kernel_sum(
+                        self.sighting_positions,
+                        self.sighting_bin_counts,
+                        self.grid,
+                        self.bird_radius,
+                        self.bird_kernel,
+                        tile_cells=self.tile_cells,
+                        num_workers=self.num_workers,
+                        out=out,
+                        reduce=reduce,
+                    )
+                self.bird_risk_prefix, self.bird_risk_undated = out
+            else:
+                cube = kernel_sum(
+                    self.sightings_tree,
+                    self.sighting_bin_counts,
+                    self.cells_tree,
+                    self.grid_size,
+                    self.bird_radius,
+                    self.bird_kernel,
+                )
+                self.__set_bird_risk_prefix(cube.reshape(len(cube), num_species, num_time_bins))
 
-        observations = self.bird_risk_gdf
-        self.gdf = self.gdf.drop(columns=['birdRisk'])
+        self.__apply_time_window()
 
+        return
 
-        # Now we can do a spatial join on observations and self.gdf
-        observations_joined = gpd.sjoin(
-            observations,
-            self.gdf[['geometry']],
-            how="inner",
-            predicate="intersects"
-        )
 
-        sum_bird_risk = (
-            observations_joined
-            .groupby('index_right')['howMany']
-            .sum()
-            .rename('birdRisk')
-        )
+    def __set_bird_risk_prefix(self, cube: np.ndarray):
+        ''' 2D cumulative sums of a (cells, species, years * 12 + 1) risk cube over its years and months '''
+        self.bird_risk_prefix, self.bird_risk_undated = month_prefix(cube, len(self.years))
+
+
+    def __apply_time_window(self):
+        ''' Sets the per-species risk (and so birdRisk) from the prefix sums for the current time_window, O(cells) '''
+
+        if self.time_window is None:
+            risk = self.bird_risk_prefix[:, :, -1, -1] + self.bird_risk_undated
+        else:
+            first_month, last_month = (month - 1 for month in self.time_window['months'])
+            first_year, last_year = (year - self.years[0] for year in self.time_window['years'])
+            risk = window_sum(self.bird_risk_prefix, first_year, last_year, first_month, last_month)
+
+        self.species_risk = risk
+        self.__combine_species()
 
-        # Add the sum of bird counts to the self.gdf
-        self.gdf = self.gdf.join(sum_bird_risk, how="left")
 
-        self.gdf = self.gdf.fillna({'birdRisk': 0})
+    def __combine_species(self):
+        ''' Sets birdRisk to the weighted sum of the per-species risk, O(cells * species) '''
+
+        # Each species is scaled to its own peak first, so the weights compare species
+        # rather than how often each one happens to get reported
+        peak = self.species_risk.max(axis=0)
+        scaled = self.species_risk / np.where(peak > 0, peak, 1)
+        weights = np.array([self.species_weights.get(code, 1.0) for code in self.species], dtype=np.float64)
+        risk = scaled @ weights
 
         # normalize the column to [0,1]
-        self.gdf['birdRisk'] = self.scaler.fit_transform(self.gdf['birdRisk'].values.reshape(-1, 1)).flatten()
+        self.gdf['birdRisk'] = self.scaler.fit_transform(risk.reshape(-1, 1)).flatten()
+        self.scorer = None
+        self.versions['birdRisk'] += 1
+    
+    def __update_wind_speed(self, sjoin: bool = None):
+        ''' Adds a windSpeed column to the Map's gdf based on wind speeds (sjoin defaults to wind_speed_mode == "sjoin") '''
+
+        with self.profiler.stage('wind_speed', rows=len(self.gdf)) as record:
+            self.gdf = self.gdf.drop(columns=['windSpeed'])
+
+            if sjoin is None:
+                sjoin = self.wind_speed_mode == "sjoin" and self.wind_speed_gdf is not None
+            record['sjoin'] = sjoin
+
+            if not sjoin:
+                # Pixel sums/counts were already binned per cell, no shapely points involved
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    avg_wind_speed = pd.Series(self.wind_sum / self.wind_count, index=self.gdf.index, name='windSpeed')
+
+            else:
+                observations = self.wind_speed_gdf
+                self.__add_geometry()
+
+                # Spatial join to attach each observation to it's grid cell
+                observations_joined = gpd.sjoin(
+                    observations,
+                    self.gdf[['geometry']],
+                    how="inner",
+                    predicate="within"
+                )
+            
+                # Series of average wind speeds, indexed the same as self.gdf
+                avg_wind_speed = (
+                    observations_joined
+                    .groupby('index_right')['windSpeedValue']
+                    .mean()
+                    .rename('windSpeed')
+                )
+
+            # Add the average wind speeds to the self.gdf
+            self.gdf = self.gdf.join(avg_wind_speed, how="left")
+
+            # There might be null values if some cells are a bit outside the region
+            # Since they're on the borders, they should have a low wind energy potential value anyway (no one wants to build a wind farm there)
+            # Still not the best solution admittedly
+            self.gdf['windSpeed'] = self.gdf['windSpeed'].fillna(self.gdf['windSpeed'].min())
+
+
+            self.gdf['windSpeed'] = self.scaler.fit_transform(self.gdf['windSpeed'].values.reshape(-1, 1)).flatten()
+        self.scorer = None
+        self.versions['windSpeed'] += 1
 
         return
-    
-    def __update_wind_speed(self):
-        ''' Adds a windSpeed column to the Map's gdf based on wind speeds '''
-
-        observations = self.wind_speed_gdf
-        self.gdf = self.gdf.drop(columns=['windSpeed'])
-
-        # Spatial join to attach each observation to it's grid cell
-        observations_joined = gpd.sjoin(
-            observations,
-            self.gdf[['geometry']],
-            how="inner",
-            predicate="within"
-        )
-        
-        # Series of average wind speeds, indexed the same as self.gdf
-        avg_wind_speed = (
-            observations_joined
-            .groupby('index_right')['windSpeedValue']
-            .mean()
-            .rename('windSpeed')
-        )
 
-        # Add the average wind speeds to the self.gdf
-        self.gdf = self.gdf.join(avg_wind_speed, how="left")
 
-        # There might be null values if some cells are a bit outside the region
-        # Since they're on the borders, they should have a low wind energy potential value anyway (no one wants to build a wind farm there)
-        # Still not the best solution admittedly
-        self.gdf['windSpeed'] = self.gdf['windSpeed'].fillna(self.gdf['windSpeed'].min())
+    def __update_power(self):
+        ''' Expected capacity factor of every hub height and turbine for the current cells, then the power column '''
+
+        if not self.hub_heights:
+            return
+
+        with self.profiler.stage('power', rows=len(self.gdf), heights=len(self.hub_heights), turbines=len(self.turbines)):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_speed = (self.hub_wind_sum / self.hub_wind_count).T
+
+            # Cells with no pixels get the lowest wind of their height, same as the windSpeed column
+            missing = np.isnan(mean_speed)
+            lowest = np.where(missing, np.inf, mean_speed).min(axis=1, keepdims=True)
+            lowest[np.isinf(lowest)] = 0
+            mean_speed = np.where(missing, lowest, mean_speed)
+
+            # (heights, cells, turbines) in one table lookup
+            self.capacity_factors = capacity_factors(mean_speed, list(self.turbines.values()), self.weibull_k)
+
+        self.__select_power()
+
+        return
+
+
+    def __select_power(self):
+        ''' Puts the current hub height/turbine's capacity factor in the gdf, raw and normalized for scoring '''
+
+        factors = self.capacity_factors[self.hub_heights.index(self.hub_height), :, list(self.turbines).index(self.turbine)]
+        self.gdf['capacityFactor'] = factors
+        self.gdf['power'] = self.scaler.fit_transform(factors.reshape(-1, 1)).flatten()
 
+        self.scorer = None
+        self.versions['power'] += 1
+        self.versions['capacityFactor'] += 1
 
-        self.gdf['windSpeed'] = self.scaler.fit_transform(self.gdf['windSpeed'].values.reshape(-1, 1)).flatten()
+        return
+
+
+    def __apply_exclusions(self):
+        ''' All the masks combined and block-summed to the current grid_size, in the 'excluded' column '''
+
+        self.excluded = None
+        self.gdf['excluded'] = 0
+
+        if self.exclusions:
+            with self.profiler.stage('exclusions', rows=len(self.gdf), masks=len(self.exclusions)) as record:
+                base = self.pyramid.base
+                combined = np.logical_or.reduce(list(self.exclusions.values()))
+
+                # Share of each cell's base cells that are excluded (partial blocks at the edges count what they have)
+                share = self.__cell_sums(combined.astype(np.int32)) / self.__cell_sums(np.ones(base.shape, dtype=np.int32))
+
+                self.excluded = share > 0.5
+                self.exclusion_penalty = self.__raster(np.where(self.excluded, -np.inf, 0.0))
+                self.gdf['excluded'] = self.excluded.astype(int)
+                record['excluded'] = int(self.excluded.sum())
+
+        self.scorer = None
+        self.versions['excluded'] += 1
 
         return
 
 
+    def __cell_sums(self, layer: np.ndarray) -> np.ndarray:
+        ''' (cells, ...) sums of a (rows, cols, ...) layer on the pyramid's base grid, over each cell of the current grid '''
+        base = self.pyramid.base
+        if self.adaptive:
+            return self.grid.gather([block_sum(layer, int(size // base.size)) for size in self.grid.sizes])
+        return block_sum(layer, int(self.grid_size // base.size)).reshape((len(self.grid),) + layer.shape[2:])
+
+
+    def __raster(self, values: np.ndarray) -> np.ndarray:
+        ''' (..., cells) array as (..., rows, cols), painted onto the fine grid in adaptive mode '''
+        if self.adaptive:
+            return self.grid.raster(values)
+        return values.reshape(values.shape[:-1] + (self.rows, self.cols))
+
+
+    def __cell_at(self, x: int, y: int) -> int:
+        ''' gdf index of the cell at column x, row y of value_grid '''
+        index = int(y * self.cols + x)
+        return int(self.grid.leaf_of[index]) if self.adaptive else index
+
+
+    @staticmethod
+    def __scratch_array(shape: tuple) -> np.ndarray:
+        ''' Zeroed float64 array on an anonymous temp file, so it lives in the page cache rather than in RAM '''
+        return np.memmap(tempfile.TemporaryFile(), dtype=np.float64, mode='w+', shape=shape)
+
+
+    def __cached_mask(self, path: str, params: dict, build) -> np.ndarray:
+        ''' build(base grid) -> mask, or the copy in the layer cache from the last time for the same file and grid '''
+        base = self.pyramid.base
+        if self.cache is None:
+            return build(base)
+
+        key = self.cache.make_key([path], crs=base.crs.to_wkt(), base=[base.xmin, base.ymin, base.size, base.rows, base.cols],
+                                  **params)
+        with self.profiler.stage('cache_load') as record:
+            entry = self.cache.load(key)
+            record['hit'] = entry is not None
+
+        if entry is not None:
+            return np.asarray(entry[0]['mask'])
+
+        mask = build(base)
+        self.cache.save(key, {'mask': mask}, {})
+        return mask
+
+
+    def __is_fresh(self, stage: str, key: tuple) -> bool:
+        ''' True if the stage was last computed from exactly these inputs '''
+        return self.stage_keys.get(stage) == key
+
+
+    def __mark_computed(self, stage: str, key: tuple):
+        ''' Records the stage's inputs and bumps its version so later stages know it changed '''
+        self.stage_keys[stage] = key
+        self.versions[stage] += 1
+
+
+    def __load_wind_raster(self, wind_speed_data_path: str, crs) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ''' Reads the processed wind GeoTIFF and returns its pixel centres (in crs) and values '''
+
+        # process_wind_speed_data writes the .tif next to the .parquet/.jsonl, so either path works here
+        return read_raster_points(self.__wind_source_path(wind_speed_data_path), crs)
+
+
+    def update_resolution(self, new_grid_size: int):
+        '''
+        Switches to another grid size (a multiple of base_grid_size) and recalculates value and pso.
+        In adaptive mode it's the coarsest leaf size, min_grid_size times a power of 2.
+        '''
+
+        if new_grid_size == self.grid_size:
+            return None
+
+        with self.profiler.stage('update_resolution', grid_size=new_grid_size):
+            self.__update_resolution(new_grid_size)
+            self.calculate_cost_value()
+            self.run_pso()
+
+        return None
+
+
     def __update_resolution(self, new_grid_size: int):
-        ''' Updates the grid size of the map '''
-        # TODO - implement this
-        pass
+        ''' Updates the grid size of the map from the pyramid, without touching the raw data '''
+
+        self.__set_level(new_grid_size)
+
+        self.__update_bird_risk()
+        # Block sums of the finest level give the exact per-cell mean, so no sjoin needed here
+        self.__update_wind_speed(sjoin=False)
+        self.__update_power()
+
+        return None
+
+
+    def __set_level(self, grid_size: int):
+        ''' Points the grid, cell arrays and gdf at one level of the pyramid '''
+
+        with self.profiler.stage('set_level', grid_size=grid_size) as record:
+            if self.adaptive:
+                # Each leaf's totals come from the pyramid level of its own size
+                self.grid = self.__quadtree(grid_size)
+                levels = [self.pyramid.level(size)[1] for size in self.grid.sizes]
+                sums = {name: self.grid.gather([level[name] for level in levels]) for name in levels[0]}
+            else:
+                self.grid, sums = self.pyramid.level(grid_size)
+            self.grid_size = grid_size
+            self.rows, self.cols = self.grid.shape
+            record['rows'] = len(self.grid)
+            record['shape'] = (self.rows, self.cols)
+
+            # Cell corners and centres (grid crs) as numpy arrays, so later stages can skip the shapely geometry
+            self.cell_bounds = self.grid.bounds
+            self.cell_centroids = self.grid.centroids
+            self.cells_tree = cKDTree(self.cell_centroids)
+
+            # Raw per-cell totals at this level
+            self.sighting_counts = sums['sightings'].ravel()
+            self.wind_sum = sums['windSum'].ravel()
+            self.wind_count = sums['windCount'].ravel()
+            if self.hub_heights:
+                self.hub_wind_sum = sums['hubWindSum'].reshape(len(self.grid), -1)
+                self.hub_wind_count = sums['hubWindCount'].reshape(len(self.grid), -1)
+
+            # The polygons are only built if something needs them, see __add_geometry
+            self.gdf = pd.DataFrame(index=pd.RangeIndex(len(self.grid)))
+            if grid_size in self.level_geometry:
+                self.__add_geometry()
+            self.gdf['birdRisk'] = 0.0
+            self.gdf['windSpeed'] = 0.0
+            if self.hub_heights:
+                self.gdf['power'] = 0.0
+                self.gdf['capacityFactor'] = 0.0
+            self.gdf['value'] = 0.0
+            self.gdf['pso'] = 0
+            self.gdf['pareto'] = 0
+            self.gdf['robustness'] = 0.0
+            self.scorer = None
+
+            # Masks live on the base grid, so they just get block-summed again
+            self.__apply_exclusions()
+
+        # New geometry, so everything computed on the old grid is stale
+        for stage in self.versions:
+            self.versions[stage] += 1
+
+        return None
+
+
+    def __add_geometry(self):
+        ''' Gives the gdf its WGS84 cell polygons, built in one go the first time each grid size needs them '''
+        if 'geometry' in self.gdf:
+            return
+
+        if self.grid_size not in self.level_geometry:
+            with self.profiler.stage('geometry', rows=len(self.grid)):
+                self.level_geometry[self.grid_size] = self.grid.to_gdf("EPSG:4326").geometry
+
+        self.gdf = gpd.GeoDataFrame(self.gdf, geometry=self.level_geometry[self.grid_size].values)
+
+
+    def __quadtree(self, grid_size: int) -> Quadtree:
+        ''' The adaptive leaves for a coarsest cell size of grid_size, refined once per grid size '''
+
+        if grid_size in self.quadtrees:
+            return self.quadtrees[grid_size]
+
+        max_level = int(round(math.log2(grid_size / self.min_grid_size)))
+        assert max_level >= 0 and self.min_grid_size * 2 ** max_level == grid_size, \
+            f"grid size must be min_grid_size ({self.min_grid_size} m) times a power of 2"
+
+        fine, fine_sums = self.pyramid.level(self.min_grid_size)
+
+        def values(level, cells):
+            grid, sums = self.pyramid.level(fine.size * 2 ** level)
+            # Risk of a fine cell at each centre (same as the leaves get), so levels compare like for like
+            risk = tiled_centre_kernel_sum(self.sighting_positions, self.sighting_totals, grid.centroids[cells], fine.size,
+                                           self.bird_radius, self.bird_kernel, tile_size=(self.tile_cells or 64) * fine.size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                wind = sums['windSum'].ravel()[cells] / sums['windCount'].ravel()[cells]
+            return np.vstack([risk, wind])
+
+        def counts(level, cells):
+            grid, sums = self.pyramid.level(fine.size * 2 ** level)
+            return sums['sightings'].ravel()[cells]
+
+        # Wind of each fine cell (what the leaves stand in for), and its square, block-summed over the levels
+        has_wind = fine_sums['windCount'] > 0
+        fine_wind = np.where(has_wind, fine_sums['windSum'] / np.maximum(fine_sums['windCount'], 1), 0.0)
+        fine_spread = LayerPyramid(fine, {'wind': fine_wind, 'windSq': fine_wind ** 2, 'cells': has_wind.astype(np.int64)})
+
+        def spread(level, cells):
+            # Standard deviation of the fine cells' wind inside each cell, the risk has no sub-cell sums to get one from
+            grid, sums = fine_spread.level(fine.size * 2 ** level)
+            count = sums['cells'].ravel()[cells]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = sums['wind'].ravel()[cells] / count
+                std = np.sqrt(np.maximum(sums['windSq'].ravel()[cells] / count - mean ** 2, 0))
+            return np.vstack([np.full(len(cells), np.nan), std])
+
+        with self.profiler.stage('quadtree', grid_size=grid_size, min_grid_size=self.min_grid_size) as record:
+            self.quadtrees[grid_size] = refine(fine, max_level, values, counts,
+                                               self.refine_threshold, self.refine_sightings, spread)
+            record['rows'] = len(self.quadtrees[grid_size])
+            record['fine_cells'] = len(fine)
+
+        return self.quadtrees[grid_size]
 
 
     def __initialize_map(self, bird_data_path: str, wind_speed_data_path: str):
         '''
         Generates a GeoDataFrame with the following structure:
         
-        index | birdRisk | windSpeed | value | pso | geometry
+        index | birdRisk | windSpeed | (power | capacityFactor) | value | pso | geometry
         
         Where the geometry is set to WGS84 coordinates of the grid cell corners (shapely Polygons).
-        birdRis, windSpeed, and value are all normalized [1,0].
+        birdRis, windSpeed, power and value are all normalized [1,0], capacityFactor is the raw one.
         pso is 1 for yes, include and 0 for no, exclude.
         '''
 
-        ''' Initialize bird dataframe '''
-        data = pd.read_json(bird_data_path, lines=True)
-        self.comName = data["comName"][0]
+        with self.profiler.stage('initialize', grid_size=self.grid_size):
+            ''' Layers, from the on-disk cache if these exact inputs were computed before '''
+            cache_key = None
+            if self.cache is not None:
+                wind_path = self.__wind_source_path(wind_speed_data_path)
+                cache_key = self.cache.make_key(
+                    [bird_data_path, wind_path] + [self.__hub_height_tif(path) for path in self.hub_height_paths.values()],
+                    coord_range=list(self.coord_range),
+                    grid_size=self.grid_size,
+                    base_grid_size=self.base_grid_size,
+                    bird_radius=self.bird_radius,
+                    bird_kernel=self.bird_kernel,
+                    sighting_bin_size=self.sighting_bin_size,
+                    wind_speed_mode=self.wind_speed_mode,
+                    hub_heights=self.hub_heights,
+                    **({'adaptive': [self.min_grid_size, self.refine_threshold, self.refine_sightings]} if self.adaptive else {}),
+                )
+                with self.profiler.stage('cache_load') as record:
+                    entry = self.cache.load(cache_key)
+                    record['hit'] = entry is not None
 
-        geometry = [Point(lon, lat) for lon, lat in zip(data['lon'], data['lat'])]
-        observations = gpd.GeoDataFrame(
-            data[['howMany']],  # Keep the attribute column
-            geometry=geometry,
-            crs="EPSG:4326"  # WGS84 coordinate reference system
-        )
+            if cache_key is not None and entry is not None:
+                with self.profiler.stage('restore_layers'):
+                    self.__restore_layers(*entry)
+            else:
+                self.__build_layers(bird_data_path, wind_speed_data_path)
+                if cache_key is not None:
+                    with self.profiler.stage('cache_save'):
+                        self.cache.save(cache_key, *self.__layer_arrays())
 
-        # Project to UTM CRS
-        observations = observations.to_crs(observations.estimate_utm_crs())
 
-        # Set new geometry to circles around each observation instead of points
-        observations['geometry'] = observations.buffer(self.bird_radius)
+            ''' Now that we have the layers, score them '''
+            self.calculate_cost_value()
+
+            self.run_pso()
+        
+            # Initialize folium map
+            self.update_folium_map('value')
+        
+            # Save gdf to GeoJSON
+            if self.output_path:
+                with self.profiler.stage('save_geojson', rows=len(self.gdf)):
+                    self.__add_geometry()
+                    self.gdf.to_file(self.output_path, driver="GeoJSON")
 
-        observations = observations.to_crs("EPSG:4326")  # Project back to WGS84
+        return None
 
-        self.bird_risk_gdf = observations
 
+    def __build_layers(self, bird_data_path: str, wind_speed_data_path: str):
+        ''' Reads the data, builds the pyramid and the birdRisk/windSpeed columns for grid_size '''
 
-        ''' Initialize wind speed dataframe '''
-        data = pd.read_json(wind_speed_data_path, lines=True)
+        ''' Finest grid (base of the resolution pyramid) '''
+        # Regular lattice over the boundary, in UTM (or equal-area for wide regions) so cells are meters-based
+        base_size = math.gcd(int(self.grid_size), int(self.base_grid_size))
+        if self.adaptive:
+            base_size = math.gcd(base_size, int(self.min_grid_size))
+        base = Grid.from_boundary(self.boundary, base_size)
 
-        geometry = [Point(lon, lat) for lon, lat in zip(data['lon'], data['lat'])]
-        observations = gpd.GeoDataFrame(
-            data[['windSpeed']],  # Keep the attribute column
-            geometry=geometry,
-            crs="EPSG:4326"  # WGS84 coordinate reference system
-        )
-        observations = observations.rename(columns={'windSpeed': 'windSpeedValue'})
 
-        self.wind_speed_gdf = observations
+        ''' Initialize bird sightings '''
+        with self.profiler.stage('read_sightings') as record:
+            # Sightings just outside the box still add risk within bird_radius, so read a bit past it
+            data = read_points(bird_data_path, ['speciesCode', 'comName', 'howMany', 'obsDt'],
+                               bbox_with_margin(self.coord_range, self.bird_radius))
 
+            # Every species in the file gets its own slice of the risk cube
+            species_index, species = pd.factorize(data['speciesCode'], sort=True)
+            self.species = list(species)
+            self.sightings_species = species_index.astype(np.int64)
+            self.species_names = data.groupby('speciesCode')['comName'].first().to_dict()
+            self.comName = ", ".join(self.species_names[code] for code in self.species)
+            self.years, self.sightings_bin = self.__month_bins(data['obsDt'])
 
-        ''' Now set up the grid (main dataframe) '''
-        # wrap boundary in GeoDataFrame, with WGS84 coordinate reference system
-        boundary_gdf = gpd.GeoDataFrame(geometry=[self.boundary], crs="EPSG:4326")
-        
-        # Project to UTM to generate meters-based grid cells
-        utm_gdf = boundary_gdf.to_crs(boundary_gdf.estimate_utm_crs())
-        xmin, ymin, xmax, ymax = utm_gdf.total_bounds
+            # Project the sightings to the grid's crs, kept as plain arrays
+            x, y = base.project(data['lat'], data['lon'])
+
+            self.sightings_xy = np.column_stack([x, y])
+            self.sightings_count = data['howMany'].to_numpy(dtype=np.float64)
+
+            # Only depends on positions, so changing the radius, kernel or resolution just re-queries it
+            self.__bin_sightings()
+            record['rows'] = len(self.sightings_count)
+            record['squares'] = len(self.sighting_positions)
+
+
+        ''' Initialize wind speed data '''
+        with self.profiler.stage('read_wind', mode=self.wind_speed_mode) as record:
+            if self.wind_speed_mode == "raster":
+                self.wind_speed_gdf = None
+                self.wind_speed_pixels = self.__load_wind_raster(wind_speed_data_path, base.crs)
+
+            else:
+                data = read_points(wind_speed_data_path, ['windSpeed'], bbox_with_margin(self.coord_range, self.grid_size))
+
+                geometry = [Point(lon, lat) for lon, lat in zip(data['lon'], data['lat'])]
+                observations = gpd.GeoDataFrame(
+                    data[['windSpeed']],  # Keep the attribute column
+                    geometry=geometry,
+                    crs="EPSG:4326"  # WGS84 coordinate reference system
+                )
+                observations = observations.rename(columns={'windSpeed': 'windSpeedValue'})
 
+                self.wind_speed_gdf = observations
 
+                # Same points as plain arrays for the pyramid
+                x, y = base.project(data['lat'], data['lon'])
+                self.wind_speed_pixels = (x, y, data['windSpeed'].to_numpy(dtype=np.float64))
 
-        # Generate grid cells
-        grid_cells = []
-        size = self.grid_size
-        for y in np.arange(ymin, ymax, size):
-            for x in np.arange(xmin, xmax, size):
-                grid_cells.append(Polygon([
-                    (x, y), (x+size, y),
-                    (x+size, y+size), (x, y+size)
-                ]))
+            record['rows'] = len(self.wind_speed_pixels[2])
 
-        self.rows = int((ymax - ymin) // size + 1)
-        self.cols = int((xmax - xmin) // size + 1)
 
-        print(f"{self.rows=}, {self.cols=}")
+        ''' Wind at each hub height, for the power layer '''
+        hub_x, hub_y, hub_values, hub_bins = [], [], [], []
+        if self.hub_heights:
+            with self.profiler.stage('read_hub_heights', heights=len(self.hub_heights)) as record:
+                for i, path in enumerate(self.hub_height_paths.values()):
+                    x, y, values = read_raster_points(self.__hub_height_tif(path), base.crs)
+                    hub_x.append(x)
+                    hub_y.append(y)
+                    hub_values.append(values)
+                    hub_bins.append(np.full(len(values), i, dtype=np.int64))
+                record['rows'] = sum(len(values) for values in hub_values)
 
-        # Create final grid (in UTM)
-        grid_gdf = gpd.GeoDataFrame(geometry=grid_cells, crs=utm_gdf.crs)
-        # Convert back to WGS84
-        grid_gdf = grid_gdf.to_crs("EPSG:4326")  
 
-        self.gdf = grid_gdf
-        self.gdf['birdRisk'] = [0] * len(grid_gdf)
-        self.gdf['windSpeed'] = [0] * len(grid_gdf)
-        self.gdf['value'] = [0] * len(grid_gdf)
-        self.gdf['pso'] = [0] * len(grid_gdf)
+        ''' Resolution pyramid '''
+        with self.profiler.stage('pyramid', rows=len(base), base_size=base_size):
+            # Everything additive is binned once on the finest grid, coarser grids are block sums of it
+            # (the per-month risk comes from the sightings themselves, so only the totals are kept here)
+            sightings, _ = base.zonal_sum(base.index_of(*self.sightings_xy.T), self.sightings_count)
+            x, y, values = self.wind_speed_pixels
+            wind_sum, wind_count = base.zonal_sum(base.index_of(x, y), values)
+            layers = {
+                'sightings': sightings,
+                'windSum': wind_sum,
+                'windCount': wind_count,
+            }
+
+            # Every hub height in one pass, binned by height like the sightings are by month
+            if self.hub_heights:
+                layers['hubWindSum'], layers['hubWindCount'] = base.zonal_sum(
+                    base.index_of(np.concatenate(hub_x), np.concatenate(hub_y)), np.concatenate(hub_values),
+                    bins=np.concatenate(hub_bins), num_bins=len(self.hub_heights))
+
+            self.pyramid = LayerPyramid(base, layers)
+        self.level_geometry = {}
+
+
+        ''' Main dataframe '''
+        self.__set_level(self.grid_size)
 
         
         ''' Join all the dataframes together '''
@@ -321,18 +1215,135 @@ class Map:
 
         self.__update_wind_speed()
 
-        self.calculate_cost_value()
+        self.__update_power()
 
-        self.run_pso()
-        
-        # Initialize folium map
-        self.update_folium_map('value')
-        
-        # Save gdf to GeoJSON
-        if self.output_path:
-            self.gdf.to_file(self.output_path, driver="GeoJSON")
+        return None
+
+
+    def __bin_sightings(self):
+        ''' Sightings added up per sighting_bin_size square and per species x month bin, and a KD-tree over the squares '''
+        num_time_bins = len(self.years) * 12 + 1
+        self.sighting_positions, self.sighting_bin_counts = bin_sightings(
+            self.sightings_xy, self.sightings_count, self.sighting_bin_size,
+            bins=self.sightings_species * num_time_bins + self.sightings_bin,
+            num_bins=len(self.species) * num_time_bins,
+        )
+        self.sighting_totals = np.asarray(self.sighting_bin_counts.sum(axis=1)).ravel()
+        self.sightings_tree = cKDTree(self.sighting_positions)
+
+
+    @staticmethod
+    def __month_bins(obs_dates: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        ''' Years spanned by the observation dates, and each one's month bin (the last bin if it can't be parsed) '''
+        dates = pd.to_datetime(obs_dates, format="ISO8601", errors="coerce")
+        dated = dates.notna().to_numpy()
+
+        if not dated.any():
+            return np.arange(0), np.zeros(len(dates), dtype=np.int64)
+
+        year = dates.dt.year.to_numpy(dtype=np.float64)
+        month = dates.dt.month.to_numpy(dtype=np.float64)
+        years = np.arange(int(np.nanmin(year)), int(np.nanmax(year)) + 1)
+
+        bins = np.full(len(dates), len(years) * 12, dtype=np.int64)
+        bins[dated] = (year[dated] - years[0]).astype(np.int64) * 12 + month[dated].astype(np.int64) - 1
+        return years, bins
+
+
+    def __layer_arrays(self) -> tuple[dict[str, np.ndarray], dict]:
+        ''' Everything __restore_layers needs, as plain arrays plus json metadata '''
+        base = self.pyramid.base
+
+        arrays = {
+            'sightingsXY': self.sightings_xy,
+            'sightingsCount': self.sightings_count,
+            'sightingsBin': self.sightings_bin,
+            'sightingsSpecies': self.sightings_species,
+            'years': self.years,
+            'birdRiskPrefix': self.bird_risk_prefix,
+            'birdRiskUndated': self.bird_risk_undated,
+            'windSpeed': self.gdf['windSpeed'].to_numpy(),
+        }
+        if self.render_mode == "geojson":
+            self.__add_geometry()  # the first render needs it anyway
+        if 'geometry' in self.gdf:
+            # Cell corners already in WGS84, so a warm start doesn't reproject anything
+            arrays['cellCorners'] = shapely.get_coordinates(self.gdf.geometry.values).reshape(len(self.gdf), -1, 2)
+        for name, layer in self.pyramid.layers.items():
+            arrays[f'pyramid_{name}'] = layer
+        if self.adaptive:
+            arrays['quadtreeLevel'] = self.grid.level
+            arrays['quadtreeCell'] = self.grid.cell
+
+        meta = {
+            'comName': self.comName,
+            'species': self.species,
+            'speciesNames': self.species_names,
+            'crs': base.crs.to_wkt(),
+            'base': [base.xmin, base.ymin, base.size, base.rows, base.cols],
+        }
+        return arrays, meta
+
+
+    def __restore_layers(self, arrays: dict[str, np.ndarray], meta: dict):
+        ''' Inverse of __layer_arrays: rebuilds the Map state without reading any data '''
+        xmin, ymin, size, rows, cols = meta['base']
+        base = Grid(CRS.from_wkt(meta['crs']), xmin, ymin, xmin + cols * size, ymin + rows * size, size)
+        base.rows, base.cols = rows, cols
+
+        self.comName = meta['comName']
+        self.sightings_xy = np.asarray(arrays['sightingsXY'])
+        self.sightings_count = np.asarray(arrays['sightingsCount'])
+        self.sightings_bin = np.asarray(arrays['sightingsBin'])
+        self.sightings_species = np.asarray(arrays['sightingsSpecies'])
+        self.species = meta['species']
+        self.species_names = meta['speciesNames']
+        self.years = np.asarray(arrays['years'])
+        self.__bin_sightings()
+        self.wind_speed_gdf = None
+
+        self.pyramid = LayerPyramid(base, {
+            name[len('pyramid_'):]: layer for name, layer in arrays.items() if name.startswith('pyramid_')
+        })
+        self.level_geometry = {}
+        if 'cellCorners' in arrays:
+            # One closed ring per cell, straight from the flat coordinate array
+            corners = np.asarray(arrays['cellCorners'])
+            cells, ring = corners.shape[:2]
+            polygons = shapely.from_ragged_array(
+                shapely.GeometryType.POLYGON,
+                corners.reshape(-1, 2),
+                (np.arange(0, cells * ring + 1, ring), np.arange(cells + 1)),
+            )
+            self.level_geometry[self.grid_size] = gpd.GeoSeries(polygons, crs="EPSG:4326")
+        if self.adaptive:
+            fine, _ = self.pyramid.level(self.min_grid_size)
+            max_level = int(round(math.log2(self.grid_size / self.min_grid_size)))
+            self.quadtrees = {self.grid_size: Quadtree(fine, max_level, arrays['quadtreeLevel'], arrays['quadtreeCell'])}
+
+        self.__set_level(self.grid_size)
+        self.bird_risk_prefix = np.asarray(arrays['birdRiskPrefix'])
+        self.bird_risk_undated = np.asarray(arrays['birdRiskUndated'])
+        self.__apply_time_window()
+        self.gdf['windSpeed'] = np.asarray(arrays['windSpeed'])
+        self.versions['windSpeed'] += 1
+        self.__update_power()
 
         return None
+
+
+    def __wind_source_path(self, wind_speed_data_path: str) -> str:
+        ''' The wind file actually read: the .tif next to the processed points in "raster" mode '''
+        if self.wind_speed_mode == "raster" and not wind_speed_data_path.endswith(".tif"):
+            return f"{wind_speed_data_path.rsplit('.', 1)[0]}.tif"
+        return wind_speed_data_path
+
+
+    def __hub_height_tif(self, path: str) -> str:
+        ''' Hub height rasters are always read as GeoTIFFs, the .tif next to a processed .parquet/.jsonl works too '''
+        if not path.endswith(".tif"):
+            return f"{path.rsplit('.', 1)[0]}.tif"
+        return path
     
 
 
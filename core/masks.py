@@ -0,0 +1,69 @@
+import geopandas as gpd
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import rasterize
+from rasterio.vrt import WarpedVRT
+from shapely.geometry import box
+
+from .grid import Grid, block_sum
+
+
+''' Boolean (rows, cols) exclusion masks on a Grid, True where a turbine can't go '''
+
+
+def grid_transform(grid: Grid) -> Affine:
+    ''' Affine of the grid's cells with row 0 at the south, like the cell index '''
+    return Affine(grid.size, 0, grid.xmin, 0, grid.size, grid.ymin)
+
+
+def polygon_mask(grid: Grid, polygons: str | gpd.GeoDataFrame, all_touched: bool = False) -> np.ndarray:
+    '''
+    Rasterizes protected area (or any other) polygons onto the grid in one call.
+
+    :param polygons: a GeoDataFrame or any file geopandas reads (shapefile, GeoPackage, GeoJSON), in any crs
+    :param all_touched: exclude every cell a polygon touches instead of just the ones whose centre is inside
+    :return: (rows, cols) bool array
+    '''
+    if isinstance(polygons, str):
+        # Only the polygons around the grid are read from the file (the box is reprojected to the file's crs)
+        polygons = gpd.read_file(polygons, bbox=gpd.GeoSeries([box(grid.xmin, grid.ymin, grid.xmax, grid.ymax)], crs=grid.crs))
+
+    geometry = polygons.to_crs(grid.crs).geometry
+    geometry = geometry[geometry.notna() & ~geometry.is_empty]
+    if geometry.empty:
+        return np.zeros(grid.shape, dtype=bool)
+
+    return rasterize(((shape, 1) for shape in geometry), out_shape=grid.shape, transform=grid_transform(grid),
+                     fill=0, all_touched=all_touched, dtype="uint8").astype(bool)
+
+
+def slope_mask(grid: Grid, dem_path: str, max_slope: float, oversample: int = 4) -> np.ndarray:
+    '''
+    Cells whose mean terrain slope is over max_slope degrees.
+
+    The DEM is warped straight onto oversample x oversample subcells of the grid (so the slope is
+    taken in meters whatever the DEM's crs, and only the part under the grid is read), then slope
+    is averaged back to the cells with a block sum.
+
+    :return: (rows, cols) bool array
+    '''
+    size = grid.size / oversample
+    height, width = grid.rows * oversample, grid.cols * oversample
+
+    # North-up for the warp, flipped to the grid's south-first rows after
+    with rasterio.open(dem_path) as dem, \
+            WarpedVRT(dem, crs=grid.crs, transform=Affine(size, 0, grid.xmin, 0, -size, grid.ymax),
+                      width=width, height=height, resampling=Resampling.bilinear) as vrt:
+        elevation = vrt.read(1, masked=True).astype(np.float64).filled(np.nan)[::-1]
+
+    dz_dy, dz_dx = np.gradient(elevation, size)
+    slope = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+
+    # Mean over the subcells that have data, cells with none aren't excluded
+    valid = ~np.isnan(slope)
+    slope_sum = block_sum(np.where(valid, slope, 0), oversample)
+    count = block_sum(valid.astype(np.int64), oversample)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return slope_sum / count > max_slope
@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+
+
+''' Turbine power curves and the expected capacity factor they give for a mean wind speed '''
+
+
+class PowerCurve:
+    ''' Turbine output from a table of (wind speed, power) points, linearly interpolated in between '''
+
+    '''
+    attributes
+    - speeds: wind speeds in m/s, increasing, the last one is the cut-out speed
+    - power: output in kW at each of those speeds
+    - rated_power: nameplate output in kW (the table's max unless given)
+
+    Output is 0 below the first speed and above the last one, so a table starting at cut-in
+    and ending at cut-out is all it takes.
+    '''
+
+    def __init__(self, speeds: list[float], power: list[float], rated_power: float = None):
+        self.speeds = np.asarray(speeds, dtype=np.float64)
+        self.power = np.asarray(power, dtype=np.float64)
+        self.rated_power = float(rated_power if rated_power is not None else self.power.max())
+        assert self.speeds.shape == self.power.shape, "Need one power value per speed"
+        assert np.all(np.diff(self.speeds) > 0), "Speeds must be increasing"
+
+    @classmethod
+    def generic(cls, rated_power: float, cut_in: float, rated_speed: float, cut_out: float, step: float = 0.5):
+        ''' Table for a textbook curve: cubic from cut_in to rated_speed, flat until cut_out '''
+        speeds = np.append(np.arange(cut_in, rated_speed, step), [rated_speed, cut_out])
+        ramp = (speeds ** 3 - cut_in ** 3) / (rated_speed ** 3 - cut_in ** 3)
+        return cls(speeds, rated_power * np.clip(ramp, 0, 1), rated_power)
+
+    def output(self, speed: np.ndarray) -> np.ndarray:
+        ''' Power in kW at each wind speed '''
+        return np.interp(speed, self.speeds, self.power, left=0, right=0)
+
+    def to_dict(self) -> dict:
+        return {'speeds': self.speeds.tolist(), 'power': self.power.tolist(), 'rated_power': self.rated_power}
+
+
+''' Generic curves for the usual onshore classes (not any manufacturer's), add real ones the same way '''
+TURBINES = {
+    "2 MW (IEC class II)": PowerCurve.generic(2000, cut_in=3.0, rated_speed=12.0, cut_out=25.0),
+    "3.6 MW low wind (IEC class III)": PowerCurve.generic(3600, cut_in=2.5, rated_speed=10.5, cut_out=22.0),
+    "5 MW (IEC class I)": PowerCurve.generic(5000, cut_in=3.5, rated_speed=13.0, cut_out=25.0),
+}
+
+
+def capacity_factor_table(curves: list[PowerCurve], weibull_k: float = 2.0, max_mean: float = 30.0,
+                          mean_step: float = 0.05, speed_step: float = 0.1) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Expected capacity factor of each curve for a grid of mean wind speeds, assuming the speed at
+    a site follows a Weibull distribution with shape weibull_k (2 is the usual Rayleigh guess when
+    only the mean is known) and that mean.
+
+    :return: (means,) array and (means, curves) array of capacity factors
+    '''
+    means = np.arange(0, max_mean + mean_step, mean_step)
+    edges = np.arange(0, max(curve.speeds[-1] for curve in curves) + 2 * speed_step, speed_step)
+    centres = (edges[:-1] + edges[1:]) / 2
+
+    # Weibull scale for each mean, then the probability of each speed bin from the CDF
+    scale = means / math.gamma(1 + 1 / weibull_k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cdf = 1 - np.exp(-(edges[np.newaxis, :] / scale[:, np.newaxis]) ** weibull_k)
+    cdf[scale == 0] = 1  # no wind at all, every bit of probability at 0 m/s
+    probability = np.diff(cdf, axis=1)
+
+    # (speed bins, curves) normalized output, so one matrix multiply covers every mean and curve
+    output = np.column_stack([curve.output(centres) / curve.rated_power for curve in curves])
+
+    return means, probability @ output
+
+
+def capacity_factors(mean_speeds: np.ndarray, curves: list[PowerCurve], weibull_k: float = 2.0) -> np.ndarray:
+    '''
+    Expected capacity factor for every mean wind speed and curve, by linear interpolation in
+    capacity_factor_table (the integral over the speed distribution only depends on the mean).
+
+    :param mean_speeds: array of any shape, e.g. (hub heights, cells), NaN stays NaN
+    :return: array of shape mean_speeds.shape + (len(curves),)
+    '''
+    means, table = capacity_factor_table(curves, weibull_k)
+    step = means[1] - means[0]
+
+    # Fractional position in the table, clipped to its ends, then one gather for every curve at once
+    position = np.clip(np.asarray(mean_speeds, dtype=np.float64) / step, 0, len(means) - 1)
+    low = np.floor(np.nan_to_num(position)).astype(np.int64)
+    high = np.minimum(low + 1, len(means) - 1)
+    weight = (position - low)[..., np.newaxis]
+
+    return table[low] * (1 - weight) + table[high] * weight
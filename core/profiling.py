@@ -0,0 +1,116 @@
+import itertools
+import logging
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable
+
+
+PROFILE_FIELDS = ('stage', 'parent', 'depth', 'seq', 'rows', 'wall_s', 'cpu_s', 'alloc_mb', 'net_mb')
+
+
+class StageProfiler:
+    ''' Times named stages (wall, CPU, memory, row counts) and hands each record to a list of hooks '''
+
+    '''
+    Stages can be nested, a record is emitted when its stage ends (so children come before their parent).
+    Each record is a plain dict:
+    - stage: name, parent: enclosing stage name (None at the top), depth: nesting level, seq: start order
+    - wall_s, cpu_s: wall clock and process CPU time
+    - alloc_mb, net_mb: peak allocation above the start and memory still held at the end
+      (None unless track_memory, tracemalloc slows allocation heavy code down)
+    - rows: number of rows/cells/points the stage worked on, plus any extra info the stage adds
+
+    attributes
+    - hooks: callables taking a record, called as each stage ends
+    - records: records since the last reset (the last "run"), at most max_records
+    - track_memory: measure memory with tracemalloc
+    '''
+
+    def __init__(self, hooks: list[Callable[[dict], None]] = None, track_memory: bool = False, max_records: int = 1000):
+        self.hooks = list(hooks or [])
+        self.records = deque(maxlen=max_records)
+        self.track_memory = track_memory
+        self.__stack = []
+        self.__started_tracing = False
+        self.__seq = itertools.count()
+
+    def add_hook(self, hook: Callable[[dict], None]):
+        if hook not in self.hooks:
+            self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[dict], None]):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def reset(self):
+        ''' Starts a new run, e.g. at the top of every Streamlit rerun '''
+        self.records.clear()
+
+    @contextmanager
+    def stage(self, name: str, **info):
+        ''' Context manager around one stage, yields the record so the body can add rows/info to it '''
+        record = {'stage': name, 'parent': self.__stack[-1]['stage'] if self.__stack else None,
+                  'depth': len(self.__stack), 'seq': next(self.__seq), 'rows': None, **info}
+
+        memory = self.track_memory
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.__started_tracing = True
+            start_mem = tracemalloc.get_traced_memory()[0]
+            # Peaks of finished children, since resetting the peak for them hides it from us
+            record['_child_peak'] = 0
+            tracemalloc.reset_peak()
+
+        self.__stack.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            self.__stack.pop()
+
+            if memory:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, record.pop('_child_peak'))
+                record['alloc_mb'] = (peak - start_mem) / 2 ** 20
+                record['net_mb'] = (current - start_mem) / 2 ** 20
+                if self.__stack and '_child_peak' in self.__stack[-1]:
+                    self.__stack[-1]['_child_peak'] = max(self.__stack[-1]['_child_peak'], peak)
+                elif not self.__stack and self.__started_tracing:
+                    tracemalloc.stop()
+                    self.__started_tracing = False
+            else:
+                record['alloc_mb'] = record['net_mb'] = None
+
+            self.records.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def summary(self) -> list[dict]:
+        ''' Records of the last run in start order (parents before their children) '''
+        return sorted(self.records, key=lambda record: record['seq'])
+
+
+def print_hook(record: dict):
+    ''' Hook printing one line per stage, the default for Map '''
+    line = f"{'  ' * record['depth']}{record['stage']}: {record['wall_s']:.3f} s (cpu {record['cpu_s']:.3f} s)"
+    if record['alloc_mb'] is not None:
+        line += f", peak +{record['alloc_mb']:.1f} MB"
+    extra = {k: v for k, v in record.items() if k not in PROFILE_FIELDS and v is not None}
+    if record['rows'] is not None:
+        extra = {'rows': record['rows'], **extra}
+    if extra:
+        line += " " + " ".join(f"{k}={v}" for k, v in extra.items())
+    print(line)
+
+
+def logging_hook(logger, level: int = logging.INFO) -> Callable[[dict], None]:
+    ''' Hook sending each record to a logging.Logger with the record as extra={'profile': ...} '''
+    def hook(record: dict):
+        logger.log(level, "%s took %.3f s", record['stage'], record['wall_s'], extra={'profile': dict(record)})
+    return hook
+
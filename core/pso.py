@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def run_pso(values: np.ndarray,
+            num_particles: int = 30,
+            max_iter: int = 100,
+            w: float = 0.5,
+            c1: float = 1.5,
+            c2: float = 1.5,
+            seed: int = None,
+            num_swarms: int = 1,
+            patience: int = 20,
+            tol: float = 1e-9):
+    '''
+    Particle swarm search for the highest cell of a 2D value grid.
+
+    All particles of all swarms move together as one (swarms, particles, 2) array, so an
+    iteration is a handful of numpy operations plus one fancy-index lookup into values.
+    The swarms are independent (each has its own global best), which is the same as running
+    num_swarms restarts in one call.
+
+    :param values: (rows, cols) array to maximize, positions are [x, y] = [col, row]. Non-finite cells
+      (-inf for excluded ones) can be flown over but never become a best, particles start on finite cells only
+    :param seed: seed for the random generator, gives reproducible results
+    :param num_swarms: number of independent swarms (restarts)
+    :param patience: stop once no swarm has improved by more than tol for this many iterations
+    :return: (best_x, best_y), best_score over all swarms, ((-1, -1), -inf) if no cell is finite
+    '''
+    rows, cols = values.shape
+    upper = np.array([cols - 1, rows - 1], dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    swarms = np.arange(num_swarms)
+
+    def get_fitness(pos):
+        cells = pos.astype(np.intp)
+        return values[cells[..., 1], cells[..., 0]]
+
+    # Every particle starts somewhere in a random finite cell, so every personal best is a real cell
+    allowed = np.flatnonzero(np.isfinite(values))
+    if len(allowed) == 0:
+        return (-1, -1), float('-inf')
+    start_y, start_x = np.divmod(rng.choice(allowed, (num_swarms, num_particles)), cols)
+    positions = np.minimum(np.stack([start_x, start_y], axis=-1) + rng.random((num_swarms, num_particles, 2)), upper)
+    velocities = rng.standard_normal((num_swarms, num_particles, 2))
+
+    # Initialize personal and global bests
+    pBest = positions.copy()
+    pBest_scores = get_fitness(positions)
+    best = pBest_scores.argmax(axis=1)
+    gBest = pBest[swarms, best]
+    gBest_scores = pBest_scores[swarms, best]
+
+    stalled = 0
+    for _ in range(max_iter):
+        # One random pair per particle (not one per iteration)
+        r1 = rng.random((num_swarms, num_particles, 1))
+        r2 = rng.random((num_swarms, num_particles, 1))
+
+        velocities = (
+            w * velocities
+            + c1 * r1 * (pBest - positions)
+            + c2 * r2 * (gBest[:, np.newaxis, :] - positions)
+        )
+        positions = np.clip(positions + velocities, 0, upper)
+
+        fitness = get_fitness(positions)
+        improved = fitness > pBest_scores
+        pBest[improved] = positions[improved]
+        pBest_scores[improved] = fitness[improved]
+
+        best = pBest_scores.argmax(axis=1)
+        new_scores = pBest_scores[swarms, best]
+
+        # Converged once none of the swarms finds anything better for a while
+        stalled = stalled + 1 if np.all(new_scores - gBest_scores <= tol) else 0
+        gBest = pBest[swarms, best]
+        gBest_scores = new_scores
+
+        if patience and stalled >= patience:
+            break
+
+    winner = gBest_scores.argmax()
+    best_x, best_y = gBest[winner].astype(int)
+
+    return (int(best_x), int(best_y)), float(gBest_scores[winner])
@@ -0,0 +1,42 @@
+import numpy as np
+
+from .grid import Grid, block_sum
+
+
+class LayerPyramid:
+    ''' Additive layers binned once on the finest grid, block-summed to any coarser grid size '''
+
+    '''
+    attributes
+    - base: finest Grid
+    - layers: dict of (rows, cols, ...) arrays on the base grid (flat (cells, ...) ones are reshaped),
+      must be sums (counts, totals) so blocks add up
+    - levels: cache of grid_size -> (Grid, dict of block-summed layers)
+    '''
+
+    def __init__(self, base: Grid, layers: dict[str, np.ndarray]):
+        self.base = base
+        self.layers = {name: self.__as_grid(np.asarray(layer)) for name, layer in layers.items()}
+        self.levels = {}
+
+    def __as_grid(self, layer: np.ndarray) -> np.ndarray:
+        ''' (cells, ...) arrays are reshaped to (rows, cols, ...), (rows, cols, ...) ones are kept '''
+        if layer.shape[:2] == self.base.shape:
+            return layer
+        return layer.reshape(self.base.shape + layer.shape[1:])
+
+    def level(self, grid_size: int) -> tuple[Grid, dict[str, np.ndarray]]:
+        ''' Grid and layers for a grid size that is a multiple of the base size '''
+        assert grid_size % self.base.size == 0, f"grid size must be a multiple of {self.base.size} m"
+
+        if grid_size not in self.levels:
+            factor = int(grid_size // self.base.size)
+            grid = self.base.coarsen(factor) if factor > 1 else self.base
+            self.levels[grid_size] = (grid, {name: block_sum(layer, factor) for name, layer in self.layers.items()})
+
+        return self.levels[grid_size]
+
+    def precompute(self, grid_sizes: list[int]):
+        ''' Fills the cache up front, e.g. for the 1/5/10/20 km options in the app '''
+        for grid_size in grid_sizes:
+            self.level(grid_size)
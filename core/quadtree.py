@@ -0,0 +1,210 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from functools import cached_property
+
+from .grid import Grid
+
+
+class Quadtree:
+    ''' Adaptive grid: square leaves of several sizes, each one a cell of some coarsening of a fine Grid '''
+
+    '''
+    attributes
+    - fine: finest Grid (level 0), level l is fine.coarsen(2 ** l), so a level l cell covers 2^l x 2^l fine cells
+    - grids: Grid of each level, finest first
+    - level, cell: level of each leaf and its flat cell index in that level's Grid, coarsest leaves first
+    - leaf_of: (fine rows * fine cols,) index of the leaf each fine cell is in
+    - size, shape, crs: the fine grid's, so rasters of the leaves line up with it
+
+    Leaves are numbered in the order of level and cell, which is also the Map gdf index. Apart from
+    leaf_of (one index per fine cell) only per-leaf arrays are stored, and a fine-grid raster of any
+    of them is one gather through leaf_of.
+    '''
+
+    def __init__(self, fine: Grid, max_level: int, level: np.ndarray, cell: np.ndarray):
+        self.fine = fine
+        self.grids = [fine] + [fine.coarsen(2 ** l) for l in range(1, max_level + 1)]
+        self.level = np.asarray(level, dtype=np.int8)
+        self.cell = np.asarray(cell, dtype=np.int64)
+        assert np.all(np.diff(self.level) <= 0), "Leaves must be ordered coarsest level first"
+
+        # Each level's leaves painted onto the fine grid, they tile it so every fine cell gets exactly one
+        self.leaf_of = np.full(len(fine), -1, dtype=np.int64)
+        for l, leaves in self.leaves_by_level():
+            grid, factor = self.grids[l], 2 ** l
+            painted = np.full(len(grid), -1, dtype=np.int64)
+            painted[self.cell[leaves]] = leaves
+            painted = painted.reshape(grid.shape).repeat(factor, axis=0).repeat(factor, axis=1)[:fine.rows, :fine.cols]
+            self.leaf_of = np.where(painted.ravel() >= 0, painted.ravel(), self.leaf_of)
+
+    def __len__(self):
+        return len(self.level)
+
+    @property
+    def size(self):
+        return self.fine.size
+
+    @property
+    def shape(self):
+        return self.fine.shape
+
+    @property
+    def crs(self):
+        return self.fine.crs
+
+    @property
+    def sizes(self) -> list[int]:
+        ''' Cell size of each level in meters, finest first '''
+        return [grid.size for grid in self.grids]
+
+    def leaves_by_level(self):
+        ''' (level, leaf indices) for every level that has leaves, coarsest first '''
+        for l in range(len(self.grids) - 1, -1, -1):
+            leaves = np.flatnonzero(self.level == l)
+            if len(leaves):
+                yield l, leaves
+
+    @cached_property
+    def bounds(self) -> np.ndarray:
+        ''' (leaves, 4) array of [minx, miny, maxx, maxy] '''
+        bounds = np.empty((len(self), 4), dtype=np.float64)
+        for l, leaves in self.leaves_by_level():
+            bounds[leaves] = self.grids[l].bounds[self.cell[leaves]]
+        return bounds
+
+    @cached_property
+    def centroids(self) -> np.ndarray:
+        return (self.bounds[:, :2] + self.bounds[:, 2:]) / 2
+
+    @cached_property
+    def representatives(self) -> np.ndarray:
+        ''' Fine cell at the centre of each leaf (clipped to the grid for leaves hanging over its edge) '''
+        factor = 2 ** self.level.astype(np.int64)
+        row, col = np.divmod(self.cell, np.array([grid.cols for grid in self.grids])[self.level])
+        row = np.minimum(row * factor + factor // 2, self.fine.rows - 1)
+        col = np.minimum(col * factor + factor // 2, self.fine.cols - 1)
+        return row * self.fine.cols + col
+
+    def to_gdf(self, crs="EPSG:4326") -> gpd.GeoDataFrame:
+        ''' One polygon per leaf, projected to crs '''
+        gdf = gpd.GeoDataFrame(geometry=shapely.box(*self.bounds.T), crs=self.crs)
+        if crs is not None:
+            gdf = gdf.to_crs(crs)
+        return gdf
+
+    def gather(self, level_arrays: list[np.ndarray]) -> np.ndarray:
+        '''
+        Per-leaf values from one array per level, e.g. pyramid block sums at each level's size.
+
+        :param level_arrays: (rows, cols, ...) or (cells, ...) array for every level, finest first
+        :return: (leaves, ...) array
+        '''
+        parts = []
+        for l, leaves in self.leaves_by_level():
+            values = np.asarray(level_arrays[l])
+            if values.shape[:2] == self.grids[l].shape:
+                values = values.reshape((len(self.grids[l]),) + values.shape[2:])
+            parts.append(values[self.cell[leaves]])
+        return np.concatenate(parts)
+
+    def raster(self, values: np.ndarray) -> np.ndarray:
+        ''' (..., leaves) array painted onto the fine grid as (..., rows, cols) '''
+        values = np.asarray(values)
+        return values[..., self.leaf_of].reshape(values.shape[:-1] + self.fine.shape)
+
+    def cell_of(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        ''' (row, col) of the fine cell under each WGS84 point and the leaf it's in, all -1 outside the grid '''
+        row, col, index = self.fine.cell_of(lat, lon)
+        return row, col, np.where(index >= 0, self.leaf_of[np.maximum(index, 0)], -1)
+
+    def row_col(self, index: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        ''' Fine (row, col) of the south-west corner of each leaf, -1 stays -1 '''
+        index = np.asarray(index, dtype=np.int64)
+        outside = index < 0
+        index = np.maximum(index, 0)
+        level = self.level[index].astype(np.int64)
+        row, col = np.divmod(self.cell[index], np.array([grid.cols for grid in self.grids])[level])
+        return np.where(outside, -1, row * 2 ** level), np.where(outside, -1, col * 2 ** level)
+
+    def centre_of(self, index: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        ''' WGS84 (lat, lon) of the centre of each leaf (NaN for -1) '''
+        index = np.asarray(index, dtype=np.int64)
+        outside = index < 0
+        x, y = self.centroids[np.maximum(index, 0)].T
+        lon, lat = self.fine.to_wgs84.transform(np.where(outside, np.nan, x), np.where(outside, np.nan, y))
+        return np.asarray(lat), np.asarray(lon)
+
+
+def children(grid: Grid, child: Grid, cells: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    ''' Flat indices in child (the level below grid) of the 4 children of each of grid's cells, and which of cells each one is in '''
+    row, col = np.divmod(cells, grid.cols)
+    rows = (2 * row[:, np.newaxis] + np.array([0, 0, 1, 1])).ravel()
+    cols = (2 * col[:, np.newaxis] + np.array([0, 1, 0, 1])).ravel()
+    parent = np.repeat(np.arange(len(cells)), 4)
+
+    # Cells on the far edges can have children past the edge of the finer level
+    inside = (rows < child.rows) & (cols < child.cols)
+    return rows[inside] * child.cols + cols[inside], parent[inside]
+
+
+def refine(fine: Grid, max_level: int, values, counts=None,
+           threshold: float = 0.05, max_count: float = None, spread=None) -> Quadtree:
+    '''
+    Builds a Quadtree top-down: every cell of the coarsest level (fine.coarsen(2 ** max_level))
+    starts as a candidate, and a candidate is split into its 4 children when it doesn't stand for
+    them well enough, i.e. when
+    - one of its layers differs by more than threshold (as a share of that layer's range over the
+      coarsest level) from the same layer at one of its children,
+    - or the spread of a layer inside it (e.g. the standard deviation of the fine cells' wind) is more than
+      threshold of that range, for variation too fine to show up in the children,
+    - or it holds more than max_count sightings.
+    Cells of the fine grid are never split.
+
+    Only the candidates and their children are ever evaluated, and the children's values are the
+    next level's candidates' values. Memory goes with the number of leaves, not the fine grid
+    (the Quadtree it returns has one fine-grid-sized array, leaf_of).
+
+    :param values: values(level, cells) -> (layers, len(cells)) array of the layers at those cells of that level
+    :param counts: optional counts(level, cells) -> sighting count of those cells, used with max_count
+    :param spread: optional spread(level, cells) -> (layers, len(cells)) variation of each layer inside those cells,
+      rows in the same order as values' and NaN for layers it doesn't measure
+    :return: the Quadtree of the leaves
+    '''
+    grids = [fine] + [fine.coarsen(2 ** l) for l in range(1, max_level + 1)]
+    candidates = np.arange(len(grids[max_level]))
+    current = np.atleast_2d(np.asarray(values(max_level, candidates), dtype=np.float64))
+    leaf_levels, leaf_cells = [], []
+
+    span = np.nanmax(current, axis=1) - np.nanmin(current, axis=1) if current.size else np.ones(len(current))
+    span = np.where(np.isfinite(span) & (span > 0), span, 1.0)[:, np.newaxis]
+
+    for l in range(max_level, 0, -1):
+        child_cells, parent = children(grids[l], grids[l - 1], candidates)
+        child_values = np.atleast_2d(np.asarray(values(l - 1, child_cells), dtype=np.float64))
+
+        # Biggest gap between each candidate and its children, over all layers (NaN never forces a split)
+        gap = np.nan_to_num(np.abs(child_values - current[:, parent]) / span).max(axis=0)
+        worst = np.zeros(len(candidates))
+        np.maximum.at(worst, parent, gap)
+        split = worst > threshold
+
+        if spread is not None and len(candidates):
+            inside = np.atleast_2d(np.asarray(spread(l, candidates), dtype=np.float64)) / span
+            split |= np.nan_to_num(inside).max(axis=0) > threshold
+        if counts is not None and max_count is not None and len(candidates):
+            split |= np.asarray(counts(l, candidates)) > max_count
+
+        leaf_levels.append(np.full((~split).sum(), l))
+        leaf_cells.append(candidates[~split])
+
+        # The children of the split cells are the next level's candidates, sorted like the leaves
+        keep = split[parent]
+        order = np.argsort(child_cells[keep], kind="stable")
+        candidates = child_cells[keep][order]
+        current = child_values[:, keep][:, order]
+
+    leaf_levels.append(np.zeros(len(candidates), dtype=np.int64))
+    leaf_cells.append(candidates)
+
+    return Quadtree(fine, max_level, np.concatenate(leaf_levels), np.concatenate(leaf_cells))
@@ -0,0 +1,117 @@
+import base64
+
+import branca.colormap as cm
+import folium
+import numpy as np
+from branca.element import MacroElement
+from jinja2 import Template
+from pyproj import Transformer
+from rasterio.transform import Affine, from_origin
+from rasterio.warp import Resampling, calculate_default_transform, reproject
+
+from .grid import Grid
+
+
+NODATA = 65535  # marker for empty pixels in the quantized lookup
+
+
+class ValueLookup(MacroElement):
+    ''' Click handler that reads a cell's value from a compact (uint16, base64) copy of the overlay '''
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var bytes = atob("{{ this.data }}");
+            var values = new Uint16Array(bytes.length / 2);
+            for (var i = 0; i < values.length; i++) {
+                values[i] = bytes.charCodeAt(2 * i) | (bytes.charCodeAt(2 * i + 1) << 8);
+            }
+            var map = {{ this._parent.get_name() }};
+            map.on('click', function(e) {
+                // Leaflet's own web mercator projection, same crs the overlay was warped to
+                var p = L.CRS.EPSG3857.project(e.latlng);
+                var col = Math.floor((p.x - {{ this.left }}) / {{ this.res }});
+                var row = Math.floor(({{ this.top }} - p.y) / {{ this.res }});
+                if (col < 0 || row < 0 || col >= {{ this.width }} || row >= {{ this.height }}) { return; }
+                var q = values[row * {{ this.width }} + col];
+                if (q === {{ this.nodata }}) { return; }
+                var v = {{ this.vmin }} + q / {{ this.nodata - 1 }} * ({{ this.vmax }} - {{ this.vmin }});
+                L.popup().setLatLng(e.latlng).setContent("{{ this.label }}: " + v.toFixed(3)).openOn(map);
+            });
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, values: np.ndarray, transform, vmin: float, vmax: float, label: str):
+        super().__init__()
+        self._name = "ValueLookup"
+        self.height, self.width = values.shape
+        self.left, self.top, self.res = transform.c, transform.f, transform.a
+        self.vmin, self.vmax = vmin, vmax
+        self.nodata = NODATA
+        self.label = label
+
+        # 2 bytes per pixel, NaN -> NODATA
+        span = (vmax - vmin) or 1
+        quantized = np.round((values - vmin) / span * (NODATA - 1))
+        quantized = np.where(np.isnan(values), NODATA, quantized).astype('<u2')
+        self.data = base64.b64encode(quantized.tobytes()).decode("ascii")
+
+
+def image_overlay_map(grid: Grid, layer: np.ndarray, name: str, max_pixels: int = 1024, opacity: float = 0.5) -> folium.Map:
+    '''
+    Folium map showing a (rows, cols) layer as one georeferenced PNG instead of one polygon per cell.
+
+    The layer is warped from the grid's (meters-based) crs to web mercator (what Leaflet stretches overlays in),
+    at most max_pixels on the long side, so the page size doesn't grow with the number of cells.
+    Clicking the map shows the value under the cursor from a compact lookup array.
+    '''
+    # Rows of the grid go south -> north, images go north -> south
+    source = np.flipud(np.asarray(layer, dtype=np.float64))
+    src_transform = from_origin(grid.xmin, grid.ymax, grid.size, grid.size)
+
+    transform, width, height = calculate_default_transform(
+        grid.crs, "EPSG:3857", grid.cols, grid.rows,
+        left=grid.xmin, bottom=grid.ymin, right=grid.xmax, top=grid.ymax,
+    )
+
+    # Cap the image size, coarser pixels are fine for display (the cells are still exact in the gdf)
+    scale = max(width, height) / max_pixels
+    if scale > 1:
+        width, height = int(np.ceil(width / scale)), int(np.ceil(height / scale))
+        transform = transform * Affine.scale(scale)
+
+    warped = np.full((height, width), np.nan)
+    reproject(
+        source, warped,
+        src_transform=src_transform, src_crs=grid.crs, src_nodata=np.nan,
+        dst_transform=transform, dst_crs="EPSG:3857", dst_nodata=np.nan,
+        resampling=Resampling.nearest,
+    )
+
+    vmin, vmax = float(np.nanmin(layer)), float(np.nanmax(layer))
+    colormap = cm.linear.YlOrRd_09.scale(vmin, vmax)
+    colormap.caption = name
+
+    # Sample the colormap once into a lookup table instead of calling it per pixel
+    lut = np.array([colormap.rgba_bytes_tuple(v) for v in np.linspace(vmin, vmax, 256)], dtype=np.uint8)
+    span = (vmax - vmin) or 1
+    index = np.clip(np.nan_to_num((warped - vmin) / span * 255), 0, 255).astype(np.uint8)
+    rgba = lut[index]
+    rgba[..., 3] = np.where(np.isnan(warped), 0, 255)
+
+    # Overlay corners back in lat/lon for Leaflet
+    to_wgs84 = Transformer.from_crs("EPSG:3857", "EPSG:4326", always_xy=True)
+    west, north = to_wgs84.transform(transform.c, transform.f)
+    east, south = to_wgs84.transform(transform.c + width * transform.a, transform.f + height * transform.e)
+    bounds = [[south, west], [north, east]]
+
+    m = folium.Map(location=[(south + north) / 2, (west + east) / 2], tiles="OpenStreetMap")
+    folium.raster_layers.ImageOverlay(
+        image=rgba, bounds=bounds, opacity=opacity, name=name, mercator_project=False
+    ).add_to(m)
+    colormap.add_to(m)
+    m.add_child(ValueLookup(warped, transform, vmin, vmax, name))
+    m.fit_bounds(bounds)
+
+    return m
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+''' Direction each layer pulls the site value in (wind and power are good, bird risk is bad) '''
+LAYER_SIGNS = {
+    "windSpeed": 1.0,
+    "birdRisk": -1.0,
+    "power": 1.0,
+}
+
+
+class Scorer:
+    ''' Weighted sum of normalized layers, rescaled to [0, 1] '''
+
+    '''
+    attributes
+    - names: layer names, in the order of the rows of stack
+    - size: number of cells in the layers
+    - cells: indices of the cells that are scored (None for all of them), the rest always score 0
+    - stack: contiguous (layers, scored cells) float64 array holding sign * layer
+    - front: positions in stack of the Pareto-optimal cells (None until pareto_front is called)
+
+    methods
+    - score: one value array for a dict of coefficients
+    - score_batch: a stack of value arrays for a 2D array of weights (one row per coefficient set)
+    - pareto_front: cells no other cell beats on every layer at once
+    - best_cells: the highest scoring cell for each of many coefficient sets, searched on the front only
+    '''
+
+    def __init__(self, layers: dict[str, np.ndarray], signs: dict[str, float] = LAYER_SIGNS, mask: np.ndarray = None):
+        ''' mask is an optional bool array of the cells that can be scored, the others are dropped from the stack '''
+        self.names = list(layers.keys())
+        stack = np.stack([signs.get(name, 1.0) * np.asarray(layers[name], dtype=np.float64) for name in self.names])
+        self.size = stack.shape[1]
+        self.cells = None if mask is None else np.flatnonzero(mask)
+        self.stack = np.ascontiguousarray(stack if self.cells is None else stack[:, self.cells])
+        self.front = None
+
+    def __len__(self):
+        return self.size
+
+    def weights(self, coefficients: dict) -> np.ndarray:
+        ''' Coefficient dict -> weight vector in layer order (missing layers get 0) '''
+        return np.array([coefficients.get(name, 0) for name in self.names], dtype=np.float64)
+
+    def score(self, coefficients: dict) -> np.ndarray:
+        ''' Returns the [0, 1] value of every cell for one set of coefficients '''
+        return self.score_batch(self.weights(coefficients)[np.newaxis, :])[0]
+
+    def score_batch(self, weights: np.ndarray) -> np.ndarray:
+        '''
+        Scores many coefficient sets in one matrix multiply.
+
+        :param weights: (sets, layers) array, columns in the order of self.names
+        :return: (sets, cells) array, each row min-max rescaled to [0, 1] over the scored cells (the others are 0)
+        '''
+        weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+        assert weights.shape[1] == len(self.names), f"Expected {len(self.names)} weights per row ({self.names})"
+
+        values = weights @ self.stack
+        if values.shape[1] == 0:
+            return np.zeros((len(weights), self.size))
+
+        # Same result as MinMaxScaler, row by row and in place (a constant row becomes all 0)
+        low = values.min(axis=1, keepdims=True)
+        span = values.max(axis=1, keepdims=True) - low
+        span[span == 0] = 1
+        values -= low
+        values /= span
+
+        if self.cells is None:
+            return values
+
+        scored = values
+        values = np.zeros((len(weights), self.size))
+        values[:, self.cells] = scored
+        return values
+
+    def pareto_front(self) -> np.ndarray:
+        ''' Indices of the scored cells not dominated on sign * layer by any other one (computed once per Scorer) '''
+        if self.front is None:
+            self.front = np.flatnonzero(pareto_mask(self.stack.T))
+        return self.front if self.cells is None else self.cells[self.front]
+
+    def best_cells(self, weights: np.ndarray, chunk_size: int = 10_000_000) -> np.ndarray:
+        '''
+        Index of the best cell for each row of a (sets, layers) weights array, same as
+        score_batch(weights).argmax(axis=1) for non-negative weights. A weighted sum with non-negative
+        weights always peaks on the Pareto front, so only those cells are scored.
+        '''
+        weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+        front = self.pareto_front()
+        candidates = self.stack[:, self.front]
+
+        # Chunked so sets x front cells stays small even for big sweeps
+        step = max(chunk_size // max(len(front), 1), 1)
+        best = np.empty(len(weights), dtype=np.int64)
+        for start in range(0, len(weights), step):
+            best[start:start + step] = (weights[start:start + step] @ candidates).argmax(axis=1)
+
+        return front[best]
+
+
+def pareto_mask(points: np.ndarray, block_size: int = 1024) -> np.ndarray:
+    '''
+    Boolean mask of the Pareto-optimal rows of a (n, k) array, maximizing every column.
+    Identical rows are all kept. Two columns take one sort and a running max, more fall back to
+    checking blocks of candidates (in decreasing sum order) against the front found so far.
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    unique, inverse = np.unique(points, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    if unique.shape[1] == 1:
+        return (unique[:, 0] == unique[:, 0].max())[inverse]
+
+    if unique.shape[1] == 2:
+        # np.unique sorts ascending by the first column then the second, so walking it backwards visits
+        # points by decreasing first column: a point is dominated iff an earlier one has a second column >= its own
+        second = unique[::-1, 1]
+        best_before = np.concatenate([[-np.inf], np.maximum.accumulate(second)[:-1]])
+        keep = (second > best_before)[::-1]
+        return keep[inverse]
+
+    # A point can only be dominated by one with a bigger sum, so the front grows in sum order
+    order = np.argsort(-unique.sum(axis=1), kind="stable")
+    front = np.empty((0, unique.shape[1]))
+    keep = np.zeros(len(unique), dtype=bool)
+
+    for start in range(0, len(order), block_size):
+        block = order[start:start + block_size]
+        candidates = unique[block]
+
+        # Dominated by the front so far (ties are impossible, the rows are unique)
+        dominated = (front[None, :, :] >= candidates[:, None, :]).all(axis=2).any(axis=1)
+
+        # or by another candidate in the same block
+        inner = (candidates[None, :, :] >= candidates[:, None, :]).all(axis=2)
+        np.fill_diagonal(inner, False)
+        dominated |= inner.any(axis=1)
+
+        keep[block[~dominated]] = True
+        front = np.concatenate([front, candidates[~dominated]])
+
+    return keep[inverse]
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+def disc_offsets(radius_cells: float) -> tuple[np.ndarray, np.ndarray]:
+    ''' (dy, dx) offsets of every cell whose centre is closer than radius_cells to the origin cell '''
+    r = int(np.ceil(radius_cells))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx ** 2 + dy ** 2 < radius_cells ** 2
+    return dy[inside], dx[inside]
+
+
+def select_sites(values: np.ndarray, k: int = 1, min_spacing: float = 0) -> list[tuple[int, int]]:
+    '''
+    Picks up to k cells of a 2D value grid, best first, keeping them min_spacing cells apart.
+
+    Each pick is the highest cell that is not within min_spacing of an earlier pick (greedy
+    non-maximum suppression). Candidates come from a partial sort (argpartition) that is only
+    widened if suppression eats the whole pool, and suppression just flags a precomputed disc
+    of cells around each pick, so there's no full sort of the grid.
+
+    :param values: (rows, cols) grid, non-finite cells are never picked
+    :param min_spacing: minimum centre-to-centre distance between picks, in cells
+    :return: list of (x, y) = (col, row), best first
+    '''
+    rows, cols = values.shape
+    flat = values.ravel()
+    n_valid = int(np.isfinite(flat).sum())
+    # -inf sorts last and is skipped below, so masked/NaN cells can't be selected
+    scores = np.where(np.isfinite(flat), flat, -np.inf)
+
+    dy, dx = disc_offsets(min_spacing) if min_spacing > 0 else (np.zeros(1, dtype=int), np.zeros(1, dtype=int))
+    suppressed = np.zeros(flat.shape, dtype=bool)
+
+    picks = []
+    pool = min(max(4 * k, 64), n_valid)
+    while pool > 0:
+        # Top `pool` cells (unordered), then sort just those, highest first
+        top = np.argpartition(-scores, pool - 1)[:pool] if pool < flat.size else np.arange(flat.size)
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        free = top[~suppressed[top]]
+        while free.size and len(picks) < k:
+            y, x = divmod(int(free[0]), cols)
+            picks.append((x, y))
+
+            # Flag every cell within min_spacing of the new pick (including itself)
+            ny, nx = y + dy, x + dx
+            keep = (ny >= 0) & (ny < rows) & (nx >= 0) & (nx < cols)
+            suppressed[ny[keep] * cols + nx[keep]] = True
+            free = free[~suppressed[free]]
+
+        if len(picks) == k or pool == n_valid:
+            break
+
+        # Suppression ate the whole pool, widen it and look again
+        pool = min(pool * 4, n_valid)
+
+    return picks
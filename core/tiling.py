@@ -0,0 +1,180 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .grid import Grid
+from .kernels import kernel_sum
+
+
+''' Tile by tile (optionally process-parallel) versions of the per-cell computations, for grids too big to do in one go '''
+
+
+def plan_tiles(grid: Grid, tile_cells: int) -> list[tuple[int, int, int, int]]:
+    ''' Splits the grid into blocks of at most tile_cells x tile_cells cells, as (row_start, row_stop, col_start, col_stop) '''
+    return [
+        (row, min(row + tile_cells, grid.rows), col, min(col + tile_cells, grid.cols))
+        for row in range(0, grid.rows, tile_cells)
+        for col in range(0, grid.cols, tile_cells)
+    ]
+
+
+def _tile_kernel_sum(tile: Grid, xy: np.ndarray, counts: np.ndarray, bins: np.ndarray,
+                     num_bins: int, radius: float, kernel: str) -> np.ndarray:
+    ''' kernel_sum for one tile's cells, given only the sightings in its halo (runs in a worker process) '''
+    if len(xy) == 0:
+        return np.zeros((len(tile), num_bins) if bins is not None or np.ndim(counts) == 2 else len(tile))
+
+    return kernel_sum(cKDTree(xy), counts, cKDTree(tile.centroids), tile.size, radius, kernel,
+                      bins=bins, num_bins=num_bins)
+
+
+def tiled_kernel_sum(sightings_xy: np.ndarray,
+                     counts: np.ndarray,
+                     grid: Grid,
+                     radius: float,
+                     kernel: str = "disc",
+                     bins: np.ndarray = None,
+                     num_bins: int = 1,
+                     tile_cells: int = 256,
+                     num_workers: int = None,
+                     out: np.ndarray = None,
+                     reduce=None) -> np.ndarray:
+    '''
+    Same result as kernel_sum over the whole grid, computed one tile at a time so the sighting/cell
+    pairs (the part that blows up for big grids and radii) only ever exist for one tile per worker.
+
+    Each tile gets the sightings within its halo (radius plus half a cell diagonal past its edges, the
+    same cutoff kernel_sum uses), so tiles are exact and their results are just written into place.
+
+    :param sightings_xy: (n, 2) sighting positions in the grid crs
+    :param counts: (n,) counts with optional bins, or (n, num_bins) counts per bin like kernel_sum takes
+    :param num_workers: processes to spread the tiles over (os.cpu_count() by default, 1 runs inline)
+    :param out: optional preallocated (cells,) or (cells, num_bins) array to fill, e.g. a np.memmap
+    :param reduce: optional reduce(tile result) -> array or tuple of arrays with one row per tile cell, run here
+      on every tile before it's written (e.g. to keep prefix sums instead of the bins), then out is required
+      and holds what it returns (a tuple of arrays for a tuple), so the full (cells, num_bins) result never exists
+    :return: (cells,) or (cells, num_bins) array in grid cell order, or out
+    '''
+    binned = bins is not None or np.ndim(counts) == 2
+    if np.ndim(counts) == 2:
+        num_bins = counts.shape[1]
+    assert reduce is None or out is not None, "out must hold what reduce returns"
+    if out is None:
+        out = np.zeros((len(grid), num_bins) if binned else len(grid))
+    out_grids = [part.reshape(grid.shape + part.shape[1:]) for part in (out if isinstance(out, tuple) else (out,))]
+
+    halo = radius + grid.size * np.sqrt(2) / 2
+
+    # Sorted by x once, so each tile's halo is a searchsorted slice plus a y filter
+    order = np.argsort(sightings_xy[:, 0], kind="stable")
+    xs = sightings_xy[order, 0]
+
+    def tile_args(rows_cols):
+        row_start, row_stop, col_start, col_stop = rows_cols
+        tile = grid.window(row_start, row_stop, col_start, col_stop)
+
+        lo, hi = np.searchsorted(xs, [tile.xmin - halo, tile.xmax + halo])
+        candidates = order[lo:hi]
+        y = sightings_xy[candidates, 1]
+        keep = candidates[(y >= tile.ymin - halo) & (y <= tile.ymax + halo)]
+
+        return (tile, sightings_xy[keep], counts[keep], bins[keep] if bins is not None else None,
+                num_bins, radius, kernel)
+
+    def write(rows_cols, result):
+        row_start, row_stop, col_start, col_stop = rows_cols
+        parts = result if reduce is None else reduce(result)
+        for out_grid, part in zip(out_grids, parts if isinstance(parts, tuple) else (parts,)):
+            out_grid[row_start:row_stop, col_start:col_stop] = part.reshape(
+                (row_stop - row_start, col_stop - col_start) + part.shape[1:]
+            )
+
+    tiles = plan_tiles(grid, tile_cells)
+    num_workers = min(num_workers or os.cpu_count() or 1, len(tiles))
+
+    if num_workers <= 1:
+        for rows_cols in tiles:
+            write(rows_cols, _tile_kernel_sum(*tile_args(rows_cols)))
+        return out
+
+    # Only a couple of tiles in flight per worker, so their inputs and results never pile up in memory
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        pending = iter(tiles)
+        in_flight = {}
+
+        def submit_next():
+            rows_cols = next(pending, None)
+            if rows_cols is not None:
+                in_flight[pool.submit(_tile_kernel_sum, *tile_args(rows_cols))] = rows_cols
+
+        for _ in range(2 * num_workers):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(in_flight.pop(future), future.result())
+                submit_next()
+
+    return out
+
+
+def tiled_centre_kernel_sum(sightings_xy: np.ndarray,
+                            counts: np.ndarray,
+                            centres: np.ndarray,
+                            cell_size: float,
+                            radius: float,
+                            kernel: str = "disc",
+                            bins: np.ndarray = None,
+                            num_bins: int = 1,
+                            tile_size: float = 64000,
+                            out: np.ndarray = None,
+                            reduce=None) -> np.ndarray:
+    '''
+    kernel_sum for cells of one size at arbitrary centres (e.g. Quadtree leaves), a square tile of
+    tile_size meters at a time. Same halo cutoff as tiled_kernel_sum, so the result is exact.
+
+    :param centres: (cells, 2) cell centres in the sightings' crs
+    :param counts: (n,) counts with optional bins, or (n, num_bins) counts per bin like kernel_sum takes
+    :param out, reduce: same as tiled_kernel_sum's
+    :return: (cells,) or (cells, num_bins) array in the order of centres, or out
+    '''
+    binned = bins is not None or np.ndim(counts) == 2
+    if np.ndim(counts) == 2:
+        num_bins = counts.shape[1]
+    assert reduce is None or out is not None, "out must hold what reduce returns"
+    if out is None:
+        out = np.zeros((len(centres), num_bins) if binned else len(centres))
+    if len(centres) == 0:
+        return out
+    outs = out if isinstance(out, tuple) else (out,)
+
+    halo = radius + cell_size * np.sqrt(2) / 2
+
+    order = np.argsort(sightings_xy[:, 0], kind="stable")
+    xs = sightings_xy[order, 0]
+
+    # Cells grouped by the tile their centre is in
+    tile = np.floor((centres - centres.min(axis=0)) / tile_size).astype(np.int64)
+    _, tile_of = np.unique(tile[:, 0] * (tile[:, 1].max() + 1) + tile[:, 1], return_inverse=True)
+
+    for cells in np.split(np.argsort(tile_of, kind="stable"), np.cumsum(np.bincount(tile_of.ravel()))[:-1]):
+        xmin, ymin = centres[cells].min(axis=0) - halo
+        xmax, ymax = centres[cells].max(axis=0) + halo
+
+        lo, hi = np.searchsorted(xs, [xmin, xmax])
+        candidates = order[lo:hi]
+        y = sightings_xy[candidates, 1]
+        keep = candidates[(y >= ymin) & (y <= ymax)]
+        if len(keep) == 0:
+            result = np.zeros((len(cells), num_bins) if binned else len(cells))
+        else:
+            result = kernel_sum(cKDTree(sightings_xy[keep]), counts[keep], cKDTree(centres[cells]), cell_size,
+                                radius, kernel, bins=bins[keep] if bins is not None else None, num_bins=num_bins)
+        parts = result if reduce is None else reduce(result)
+        for target, part in zip(outs, parts if isinstance(parts, tuple) else (parts,)):
+            target[cells] = part
+
+    return out
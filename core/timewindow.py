@@ -0,0 +1,48 @@
+import numpy as np
+
+
+''' Month-by-year sums kept as 2D prefix sums, so any block of months and years is 4 lookups per cell '''
+
+
+def month_prefix(cube: np.ndarray, num_years: int, out: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Cumulative sums of a (cells, ..., years * 12 + 1) cube over its years and months.
+
+    :param cube: last axis is year * 12 + month (both 0-based), plus one last bin of undated values
+    :param out: optional preallocated (cells, ..., years + 1, 13) array to fill, e.g. a np.memmap
+    :return: (cells, ..., years + 1, 13) prefix sums with a zero first row and column, and the undated bin
+    '''
+    lead = cube.shape[:-1]
+    assert cube.shape[-1] == num_years * 12 + 1, f"Expected {num_years * 12 + 1} time bins"
+
+    if out is None:
+        out = np.zeros(lead + (num_years + 1, 13))
+    else:
+        out[..., 0, :] = 0
+        out[..., :, 0] = 0
+    out[..., 1:, 1:] = cube[..., :-1].reshape(lead + (num_years, 12)).cumsum(axis=-2).cumsum(axis=-1)
+    return out, cube[..., -1].copy()
+
+
+def window_sum(prefix: np.ndarray, first_year: int, last_year: int, first_month: int, last_month: int) -> np.ndarray:
+    '''
+    Sum over a block of years and months from month_prefix sums, O(cells).
+
+    Years are 0-based indices into the prefix and clipped to it (so a window past the data just
+    covers less of it). Months are 0-based and inclusive, first_month > last_month wraps around
+    new year, e.g. (10, 1) is November to February.
+    '''
+    num_years = prefix.shape[-2] - 1
+    first_year = int(np.clip(first_year, 0, num_years))
+    last_year = int(np.clip(last_year, -1, num_years - 1))
+
+    def block(first_month, last_month):
+        # Inclusion-exclusion on the prefix sums
+        y0, y1, m0, m1 = first_year, last_year + 1, first_month, last_month + 1
+        return prefix[..., y1, m1] - prefix[..., y0, m1] - prefix[..., y1, m0] + prefix[..., y0, m0]
+
+    if last_year < first_year:
+        return np.zeros(prefix.shape[:-2])
+    if first_month <= last_month:
+        return block(first_month, last_month)
+    return block(first_month, 11) + block(0, last_month)
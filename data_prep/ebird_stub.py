@@ -0,0 +1,84 @@
+import json
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class EBirdStub:
+    ''' Local stand-in for the eBird historic observations endpoint, for running get_bird_sighting_data offline '''
+
+    '''
+    attributes
+    - observations: "YYYY-MM-DD" -> list of observations returned for that day (days not in it return [])
+    - failures: "YYYY-MM-DD" -> status codes (e.g. 503, 429) answered one per request before the day succeeds
+    - calls: Counter of requests per day, failed ones included
+    - url: base_url to pass to get_bird_sighting_data
+
+    Used as a context manager, it serves on a free local port from a background thread:
+
+        with EBirdStub({"2020-05-01": [...]}, failures={"2020-05-01": [503]}) as stub:
+            get_bird_sighting_data(base_url=stub.url, ebird_api_key="test", ...)
+    '''
+
+    PATH = re.compile(r"^/data/obs/[^/]+/historic/(\d+)/(\d+)/(\d+)$")
+
+    def __init__(self, observations: dict[str, list[dict]] = None, failures: dict[str, list[int]] = None):
+        self.observations = dict(observations or {})
+        self.failures = {day: list(codes) for day, codes in (failures or {}).items()}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.__handler())
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def respond(self, path: str, token: str) -> tuple[int, object]:
+        ''' (status, json body) for one request '''
+        match = self.PATH.match(path.split("?")[0])
+        if match is None:
+            return 404, {"error": "not found"}
+        if not token:
+            return 403, {"error": "missing X-eBirdApiToken"}
+
+        year, month, day = (int(part) for part in match.groups())
+        day = f"{year:04d}-{month:02d}-{day:02d}"
+
+        with self.lock:
+            self.calls[day] += 1
+            pending = self.failures.get(day)
+            if pending:
+                return pending.pop(0), {"error": "stub failure"}
+
+        return 200, self.observations.get(day, [])
+
+    def __handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = stub.respond(self.path, self.headers.get("X-eBirdApiToken"))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass  # quiet, the fetcher prints its own progress
+
+        return Handler
@@ -1,8 +1,12 @@
-from ebird.api import get_historic_observations
 import os
 from dotenv import load_dotenv
 from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
 import json
+import random
+import threading
+import time
 import requests
 import rasterio
 
@@ -11,86 +15,215 @@ import rasterio
 #################################
 
 
+EBIRD_API_URL = "https://api.ebird.org/v2"
+
+
+class RateLimiter:
+    ''' Spaces out calls to each host so there are at most `rate` per second, shared by all threads '''
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_call = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url: str) -> None:
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_call.get(host, now))
+            self.next_call[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def season_dates(first_year: int = 2015, num_years: int = 10) -> list[date]:
+    ''' Every day from March to October of each year (when they're in Alberta) '''
+    dates = []
+    for year in range(first_year, first_year + num_years):
+        current_date = date(year, 3, 1)
+        while current_date <= date(year, 10, 31):
+            dates.append(current_date)
+            current_date += timedelta(days=1)
+    return dates
+
+
 def get_bird_sighting_data(common_name: str | list[str] = "Ferruginous Hawk",
                            scientific_name: str | list[str] = "Buteo regalis",
                            ebird_species_code: str | list[str] = "ferhaw",
                            region_code: str | list[str] = "CA-AB",
                            ebird_api_key: str = None,
-                           output_path: str = None):
+                           output_path: str = None,
+                           checkpoint_path: str = None,
+                           num_workers: int = 8,
+                           requests_per_second: float = 5,
+                           max_retries: int = 5,
+                           backoff: float = 1.0,
+                           base_url: str = EBIRD_API_URL,
+                           dates: list[date] = None):
     '''
-    Fetch bird sighting data from eBird
+    Fetch bird sighting data from eBird, one historic observations call per day, several days at a time
     :param common_name:
     :param scientific_name:
-    :param ebird_species_code:
+    :param ebird_species_code: one code or a list of them. Each day's call returns every species, so
+        several species cost no extra requests, they all end up in the same output file
     :param ebird_api_key: for now hardcoded with my API key
-    :return: A list of observations (dictionaries)
+    :param output_path: .jsonl file the observations are appended to as each day completes
+    :param checkpoint_path: file listing the completed days (defaults to output_path + ".checkpoint"),
+        an interrupted run started again with the same paths only fetches the missing days. Without
+        one the output file is started over
+    :param num_workers: number of days fetched concurrently
+    :param requests_per_second: cap on calls to the API host, shared by all workers
+    :param max_retries: retries per day (on connection errors, 429 and 5xx) with exponential backoff
+    :param base_url: API root, point it at a local stub server for testing (see ebird_stub.py)
+    :param dates: days to fetch, every day of season_dates() by default
+    :return: The number of observations written in this run. It used to return the list of observations,
+        that no longer fits in memory for a full run, so read them back from output_path instead
     '''
 
-    def print_data(data: list[dict[str]]) -> None:
-        for d in data:
-            print(f"{d['comName']}\n"
-                    f"\tScientific Name: {d['sciName']}\n"
-                    f"\tLat: {d['lat']}, Long: {d['lng']}\n"
-                    f"\tDate: {d['obsDt']}\n"
-                    f"\tCount: {d['howMany']}",
-                    "\n")
+    thread_local = threading.local()
+    limiter = RateLimiter(requests_per_second)
+
+    def get_session() -> requests.Session:
+        # requests sessions aren't thread safe, so one per worker
+        if not hasattr(thread_local, "session"):
+            thread_local.session = requests.Session()
+            thread_local.session.headers["X-eBirdApiToken"] = ebird_api_key
+        return thread_local.session
 
 
     def fetch_by_date(date):
         ''' Returns all the observations of the given species for a specific date, filtering out ones with no count '''
-        observations = get_historic_observations(token=ebird_api_key, date=date, area=region_code, detail='full')
-        ferhaw_obs = [obs for obs in observations if obs['speciesCode'] == ebird_species_code]
-        for obs in ferhaw_obs:
+        url = f"{base_url}/data/obs/{region_code}/historic/{date.year}/{date.month}/{date.day}"
+
+        for attempt in range(max_retries + 1):
+            limiter.wait(url)
+            try:
+                response = get_session().get(url, params={"detail": "full"}, timeout=30)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    observations = response.json()
+                    break
+                error = requests.HTTPError(f"{response.status_code} for {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == max_retries:
+                raise error
+            # Exponential backoff with a bit of jitter so the workers don't retry in lockstep
+            time.sleep(backoff * 2 ** attempt * (1 + random.random() / 2))
+
+        species_obs = [obs for obs in observations if obs['speciesCode'] in species_codes]
+        for obs in species_obs:
             if 'howMany' not in obs.keys():
                 obs['howMany'] = 1
                 obs['noCount'] = 1
-        return ferhaw_obs
+        return species_obs
 
 
-    # TODO: implement multi-species functionality
-    if [i for i in [common_name, scientific_name, ebird_species_code] if type(i) is list]:
-        return "Multi-species functionality is not implemented yet"
-    
     # TODO: Find the species code if not provided (use get_taxonomy())
     if ebird_species_code is None:
         pass
 
+    species_codes = {ebird_species_code} if isinstance(ebird_species_code, str) else set(ebird_species_code)
+    species_tag = ",".join(sorted(species_codes))
+
     # Load API key
     if ebird_api_key is None:
         load_dotenv()
         ebird_api_key = os.environ["EBIRD_API_KEY"]
 
-    # Get all sightings by date range
-    all_sightings = []
-
     if not output_path or not output_path.endswith(".jsonl"):
         output_path = "raw_bird_sighting_data.jsonl"
 
-    with open(output_path, "w+") as f:
-
-        # 10 year range from March-Oct 2015 to 2024 (when they're in Alberta)
-        # Had to do it this way because the eBird API only allows recent data (past 30 days)
-        # Or you can get data from a specific day. Hence the awful loop
-        for i in range(0, 10):
-            year = 2015 + i
-            start_date = date(year, 3, 1)
-            end_date = date(year, 10, 31)
-            delta = timedelta(days=1)
-            current_date = start_date
-
-            while current_date <= end_date:
-                current_date += delta
-                print(current_date.strftime("%Y-%m-%d") + "\n")
-                data = fetch_by_date(current_date)
-                print_data(data)
-                for obs in data:
-                    all_sightings.append(obs)
+    if checkpoint_path is None:
+        checkpoint_path = output_path + ".checkpoint"
 
+    # Days finished by an earlier (interrupted) run for the same species
+    # (lines are "date species,codes offset", older checkpoints only have the date, or no offset)
+    completed = set()
+    resume_offset = None
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # cut off mid-line by a crash, so that day isn't done
+                day, _, rest = line.strip().partition(" ")
+                tag, _, offset = rest.partition(" ")
+                if day and tag in ("", species_tag):
+                    completed.add(day)
+                if offset.isdigit():
+                    resume_offset = int(offset)
+
+    if not completed or not os.path.exists(output_path):
+        # Nothing to resume from, start both files over instead of appending to an old run
+        open(output_path, "w").close()
+        open(checkpoint_path, "w").close()
+        completed = set()
+    elif resume_offset is not None and os.path.getsize(output_path) > resume_offset:
+        # Observations written after the last checkpointed day (a crash between the two writes),
+        # that day gets fetched again so they're dropped
+        with open(output_path, "r+") as f:
+            f.truncate(resume_offset)
+
+    # 10 year range from March-Oct 2015 to 2024
+    # Had to do it this way because the eBird API only allows recent data (past 30 days)
+    # Or you can get data from a specific day. Hence the awful loop (now run concurrently)
+    pending = [d for d in (season_dates() if dates is None else dates) if d.strftime("%Y-%m-%d") not in completed]
+    print(f"{len(completed)} days already done, fetching {len(pending)}")
+
+    num_written = 0
+    failed = []
+
+    # Append so a resumed run keeps what's already there. Results are written by this thread only,
+    # one day at a time, and the day is checkpointed right after its observations are flushed, along
+    # with where the output file ends, so a resumed run can cut off anything the checkpoint doesn't cover
+    with open(output_path, "a") as f, open(checkpoint_path, "a") as checkpoint, \
+            ThreadPoolExecutor(max_workers=num_workers) as pool:
+
+        # Only a couple of days in flight per worker, so finished results never pile up in memory
+        dates = iter(pending)
+        in_flight = {}
+
+        def submit_next():
+            next_date = next(dates, None)
+            if next_date is not None:
+                in_flight[pool.submit(fetch_by_date, next_date)] = next_date
+
+        for _ in range(2 * num_workers):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                current_date = in_flight.pop(future).strftime("%Y-%m-%d")
+                submit_next()
+
+                try:
+                    data = future.result()
+                except Exception as e:
+                    print(f"{current_date} failed: {e}")
+                    failed.append(current_date)
+                    continue
+
+                for obs in data:
                     # Save data to file
                     json.dump(obs, f)
                     f.write("\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+                checkpoint.write(f"{current_date} {species_tag} {f.tell()}\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+                num_written += len(data)
+                print(f"{current_date}: {len(data)} observations")
+
+    if failed:
+        print(f"{len(failed)} days failed, run again with the same output_path to retry them")
 
-    return all_sightings
+    return num_written
 
 
 def get_wind_speed_data(country: str = "CAN",
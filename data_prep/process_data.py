@@ -1,196 +1,332 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import rasterio
-from rasterio.mask import mask
 from rasterio.enums import Resampling
 from rasterio.transform import from_origin
-from shapely.geometry import box, mapping
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
+import csv
 import os
+import tempfile
 
 import numpy as np
 
 
+''' Column types of the processed datasets (float32 is plenty for ~1m coordinates and wind speeds) '''
+BIRD_DTYPES = {
+    "speciesCode": "string",
+    "comName": "string",
+    "sciName": "string",
+    "obsDt": "string",
+    "howMany": "int32",
+    "noCount": "int8",
+    "lat": "float32",
+    "lon": "float32",
+}
+
+''' Raw attributes a .jsonl sighting file must have (noCount is optional, the API only sends it without a count) '''
+JSONL_REQUIRED = {"speciesCode", "comName", "sciName", "obsDt", "howMany", "lat", "lng", "subId"}
+
+''' eBird Basic Dataset columns that are read, and what they're called in the processed data '''
+EBD_COLUMNS = {
+    "COMMON NAME": "comName",
+    "SCIENTIFIC NAME": "sciName",
+    "OBSERVATION COUNT": "howMany",
+    "LATITUDE": "lat",
+    "LONGITUDE": "lon",
+    "OBSERVATION DATE": "obsDt",
+    "TIME OBSERVATIONS STARTED": "obsTime",
+    "SAMPLING EVENT IDENTIFIER": "subId",
+    "GROUP IDENTIFIER": "groupId",
+}
+EBD_REQUIRED = {"COMMON NAME", "SCIENTIFIC NAME", "OBSERVATION COUNT", "LATITUDE", "LONGITUDE",
+                "OBSERVATION DATE", "SAMPLING EVENT IDENTIFIER"}
+
+''' Sightings are deduplicated one hash partition at a time, about this much input per partition (at most MAX_PARTITIONS) '''
+PARTITION_BYTES = 256 * 2 ** 20
+MAX_PARTITIONS = 256
+
+WIND_DTYPES = {
+    "lat": "float32",
+    "lon": "float32",
+    "windSpeed": "float32",
+}
+
+
+class ProcessedWriter:
+    '''
+    Appends dataframe chunks to a typed columnar .parquet file (one row group per chunk) or a .jsonl file
+    (export format), with the columns cast to dtypes.
 
+    With lat_band set, Parquet rows are instead grouped into latitude bands that many degrees tall:
+    every row group holds rows of a single band sorted by latitude, so a bounding box filter on the
+    file skips the row groups of every band outside it, however the input was ordered. Rows wait in
+    their band's buffer, and the biggest buffers are written out whenever more than buffer_rows are pending.
+    '''
 
-
-def process_bird_sighting_data(input_path: str, 
-                               proc_output_path: str, 
-                               coord_range: list[float] = [49.0000, 52.833333, -114.0000, -110.0000]
-                               ) -> pd.DataFrame:
-    """
-    Expects input .jsonl file, processes the data, saves it and returns the final dataframe.
-    """
-
-    # Load raw data
-    try:
-        df = pd.read_json(input_path, lines=True)
-    except:
-        print("Error loading file")
+    def __init__(self, path: str, dtypes: dict[str, str], lat_band: float = None, buffer_rows: int = 200_000):
+        self.path = path
+        self.dtypes = dtypes
+        self.lat_band = lat_band
+        self.buffer_rows = buffer_rows
+        self.bands = {}  # band number -> list of dataframes waiting to be written
+        self.pending = 0
+        self.writer = None
+        self.file = None
+
+        if not path.endswith(".parquet"):
+            self.file = open(path, "w")
+
+    def write(self, df: pd.DataFrame) -> None:
+        df = df.astype({col: dtype for col, dtype in self.dtypes.items() if col in df.columns})
+
+        if self.file is not None:
+            if len(df):
+                self.file.write(df.to_json(orient="records", lines=True).rstrip("\n") + "\n")
+            return
+
+        if self.lat_band is None or not len(df):
+            self.__write_table(df)
+            return
+
+        band = np.floor(df["lat"].to_numpy(dtype=np.float64) / self.lat_band).astype(np.int64)
+        for number, rows in df.groupby(band, sort=False):
+            self.bands.setdefault(number, []).append(rows)
+        self.pending += len(df)
+
+        # Biggest bands first, so the row groups come out as large as the buffer allows
+        while self.pending > self.buffer_rows:
+            self.__flush_band(max(self.bands, key=lambda number: sum(len(rows) for rows in self.bands[number])))
+
+    def close(self) -> None:
+        for number in sorted(self.bands):
+            self.__flush_band(number)
+        if self.writer is not None:
+            self.writer.close()
+        if self.file is not None:
+            self.file.close()
+
+    def __flush_band(self, number: int) -> None:
+        rows = pd.concat(self.bands.pop(number))
+        self.pending -= len(rows)
+        self.__write_table(rows.sort_values("lat", kind="stable"))
+
+    def __write_table(self, df: pd.DataFrame) -> None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema)
+        self.writer.write_table(table)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_bird_chunks(input_path: str, chunk_size: int = 200_000, coord_range: list[float] = None):
+    '''
+    Streams a raw sighting file as dataframes of at most chunk_size rows, renamed to the processed
+    column names plus subId, and cut to coord_range [lat_min, lat_max, lon_min, lon_max] if given
+    (NaN coordinates are dropped too). Reads the .jsonl written by get_bird_sighting_data, or an eBird Basic
+    Dataset export (.txt/.tsv, optionally .gz) which has no species codes, so speciesCode holds the
+    scientific name until process_bird_sighting_data swaps it.
+    '''
+    def in_range(chunk):
+        if coord_range is None:
+            return chunk["lat"].notna() & chunk["lon"].notna()
+        lat_min, lat_max, lon_min, lon_max = coord_range
+        return (
+            (chunk["lat"] >= lat_min) & (chunk["lat"] <= lat_max) &
+            (chunk["lon"] >= lon_min) & (chunk["lon"] <= lon_max)
+        )
+
+    if input_path.endswith((".jsonl", ".json")):
+        reader = pd.read_json(input_path, lines=True, chunksize=chunk_size, convert_dates=False)
+        for chunk in reader:
+            assert JSONL_REQUIRED.issubset(chunk.columns), f"Missing keys in {input_path}: {JSONL_REQUIRED - set(chunk.columns)}"
+
+            chunk = chunk.rename(columns={"lng": "lon"})
+            chunk = chunk[in_range(chunk)]
+            if "noCount" not in chunk.columns:
+                chunk = chunk.assign(noCount=0)
+            yield chunk
         return
-    
-    # Fill Nans with 0
-    df["noCount"] = df["noCount"].fillna(0).astype(int)
 
-    # Keep only necessary attributes
-    required_attrs = {"speciesCode", "comName", "sciName", "obsDt", "howMany", "noCount", "lat", "lng"}
+    # The EBD is tab separated with stray quotes in the comments, so quoting is turned off
+    reader = pd.read_csv(input_path, sep="\t", quoting=csv.QUOTE_NONE, chunksize=chunk_size,
+                         usecols=lambda column: column in EBD_COLUMNS,
+                         dtype={column: "float64" if column in ("LATITUDE", "LONGITUDE") else str for column in EBD_COLUMNS})
+    for chunk in reader:
+        assert EBD_REQUIRED.issubset(chunk.columns), f"Missing columns in {input_path}: {EBD_REQUIRED - set(chunk.columns)}"
 
-    for idx, row in df.iterrows():
-        assert required_attrs.issubset(row.keys()), f"Missing keys in row {idx}: {row.to_dict()}"
+        # Cut to the bbox first, the EBD is mostly other places
+        chunk = chunk.rename(columns=EBD_COLUMNS)
+        chunk = chunk[in_range(chunk)].copy()
 
-    proc_df = df[list(required_attrs)]
+        # "X" means seen but not counted, same as a missing howMany from the API
+        how_many = pd.to_numeric(chunk["howMany"], errors="coerce")
+        chunk["noCount"] = how_many.isna().astype(int)
+        chunk["howMany"] = how_many.fillna(1)
 
-    # Rename "lng" to "lon" for compatibility with streamlit
-    proc_df = proc_df.rename(columns={"lng": "lon"})
+        chunk["speciesCode"] = chunk["sciName"]
 
-    # optional TODO: Separate obsDt into date and time (will mostly use date)
+        if "obsTime" in chunk.columns:
+            chunk["obsDt"] = (chunk["obsDt"] + " " + chunk["obsTime"].str[:5]).fillna(chunk["obsDt"])
 
-    # Filter for area used by Wellicome
-    # Coordinate boundaries:
-    # NW: 52.833333, -114.000000
-    # SW: 49.0000, -114.0000
-    # NE: 52.833333, -110.0000
-    # SE: 49.0000, -110.0000
+        # Shared checklists show up once per observer, the group id is the same for all of them
+        if "groupId" in chunk.columns:
+            chunk["subId"] = chunk["groupId"].fillna(chunk["subId"])
 
-    lat_min, lat_max, lon_min, lon_max = coord_range
-
-    proc_df = proc_df[
-        (proc_df["lat"] >= lat_min) & (proc_df["lat"] <= lat_max) &
-        (proc_df["lon"] >= lon_min) & (proc_df["lon"] <= lon_max)
-    ]
-    
-    # Save processed dataframe to file
-    proc_df.to_json(proc_output_path, orient="records", lines=True)
+        yield chunk
 
-    return proc_df
-
-
-def process_wind_speed_data(input_path: str,
-                            proc_output_path: str = None,
-                            coord_range: list[float] = [49.0000, 52.833333, -114.0000, -110.0000]
-                            ) -> pd.DataFrame:
-    
-    ''' Expects input .tif file, processes the data, saves the final dataframe to jsonl file. 
-    The final dataframe will contain (lat, lon, wind_speed) in the given coord_range, with 1km resolution.
-
-    proc_output_path should be the .jsonl file, not the .tif file
-    '''
-
-
-    # Determine UTM zone from avg longitude/latitude
-    lat_min, lat_max, lon_min, lon_max = coord_range
 
+def process_bird_sighting_data(input_path: str, 
+                               proc_output_path: str, 
+                               coord_range: list[float] = [49.0000, 52.833333, -114.0000, -110.0000],
+                               species: list[tuple[str, str, str]] = None,
+                               chunk_size: int = 200_000,
+                               lat_band: float = 0.05,
+                               partitions: int = None
+                               ) -> int:
+    """
+    Streams a raw .jsonl (from get_bird_sighting_data) or eBird Basic Dataset .txt/.tsv export,
+    processes it chunk by chunk and writes the sightings to proc_output_path.
+    proc_output_path can be .parquet (what Map reads fastest) or .jsonl.
+
+    species is a list of (speciesCode, comName, sciName) to keep, matched on the code for .jsonl and
+    on the scientific name for the EBD (which then gets the code). None keeps every species.
+
+    Sightings are deduplicated by (subId, speciesCode), so days fetched twice by a resumed download or
+    shared checklists in the EBD are only counted once (the first one is kept). The kept sightings are
+    spilled to temporary Parquet files next to proc_output_path, split into partitions by a hash of
+    that key, so every copy of a sighting lands in the same partition, and each partition is then
+    deduplicated on its own on the way out. By default there's one partition per PARTITION_BYTES of input
+    (compressed size for .gz), so memory is about a chunk plus one partition however big the input is,
+    up to MAX_PARTITIONS, past which a partition grows with the input. Parquet row groups each hold one
+    lat_band degrees tall band sorted by latitude (see ProcessedWriter), so Map's bounding box read skips the rest.
+
+    Returns the number of sightings written.
+    """
 
-    ''' Don't need this lovely code anymore :'( '''
-    # utm_zone = int(((lon_max + lon_min)/2 + 180) / 6) + 1
-    # print(f"{utm_zone=}")
+    codes = {code for code, _, _ in species} if species else None
+    codes_by_name = {sci_name: code for code, _, sci_name in species} if species else {}
 
-    # if (lat_max + lat_min) / 2 >= 0:
-    #     utm_crs = f"EPSG:326{utm_zone}" # Northern hemisphere
-    # else:
-    #     utm_crs = f"EPSG:327{utm_zone}" # Southern hemisphere
+    if partitions is None:
+        partitions = int(np.clip(np.ceil(os.path.getsize(input_path) / PARTITION_BYTES), 1, MAX_PARTITIONS))
+    num_written = 0
 
-    # print(f"{utm_crs=}")
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(proc_output_path))) as spill_dir:
+        spill = {}  # partition -> ParquetWriter, opened when it gets its first rows
 
+        for chunk in read_bird_chunks(input_path, chunk_size, coord_range):
 
-    # Load raw data
-    raw_dataset = rasterio.open(input_path)
+            # EBD species are matched on the scientific name, then given their code
+            if species and not input_path.endswith((".jsonl", ".json")):
+                chunk["speciesCode"] = chunk["sciName"].map(codes_by_name)
 
-    # print(f"{dataset.crs=}")
-    # print(f"{dataset.bounds=}")
-    # print(f"{dataset.width=}")
-    # print(f"{dataset.height=}")
-    # band1 = dataset.read(1)
-    # print(f"{band1=}")
-    # print(f"num nans: {np.count_nonzero(np.isnan(band1))}") # About a third are nan (ocean)
+            # Already cut to the area used by Wellicome, now the species asked for
+            if codes is not None:
+                chunk = chunk[chunk["speciesCode"].isin(codes)]
 
-    bbox = box(lon_min, lat_min, lon_max, lat_max)
-    geo = [mapping(bbox)]
+            # Duplicates within the chunk now, the ones across chunks meet in their partition
+            chunk = chunk.drop_duplicates(subset=["subId", "speciesCode"])
+            keys = pd.util.hash_pandas_object(chunk[["subId", "speciesCode"]], index=False).to_numpy()
 
-    out_image, out_transform = mask(raw_dataset, geo, crop=True)
-    out_meta = raw_dataset.meta.copy()
+            chunk = chunk.assign(
+                howMany=chunk["howMany"].fillna(1),
+                noCount=chunk["noCount"].fillna(0),
+            )[list(BIRD_DTYPES)].astype(BIRD_DTYPES).assign(key=keys)
 
-    out_meta.update({
-        "driver": "GTiff",
-        "height": out_image.shape[1],
-        "width": out_image.shape[2],
-        "transform": out_transform
-    })
+            for part, rows in chunk.groupby(keys % partitions, sort=False):
+                table = pa.Table.from_pandas(rows, preserve_index=False)
+                if part not in spill:
+                    spill[part] = pq.ParquetWriter(os.path.join(spill_dir, f"{part}.parquet"), table.schema)
+                spill[part].write_table(table)
 
-    raw_dataset.close()
+        for writer in spill.values():
+            writer.close()
 
-    temp = "temp.tif"
+        with ProcessedWriter(proc_output_path, BIRD_DTYPES, lat_band, chunk_size) as writer:
+            for part in sorted(spill):
+                rows = pd.read_parquet(os.path.join(spill_dir, f"{part}.parquet"))
+                rows = rows.drop_duplicates(subset="key").drop(columns="key")
+                writer.write(rows)
+                num_written += len(rows)
 
-    with rasterio.open(temp, 'w', **out_meta) as dest:
-        dest.write(out_image)
+            # Still write the (empty) file so readers don't trip over a missing one
+            if num_written == 0:
+                writer.write(pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in BIRD_DTYPES.items()}))
 
+    print(f"{num_written} sightings written to {proc_output_path}")
 
-    cropped_dataset = rasterio.open(temp, "r+")
+    return num_written
 
-    band = cropped_dataset.read(1)
 
-    # replace nans with 0
-    band[np.isnan(band)] = 0
-    cropped_dataset.write(band, 1)
+def process_wind_speed_data(input_path: str,
+                            proc_output_path: str = None,
+                            coord_range: list[float] = [49.0000, 52.833333, -114.0000, -110.0000],
+                            desired_res: float = 0.01,
+                            block_rows: int = 256
+                            ) -> None:
     
+    ''' Expects input .tif file, processes the data, saves the final dataframe to a .parquet (or .jsonl) file. 
+    The final dataframe will contain (lat, lon, wind_speed) in the given coord_range, with 1km resolution.
+    The resampled raster is also saved next to it as a .tif (what Map's "raster" wind mode reads).
 
-    desired_res = 0.01 # Hardcoded 0.01 degree resolution, approx 1km
-
-    # Calculate new dimensions
-
-    width = int((cropped_dataset.bounds.right - cropped_dataset.bounds.left) / desired_res)
-    height = int((cropped_dataset.bounds.top - cropped_dataset.bounds.bottom) / desired_res)
-
-    transform = from_origin(cropped_dataset.bounds.left, cropped_dataset.bounds.top, desired_res, desired_res)
+    proc_output_path should be the .parquet (or .jsonl) file, not the .tif file
 
-    # Resample data
-    data = cropped_dataset.read(
-        out_shape=(cropped_dataset.count, height, width),
-        resampling=Resampling.nearest
-    )
+    Everything happens in memory through a warped virtual raster of just the bbox, block_rows output
+    rows at a time, so memory stays bounded even for the whole Canada raster and there are no
+    temp files for parallel runs to fight over.
+    '''
 
-    # Update metadata
-    profile = cropped_dataset.profile
-    profile.update({
-        'transform': transform,
-        'width': width,
-        'height': height
-    })
+    lat_min, lat_max, lon_min, lon_max = coord_range
 
-    # save the processed raster data to a new file
-    with rasterio.open(f"{proc_output_path.split(".")[0]}.tif", 'w', **profile) as final_dataset:
-        final_dataset.write(data)
+    # Output grid: desired_res degrees (0.01, approx 1km) from the top left corner of the bbox
+    width = int(np.ceil(round((lon_max - lon_min) / desired_res, 6)))
+    height = int(np.ceil(round((lat_max - lat_min) / desired_res, 6)))
+    transform = from_origin(lon_min, lat_max, desired_res, desired_res)
 
-    # Now we have the final raster dataset. Save lat, lon, and windSpeed values to a jsonl file (consistent with bird data)
-    # idk exactly why I can't keep going after writing but this works
-    with rasterio.open(f"{proc_output_path.split(".")[0]}.tif", 'r+') as final_dataset:
-        data = final_dataset.read(1)
-        transform = final_dataset.transform
+    profile = {
+        "driver": "GTiff",
+        "dtype": "float32",
+        "count": 1,
+        "width": width,
+        "height": height,
+        "crs": "EPSG:4326",
+        "transform": transform,
+    }
 
-        # Create geojson from processed raster data
+    tif_path = f"{os.path.splitext(proc_output_path)[0]}.tif"
 
-        rows, cols = data.shape
-        row_indices, col_indices = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
-        flat_rows = row_indices.flatten()
-        flat_cols = col_indices.flatten()
+    with rasterio.open(input_path) as raw_dataset, \
+            WarpedVRT(raw_dataset, crs="EPSG:4326", transform=transform, width=width, height=height,
+                      resampling=Resampling.nearest) as vrt, \
+            rasterio.open(tif_path, "w", **profile) as final_dataset, \
+            ProcessedWriter(proc_output_path, WIND_DTYPES) as writer:
 
-        xs, ys = rasterio.transform.xy(transform, flat_rows, flat_cols)
+        for row_start in range(0, height, block_rows):
+            window = Window(0, row_start, width, min(block_rows, height - row_start))
 
-        flat_data = data.flatten()
+            # Only the source pixels under this window are read and resampled
+            band = vrt.read(1, window=window, masked=True).filled(np.nan).astype(np.float32)
 
-        df = pd.DataFrame({
-            'lat': ys,
-            'lon': xs,
-            'windSpeed': flat_data
-        })
+            # replace nans (ocean/nodata) with 0
+            band[np.isnan(band)] = 0
 
-        df.to_json(proc_output_path, orient='records', lines=True)
+            final_dataset.write(band, 1, window=window)
 
-    # Delete intermediate file temp.tif
-    if os.path.exists(temp):
-        os.remove(temp)
+            # Pixel centre coordinates for the whole block at once
+            rows, cols = np.indices(band.shape)
+            xs, ys = vrt.window_transform(window) * (cols.ravel() + 0.5, rows.ravel() + 0.5)
 
+            # Save lat, lon, and windSpeed values (consistent with bird data)
+            writer.write(pd.DataFrame({
+                'lat': ys,
+                'lon': xs,
+                'windSpeed': band.ravel()
+            }))
 
     return
-
-
-
-
@@ -12,6 +12,7 @@ wind_raw_path=DATA_DIR+"raw_wind_speed_data.tif"
 
 map_path=DATA_DIR+"gdf.geojson"
 
+# Returns the number of observations written, the observations themselves are in output_path
 # get_bird_sighting_data(ebird_species_code='mcclon', output_path=DATA_DIR+"4_raw_bird_sighting_data.jsonl")
 # get_wind_speed_data(output_path=raw_path)
 process_bird_sighting_data(input_path=DATA_DIR+"4_raw_bird_sighting_data.jsonl", proc_output_path=DATA_DIR+"4_proc_bird_sighting_data.jsonl")
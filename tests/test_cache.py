@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_sightings, make_wind_raster
+from core.cache import LayerCache
+from core.map import Map
+from data_prep.process_data import process_wind_speed_data
+
+
+REGION = [49.0, 49.8, -110.5, -108.5]
+
+
+def arrays(seed: int) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return {'birdRisk': rng.random(1000), 'counts': rng.integers(0, 50, (10, 100))}
+
+
+def test_round_trip(tmp_path):
+    cache = LayerCache(str(tmp_path))
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("some sightings")
+    key = cache.make_key([str(input_path)], grid_size=5000)
+
+    assert cache.load(key) is None
+    cache.save(key, arrays(0), {'grid_size': 5000})
+    loaded, meta = cache.load(key)
+
+    assert meta['grid_size'] == 5000
+    for name, array in arrays(0).items():
+        assert isinstance(loaded[name], np.memmap)
+        np.testing.assert_array_equal(loaded[name], array)
+
+
+def test_key_follows_contents_and_params(tmp_path):
+    cache = LayerCache(str(tmp_path / "cache"))
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("some sightings")
+    key = cache.make_key([str(input_path)], grid_size=5000)
+
+    # Same contents under another name (or touched) is still a hit, anything else is a new key
+    copy = tmp_path / "copy.txt"
+    copy.write_text("some sightings")
+    assert cache.make_key([str(copy)], grid_size=5000) == key
+    assert cache.make_key([str(input_path)], grid_size=10000) != key
+    input_path.write_text("other sightings")
+    assert cache.make_key([str(input_path)], grid_size=5000) != key
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = LayerCache(str(tmp_path))
+    cache.save("a", arrays(0), {})
+    entry_size = sum(entry.stat().st_size for entry in os.scandir(tmp_path / "a"))
+    cache.max_bytes = int(2.5 * entry_size)
+
+    cache.save("b", arrays(1), {})
+    # Make a older than b, then use it, so b is the least recently used one
+    os.utime(tmp_path / "a" / "meta.json", (1000, 1000))
+    os.utime(tmp_path / "b" / "meta.json", (2000, 2000))
+    assert cache.load("a") is not None
+
+    cache.save("c", arrays(2), {})
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+    np.testing.assert_array_equal(cache.load("a")[0]['birdRisk'], arrays(0)['birdRisk'])
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cached_map")
+    sightings = make_sightings(500, str(folder / "sightings.parquet"), coord_range=REGION, num_hotspots=5)
+    raw = make_wind_raster(str(folder / "raw.tif"), coord_range=REGION, resolution=0.01)
+    wind = str(folder / "wind.parquet")
+    process_wind_speed_data(raw, wind, coord_range=REGION)
+    return sightings, wind
+
+
+def test_warm_map_matches_cold_map(inputs, tmp_path):
+    sightings, wind = inputs
+    maps = []
+    for _ in range(2):
+        records = []
+        maps.append(Map(REGION, 5000, sightings, wind, wind_speed_mode="raster", render_mode="image",
+                        cache_dir=str(tmp_path), profile_hooks=[records.append]))
+        stages = {record['stage']: record for record in records}
+
+    # The second one loads the layers, nothing is read or recomputed
+    assert stages['cache_load']['hit']
+    assert 'read_sightings' not in stages and 'bird_risk' not in stages
+
+    cold, warm = maps
+    for column in ['birdRisk', 'windSpeed', 'value', 'pso']:
+        np.testing.assert_array_equal(warm.gdf[column].to_numpy(), cold.gdf[column].to_numpy())
+
+    # And it still updates like a cold one
+    for map in maps:
+        map.update_bird_radius(10000)
+        map.update_resolution(10000)
+    np.testing.assert_allclose(warm.gdf['birdRisk'].to_numpy(), cold.gdf['birdRisk'].to_numpy())
+    np.testing.assert_allclose(warm.gdf['windSpeed'].to_numpy(), cold.gdf['windSpeed'].to_numpy())
@@ -0,0 +1,101 @@
+import json
+from datetime import date
+
+from data_prep.ebird_stub import EBirdStub
+from data_prep.get_data import get_bird_sighting_data
+
+
+DATES = [date(2020, 5, day) for day in range(1, 6)]
+
+
+def observation(day: str, sub_id: str, how_many: int = None) -> dict:
+    obs = {"speciesCode": "ferhaw", "comName": "Ferruginous Hawk", "sciName": "Buteo regalis",
+           "obsDt": f"{day} 08:00", "lat": 50.5, "lng": -112.0, "subId": sub_id}
+    if how_many is not None:
+        obs["howMany"] = how_many
+    return obs
+
+
+def stub_days() -> dict:
+    ''' Two hawks and one other species a day, one hawk without a count '''
+    days = {}
+    for d in DATES:
+        day = d.strftime("%Y-%m-%d")
+        other = {**observation(day, f"S{d.day}c", 3), "speciesCode": "rethaw"}
+        days[day] = [observation(day, f"S{d.day}a", 2), observation(day, f"S{d.day}b"), other]
+    return days
+
+
+def fetch(stub: EBirdStub, output_path, **kwargs) -> int:
+    kwargs = {"num_workers": 2, "requests_per_second": 0, "backoff": 0, "max_retries": 2, **kwargs}
+    return get_bird_sighting_data(ebird_api_key="test", output_path=str(output_path), base_url=stub.url,
+                                  dates=DATES, **kwargs)
+
+
+def read_sub_ids(path) -> list[str]:
+    with open(path) as f:
+        return sorted(json.loads(line)["subId"] for line in f)
+
+
+def test_fetches_every_day_and_filters_species(tmp_path):
+    output = tmp_path / "sightings.jsonl"
+    with EBirdStub(stub_days()) as stub:
+        assert fetch(stub, output) == 10
+
+    assert read_sub_ids(output) == sorted(f"S{d.day}{k}" for d in DATES for k in "ab")
+    with open(output) as f:
+        uncounted = [json.loads(line) for line in f if json.loads(line)["subId"].endswith("b")]
+    assert all(obs["howMany"] == 1 and obs["noCount"] == 1 for obs in uncounted)
+
+
+def test_retries_429_and_5xx(tmp_path):
+    output = tmp_path / "sightings.jsonl"
+    with EBirdStub(stub_days(), failures={"2020-05-02": [503, 429], "2020-05-04": [500]}) as stub:
+        assert fetch(stub, output) == 10
+        assert stub.calls["2020-05-02"] == 3
+        assert stub.calls["2020-05-04"] == 2
+        assert stub.calls["2020-05-01"] == 1
+
+
+def test_resumes_only_the_failed_days(tmp_path):
+    output = tmp_path / "sightings.jsonl"
+
+    # More failures than retries, so that day is left for the next run
+    with EBirdStub(stub_days(), failures={"2020-05-03": [503] * 3}) as stub:
+        assert fetch(stub, output) == 8
+
+    with EBirdStub(stub_days()) as stub:
+        assert fetch(stub, output) == 2
+        assert set(stub.calls) == {"2020-05-03"}
+
+    assert read_sub_ids(output) == sorted(f"S{d.day}{k}" for d in DATES for k in "ab")
+
+
+def test_drops_output_past_the_last_checkpoint(tmp_path):
+    output = tmp_path / "sightings.jsonl"
+    with EBirdStub(stub_days(), failures={"2020-05-05": [503] * 3}) as stub:
+        fetch(stub, output)
+
+    # A crash after a day's observations were written but before its checkpoint line
+    with open(output, "a") as f:
+        f.write(json.dumps(observation("2020-05-05", "S5a", 2)) + "\n")
+    with open(f"{output}.checkpoint", "a") as f:
+        f.write("2020-05-05 fer")  # and a half-written checkpoint line
+
+    with EBirdStub(stub_days()) as stub:
+        assert fetch(stub, output) == 2
+        assert set(stub.calls) == {"2020-05-05"}
+
+    assert read_sub_ids(output) == sorted(f"S{d.day}{k}" for d in DATES for k in "ab")
+
+
+def test_starts_over_without_a_checkpoint(tmp_path):
+    output = tmp_path / "sightings.jsonl"
+    with open(output, "w") as f:
+        f.write(json.dumps(observation("2019-01-01", "old")) + "\n")
+
+    with EBirdStub(stub_days()) as stub:
+        fetch(stub, output)
+
+    assert "old" not in read_sub_ids(output)
+    assert len(read_sub_ids(output)) == 10
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from core.grid import Grid
+from core.kernels import bin_sightings, kernel_sum
+
+
+GRID = Grid("EPSG:32612", 400_000, 5_500_000, 430_000, 5_520_000, 1000)  # 20 x 30 cells
+RADIUS = 3000
+
+
+@pytest.fixture(scope="module")
+def sightings():
+    rng = np.random.default_rng(3)
+    xy = np.column_stack([rng.uniform(395_000, 435_000, 4000), rng.uniform(5_495_000, 5_525_000, 4000)])
+    # A few hotspots with many sightings at the exact same spot
+    xy[:1000] = xy[rng.integers(1000, 4000, 10)].repeat(100, axis=0)
+    return xy, rng.integers(1, 5, len(xy)).astype(np.float64)
+
+
+def disc(xy, counts, radius):
+    return kernel_sum(cKDTree(xy), counts, cKDTree(GRID.centroids), GRID.size, radius)
+
+
+def test_no_bin_size_is_exact(sightings):
+    xy, counts = sightings
+    positions, merged = bin_sightings(xy, counts)
+    assert len(positions) < len(xy)
+    np.testing.assert_allclose(disc(positions, merged, RADIUS), disc(xy, counts, RADIUS))
+
+
+@pytest.mark.parametrize("bin_size", [100, 250, 1000])
+def test_binned_error_is_bounded(sightings, bin_size):
+    xy, counts = sightings
+    positions, binned = bin_sightings(xy, counts, bin_size)
+    approx = disc(positions, binned, RADIUS)
+
+    # No sighting moves more than bin_size * sqrt(2), so every cell gets at least the sightings within
+    # the radius shrunk by that much, and at most the ones within the radius grown by it
+    slack = bin_size * np.sqrt(2)
+    assert np.all(approx >= disc(xy, counts, RADIUS - slack) - 1e-9)
+    assert np.all(approx <= disc(xy, counts, RADIUS + slack) + 1e-9)
+    assert approx.sum() == pytest.approx(disc(xy, counts, RADIUS).sum(), rel=bin_size / RADIUS)
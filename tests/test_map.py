@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_sightings, make_wind_raster
+from core.map import Map
+from data_prep.process_data import process_wind_speed_data
+
+
+REGION = [49.0, 49.8, -110.5, -108.5]
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    ''' Sightings and a processed wind raster over REGION, shared by every Map below '''
+    folder = tmp_path_factory.mktemp("map")
+    sightings = make_sightings(500, str(folder / "sightings.parquet"), coord_range=REGION, num_hotspots=5)
+    raw = make_wind_raster(str(folder / "raw.tif"), coord_range=REGION, resolution=0.01)
+    wind = str(folder / "wind.parquet")
+    process_wind_speed_data(raw, wind, coord_range=REGION)
+    return sightings, wind
+
+
+@pytest.fixture
+def map(inputs):
+    sightings, wind = inputs
+    return Map(REGION, 5000, sightings, wind, wind_speed_mode="raster", render_mode="image", profile_hooks=[])
+
+
+def rescaled(values: np.ndarray) -> np.ndarray:
+    return (values - values.min()) / (values.max() - values.min())
+
+
+@pytest.mark.parametrize("bird, wind", [(50, 50), (90, 10), (1, 100), (0, 30)])
+def test_cost_value_uses_the_coefficients(map, bird, wind):
+    map.calculate_cost_value({'birdRisk': bird, 'windSpeed': wind})
+    expected = rescaled(wind * map.gdf['windSpeed'].to_numpy() - bird * map.gdf['birdRisk'].to_numpy())
+    np.testing.assert_allclose(map.gdf['value'].to_numpy(), expected, atol=1e-12)
+    np.testing.assert_allclose(map.batch_cost_values(np.array([[bird, wind]]))[0], map.value_grid, atol=1e-12)
+
+
+def test_scorer_is_reused_until_a_layer_changes(map):
+    scorer = map.get_scorer()
+    for bird in (10, 60, 95):
+        map.calculate_cost_value({'birdRisk': bird})
+        assert map.get_scorer() is scorer
+
+    map.update_bird_radius(10000)
+    rebuilt = map.get_scorer()
+    assert rebuilt is not scorer
+    np.testing.assert_array_equal(rebuilt.stack[rebuilt.names.index('birdRisk')], -map.gdf['birdRisk'].to_numpy())
+
+
+@pytest.mark.parametrize("grid_size", [2000, 10000, 20000])
+def test_update_resolution_matches_a_new_map(inputs, map, grid_size):
+    sightings, wind = inputs
+    map.update_resolution(grid_size)
+    fresh = Map(REGION, grid_size, sightings, wind, wind_speed_mode="raster", render_mode="image", profile_hooks=[])
+
+    assert map.grid.shape == fresh.grid.shape
+    for column in ['birdRisk', 'windSpeed', 'value']:
+        np.testing.assert_allclose(map.gdf[column].to_numpy(), fresh.gdf[column].to_numpy(), atol=1e-12)
+
+
+def stages(map) -> list[str]:
+    ''' Names of the stages run since the last reset, then starts a new run '''
+    names = [record['stage'] for record in map.profiler.records]
+    map.profiler.reset()
+    return names
+
+
+def test_unchanged_inputs_skip_every_stage(map):
+    map.get_folium_html()
+    result = map.run_pso()
+    stages(map)
+
+    # A rerun with nothing changed
+    map.calculate_cost_value(map.get_coefficients())
+    assert map.run_pso() is result
+    map.update_folium_map('value')
+    map.update_resolution(map.grid_size)
+    map.update_bird_radius(map.bird_radius)
+    map.get_folium_html()
+    assert stages(map) == []
+
+
+def test_only_the_affected_stages_recompute(map):
+    map.get_folium_html()
+    stages(map)
+
+    # Another subject is a new map, but nothing upstream of it changes
+    map.update_folium_map('windSpeed')
+    map.calculate_cost_value()
+    map.run_pso()
+    assert stages(map) == ['folium']
+
+    # New coefficients change value and the search on it, and the 'value' map, not the 'windSpeed' one
+    map.calculate_cost_value({'birdRisk': 80})
+    map.run_pso()
+    map.update_folium_map('windSpeed')
+    assert stages(map) == ['cost_value', 'pso']
+    map.update_folium_map('value')
+    map.get_folium_html()
+    map.get_folium_html()
+    assert stages(map) == ['folium', 'render_html']
@@ -0,0 +1,47 @@
+import math
+
+import numpy as np
+import pytest
+from scipy import integrate
+
+from core.power import TURBINES, PowerCurve, capacity_factors
+
+
+def weibull_scale(mean: float, k: float) -> float:
+    return mean / math.gamma(1 + 1 / k)
+
+
+@pytest.mark.parametrize("mean, k", [(7.0, 2.0), (5.5, 2.0), (9.0, 3.0), (6.25, 1.5)])
+def test_flat_curve_is_the_probability_of_running(mean, k):
+    # Full power from 3 to 25 m/s and nothing outside, so the capacity factor is just P(3 <= v <= 25)
+    flat = PowerCurve([3.0, 25.0], [1000, 1000])
+    scale = weibull_scale(mean, k)
+    expected = math.exp(-(3.0 / scale) ** k) - math.exp(-(25.0 / scale) ** k)
+    assert capacity_factors(np.array([mean]), [flat], k)[0, 0] == pytest.approx(expected, abs=1e-4)
+
+
+def test_hand_computed_value():
+    # Mean 7 m/s with k = 2: scale = 7 / gamma(1.5) = 7.8987, exp(-(3 / 7.8987)^2) - exp(-(25 / 7.8987)^2) = 0.86562
+    flat = PowerCurve([3.0, 25.0], [1000, 1000])
+    assert capacity_factors(np.array([7.0]), [flat])[0, 0] == pytest.approx(0.86562, abs=1e-5)
+
+
+@pytest.mark.parametrize("mean", [4.0, 6.5, 8.0, 11.0])
+def test_turbines_match_the_integral(mean):
+    curves = list(TURBINES.values())
+    factors = capacity_factors(np.array([[mean, mean]]), curves)
+    assert factors.shape == (1, 2, len(curves))
+
+    k = 2.0
+    scale = weibull_scale(mean, k)
+    for curve, factor in zip(curves, factors[0, 0]):
+        density = lambda v: k / scale * (v / scale) ** (k - 1) * math.exp(-(v / scale) ** k)
+        expected, _ = integrate.quad(lambda v: curve.output(v) / curve.rated_power * density(v), 0, curve.speeds[-1],
+                                     points=curve.speeds, limit=200)
+        assert factor == pytest.approx(expected, abs=2e-3)
+
+
+def test_calm_and_missing_cells():
+    factors = capacity_factors(np.array([0.0, np.nan]), list(TURBINES.values()))
+    np.testing.assert_array_equal(factors[0], 0)
+    assert np.isnan(factors[1]).all()
@@ -0,0 +1,94 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from core.datasets import read_points
+from data_prep.process_data import process_bird_sighting_data
+
+
+RANGE = [49.0, 52.833333, -114.0, -110.0]
+
+
+def write_raw(path, num: int, seed: int = 0) -> pd.DataFrame:
+    ''' Sightings in random order all over the range, every 10th one sent twice like a resumed download '''
+    rng = np.random.default_rng(seed)
+    raw = pd.DataFrame({
+        "speciesCode": "ferhaw", "comName": "Ferruginous Hawk", "sciName": "Buteo regalis",
+        "obsDt": "2020-05-01 08:00", "howMany": rng.integers(1, 5, num),
+        "lat": rng.uniform(48.5, 53.3, num), "lng": rng.uniform(-114, -110, num),
+        "subId": [f"S{i}" for i in range(num)],
+    })
+    rows = pd.concat([raw, raw.iloc[::10]]).sample(frac=1, random_state=seed)
+    with open(path, "w") as f:
+        for row in rows.to_dict("records"):
+            f.write(json.dumps(row) + "\n")
+    return raw
+
+
+def test_row_groups_hold_one_sorted_band(tmp_path):
+    raw = write_raw(tmp_path / "raw.jsonl", 20_000)
+    out = str(tmp_path / "proc.parquet")
+
+    written = process_bird_sighting_data(str(tmp_path / "raw.jsonl"), out, RANGE, chunk_size=3000, lat_band=0.25)
+
+    inside = raw[(raw["lat"] >= RANGE[0]) & (raw["lat"] <= RANGE[1])]
+    assert written == len(inside)
+
+    data = pd.read_parquet(out)
+    np.testing.assert_allclose(np.sort(data["lat"].to_numpy()), np.sort(inside["lat"].to_numpy(np.float32)))
+
+    file = pq.ParquetFile(out)
+    assert file.metadata.num_row_groups > 1
+    for group in range(file.metadata.num_row_groups):
+        lat = file.read_row_group(group, columns=["lat"])["lat"].to_numpy().astype(np.float64)
+        assert np.all(np.diff(lat) >= 0)
+        assert np.floor(lat.min() / 0.25) == np.floor(lat.max() / 0.25)
+
+
+def test_bbox_read_skips_other_bands(tmp_path):
+    write_raw(tmp_path / "raw.jsonl", 20_000)
+    out = str(tmp_path / "proc.parquet")
+    process_bird_sighting_data(str(tmp_path / "raw.jsonl"), out, RANGE, chunk_size=3000, lat_band=0.25)
+
+    box = [50.0, 50.4, -113.0, -112.0]
+    file = pq.ParquetFile(out)
+    stats = [file.metadata.row_group(group).column(file.schema_arrow.get_field_index("lat")).statistics
+             for group in range(file.metadata.num_row_groups)]
+    overlapping = [s for s in stats if s.max >= box[0] and s.min <= box[1]]
+    assert len(overlapping) < len(stats) / 4
+
+    data = read_points(out, ["howMany"], box)
+    full = pd.read_parquet(out)
+    expected = full[(full["lat"] >= box[0]) & (full["lat"] <= box[1]) & (full["lon"] >= box[2]) & (full["lon"] <= box[3])]
+    assert len(data) == len(expected) > 0
+
+
+@pytest.mark.parametrize("partitions", [1, 4, None])
+def test_duplicates_across_chunks(tmp_path, partitions):
+    rng = np.random.default_rng(1)
+    raw = pd.DataFrame({
+        "speciesCode": rng.choice(["ferhaw", "rethaw"], 6000), "comName": "Hawk", "sciName": "Buteo",
+        "obsDt": "2020-05-01 08:00", "howMany": rng.integers(1, 5, 6000),
+        "lat": rng.uniform(49.5, 52.5, 6000), "lng": rng.uniform(-113.5, -110.5, 6000),
+        "subId": [f"S{i % 4000}" for i in range(6000)],
+    })
+    raw = raw.drop_duplicates(subset=["subId", "speciesCode"])
+
+    # The first 1000 sent again at the very end with other counts, so copies are many chunks apart
+    again = raw.iloc[:1000].assign(howMany=100)
+    with open(tmp_path / "raw.jsonl", "w") as f:
+        for row in pd.concat([raw, again]).to_dict("records"):
+            f.write(json.dumps(row) + "\n")
+
+    out = str(tmp_path / "proc.parquet")
+    written = process_bird_sighting_data(str(tmp_path / "raw.jsonl"), out, RANGE, chunk_size=500, partitions=partitions)
+
+    # One row per (subId, speciesCode), and it's the first copy that's kept
+    data = pd.read_parquet(out)
+    assert written == len(data) == len(raw)
+    assert data["howMany"].sum() == raw["howMany"].sum()
+    assert not any(name.endswith(".parquet") and name != "proc.parquet" for name in os.listdir(tmp_path))
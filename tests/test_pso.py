@@ -0,0 +1,26 @@
+import numpy as np
+
+from core.pso import run_pso
+
+
+def test_finds_the_peak():
+    y, x = np.mgrid[0:80, 0:120]
+    values = -((x - 90) ** 2 + (y - 20) ** 2).astype(np.float64)
+    (best_x, best_y), score = run_pso(values, seed=0, num_swarms=4)
+    assert (best_x, best_y) == (90, 20) and score == 0
+
+
+def test_never_returns_an_excluded_cell():
+    # Excluded everywhere but a small island in the corner, far from where random particles would land
+    values = np.full((200, 300), -np.inf)
+    values[190:195, 5:8] = np.arange(15, dtype=np.float64).reshape(5, 3)
+    for seed in range(10):
+        (best_x, best_y), score = run_pso(values, num_particles=5, max_iter=10, seed=seed)
+        assert np.isfinite(score)
+        assert values[best_y, best_x] == score
+
+
+def test_nothing_to_find():
+    values = np.full((10, 10), -np.inf)
+    values[3, 3] = np.nan
+    assert run_pso(values, seed=0) == ((-1, -1), float('-inf'))
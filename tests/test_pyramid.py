@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from core.grid import Grid
+from core.pyramid import LayerPyramid
+
+
+BASE = Grid("EPSG:32612", 400_000, 5_500_000, 423_000, 5_517_000, 1000)  # 17 x 23 cells, so most levels have partial blocks
+
+
+@pytest.fixture(scope="module")
+def points():
+    ''' Points inside the base grid with a value and a month each '''
+    rng = np.random.default_rng(7)
+    x = rng.uniform(BASE.xmin, BASE.xmax, 20_000)
+    y = rng.uniform(BASE.ymin, BASE.ymax, 20_000)
+    return x, y, rng.gamma(2, 3, len(x)), rng.integers(0, 12, len(x))
+
+
+@pytest.fixture(scope="module")
+def pyramid(points):
+    x, y, values, months = points
+    index = BASE.index_of(x, y)
+    sums, counts = BASE.zonal_sum(index, values)
+    monthly, _ = BASE.zonal_sum(index, values, months, 12)
+    return LayerPyramid(BASE, {'sum': sums, 'count': counts, 'monthly': monthly})
+
+
+@pytest.mark.parametrize("grid_size", [1000, 2000, 5000, 10_000, 20_000, 50_000])
+def test_level_matches_a_direct_rebuild(points, pyramid, grid_size):
+    x, y, values, months = points
+    grid, layers = pyramid.level(grid_size)
+
+    # Binning the points straight onto a grid of that size, the way a new Map would
+    direct = Grid(BASE.crs, BASE.xmin, BASE.ymin, BASE.xmax, BASE.ymax, grid_size)
+    assert grid.shape == direct.shape
+    index = direct.index_of(x, y)
+    sums, counts = direct.zonal_sum(index, values)
+    monthly, _ = direct.zonal_sum(index, values, months, 12)
+
+    np.testing.assert_allclose(layers['sum'].ravel(), sums)
+    np.testing.assert_array_equal(layers['count'].ravel(), counts)
+    np.testing.assert_allclose(layers['monthly'].reshape(len(direct), 12), monthly)
+    assert layers['count'].sum() == len(x)
+
+
+def test_levels_are_cached(pyramid):
+    assert pyramid.level(5000)[1]['sum'] is pyramid.level(5000)[1]['sum']
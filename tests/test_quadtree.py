@@ -0,0 +1,68 @@
+import numpy as np
+
+from core.grid import Grid, block_sum
+from core.quadtree import refine
+
+
+FINE = Grid("EPSG:32612", 400_000, 5_500_000, 464_000, 5_548_000, 1000)  # 48 x 64 cells
+MAX_LEVEL = 3
+
+
+def level_means(field: np.ndarray):
+    ''' values(level, cells) of the block means of a (rows, cols) field on FINE '''
+    def values(level, cells):
+        factor = 2 ** level
+        return (block_sum(field, factor) / block_sum(np.ones_like(field), factor)).ravel()[cells][np.newaxis]
+    return values
+
+
+def check_tiling(tree):
+    ''' Every fine cell is in exactly one leaf '''
+    area = (4 ** tree.level.astype(np.int64)).sum()
+    assert area == len(FINE) and np.all(tree.leaf_of >= 0)
+    np.testing.assert_array_equal(np.bincount(tree.leaf_of, minlength=len(tree)), 4 ** tree.level.astype(np.int64))
+
+
+def test_flat_field_stays_coarse():
+    tree = refine(FINE, MAX_LEVEL, level_means(np.ones(FINE.shape)))
+    check_tiling(tree)
+    assert np.all(tree.level == MAX_LEVEL)
+
+
+def test_splits_only_around_a_bump():
+    field = np.zeros(FINE.shape)
+    field[21:23, 31:33] = 1.0  # straddles 2 x 2 blocks, so only 1 km leaves fit it
+    tree = refine(FINE, MAX_LEVEL, level_means(field), threshold=0.1)
+    check_tiling(tree)
+
+    # Fine leaves cover the bump, everything far from it stays at the coarsest level
+    assert np.all(tree.level[tree.leaf_of.reshape(FINE.shape)[21:23, 31:33]] == 0)
+    far = tree.leaf_of.reshape(FINE.shape)[:8, :8]
+    assert np.all(tree.level[far] == MAX_LEVEL)
+
+
+def test_spread_splits_noise_the_children_hide():
+    # Checkerboard of 1 km cells, every 2 x 2 block (and so every child) has the same mean
+    field = np.indices(FINE.shape).sum(axis=0) % 2 * 1.0 + np.linspace(0, 1, FINE.cols)
+    values = level_means(field)
+    assert refine(FINE, MAX_LEVEL, values, threshold=0.2).level.min() > 0
+
+    def spread(level, cells):
+        return np.full((1, len(cells)), 0.5)
+
+    tree = refine(FINE, MAX_LEVEL, values, threshold=0.2, spread=spread)
+    check_tiling(tree)
+    assert np.all(tree.level == 0)
+
+
+def test_count_limit():
+    counts_field = np.zeros(FINE.shape)
+    counts_field[5, 5] = 500
+
+    def counts(level, cells):
+        return block_sum(counts_field, 2 ** level).ravel()[cells]
+
+    tree = refine(FINE, MAX_LEVEL, level_means(np.zeros(FINE.shape)), counts, max_count=100)
+    check_tiling(tree)
+    assert tree.level[tree.leaf_of[5 * FINE.cols + 5]] == 0
+    assert (tree.level == MAX_LEVEL).sum() == len(FINE.coarsen(2 ** MAX_LEVEL)) - 1
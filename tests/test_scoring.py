@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from core.scoring import Scorer, pareto_mask
+
+
+def brute_force(points: np.ndarray) -> np.ndarray:
+    ''' A row is kept unless some other row is >= on every column and > on one '''
+    at_least = (points[None, :, :] >= points[:, None, :]).all(axis=2)
+    better = (points[None, :, :] > points[:, None, :]).any(axis=2)
+    return ~(at_least & better).any(axis=1)
+
+
+@pytest.mark.parametrize("columns", [1, 2, 3, 4])
+@pytest.mark.parametrize("seed", range(5))
+def test_pareto_mask_matches_brute_force(columns, seed):
+    rng = np.random.default_rng(seed)
+    # Small integers so there are plenty of ties and duplicate rows
+    points = rng.integers(0, 6, size=(300, columns)).astype(np.float64)
+    np.testing.assert_array_equal(pareto_mask(points, block_size=16), brute_force(points))
+
+
+def test_pareto_mask_continuous_values():
+    points = np.random.default_rng(1).normal(size=(2000, 3))
+    np.testing.assert_array_equal(pareto_mask(points, block_size=64), brute_force(points))
+
+
+def test_best_cells_matches_full_scoring():
+    rng = np.random.default_rng(2)
+    layers = {"windSpeed": rng.random(500), "birdRisk": rng.random(500), "power": rng.random(500)}
+    mask = rng.random(500) > 0.2
+    scorer = Scorer(layers, mask=mask)
+    weights = rng.integers(0, 10, size=(50, 3))
+    weights[0] = 1
+
+    best = scorer.best_cells(weights)
+    values = scorer.score_batch(weights)
+    np.testing.assert_allclose(values[np.arange(len(weights)), best], values.max(axis=1))
+    assert mask[best].all()
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from core.sites import select_sites
+
+
+def brute_force(values: np.ndarray, k: int, min_spacing: float) -> list[tuple[int, int]]:
+    ''' Walks every finite cell best first, keeping the ones min_spacing away from all earlier picks '''
+    rows, cols = values.shape
+    picks = []
+    for index in np.argsort(-values.ravel(), kind="stable"):
+        if len(picks) == k:
+            break
+        y, x = divmod(int(index), cols)
+        if not np.isfinite(values[y, x]):
+            continue
+        if all((x - px) ** 2 + (y - py) ** 2 >= min_spacing ** 2 for px, py in picks):
+            picks.append((x, y))
+    return picks
+
+
+@pytest.mark.parametrize("min_spacing", [0, 1, 2.5, 7, 40])
+@pytest.mark.parametrize("k", [1, 5, 30])
+def test_matches_brute_force(k, min_spacing):
+    rng = np.random.default_rng(k)
+    values = rng.random((40, 60))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    values[:5, :5] = -np.inf
+
+    picks = select_sites(values, k, min_spacing)
+    assert picks == brute_force(values, k, min_spacing)
+
+
+def test_picks_are_spaced():
+    # Smooth hill, so without spacing the best cells would all bunch up at the top
+    y, x = np.mgrid[0:100, 0:100]
+    values = -((x - 50) ** 2 + (y - 50) ** 2).astype(np.float64)
+
+    picks = select_sites(values, 10, min_spacing=12)
+    assert len(picks) == 10
+    for i, (x1, y1) in enumerate(picks):
+        for x2, y2 in picks[i + 1:]:
+            assert np.hypot(x1 - x2, y1 - y2) >= 12
+
+
+def test_fewer_picks_when_the_grid_runs_out():
+    values = np.full((10, 10), np.nan)
+    values[0, 0] = values[0, 9] = 1.0
+    assert select_sites(values, 5, min_spacing=3) == [(0, 0), (9, 0)]
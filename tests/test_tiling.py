@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from core.grid import Grid
+from core.kernels import kernel_sum
+from core.tiling import tiled_centre_kernel_sum, tiled_kernel_sum
+from core.timewindow import month_prefix
+
+
+@pytest.fixture
+def case():
+    ''' Sightings spread over and just past a 37 x 23 grid of 1 km cells '''
+    rng = np.random.default_rng(0)
+    grid = Grid("EPSG:32612", 400_000, 5_500_000, 437_000, 5_523_000, 1000)
+    xy = rng.uniform([395_000, 5_495_000], [442_000, 5_528_000], size=(3000, 2))
+    counts = rng.integers(1, 5, size=len(xy)).astype(np.float64)
+    bins = rng.integers(0, 7, size=len(xy))
+    return grid, xy, counts, bins
+
+
+def untiled(grid, xy, counts, radius, kernel, bins=None, num_bins=1):
+    return kernel_sum(cKDTree(xy), counts, cKDTree(grid.centroids), grid.size, radius, kernel,
+                      bins=bins, num_bins=num_bins)
+
+
+@pytest.mark.parametrize("kernel", ["disc", "gaussian"])
+@pytest.mark.parametrize("tile_cells", [1, 5, 16, 64])
+def test_tiled_matches_kernel_sum(case, kernel, tile_cells):
+    grid, xy, counts, _ = case
+    tiled = tiled_kernel_sum(xy, counts, grid, 3000, kernel, tile_cells=tile_cells, num_workers=1)
+    np.testing.assert_allclose(tiled, untiled(grid, xy, counts, 3000, kernel), rtol=1e-12, atol=1e-12)
+
+
+def test_tiled_matches_kernel_sum_with_bins(case):
+    grid, xy, counts, bins = case
+    tiled = tiled_kernel_sum(xy, counts, grid, 2500, bins=bins, num_bins=7, tile_cells=8, num_workers=1)
+    assert tiled.shape == (len(grid), 7)
+    np.testing.assert_allclose(tiled, untiled(grid, xy, counts, 2500, "disc", bins, 7), rtol=1e-12, atol=1e-12)
+
+
+def test_tiled_in_worker_processes(case, tmp_path):
+    grid, xy, counts, _ = case
+    out = np.lib.format.open_memmap(tmp_path / "risk.npy", mode="w+", shape=(len(grid),))
+    tiled = tiled_kernel_sum(xy, counts, grid, 3000, tile_cells=10, num_workers=2, out=out)
+    assert tiled is out
+    np.testing.assert_allclose(tiled, untiled(grid, xy, counts, 3000, "disc"), rtol=1e-12, atol=1e-12)
+
+
+def test_tiles_reduced_to_prefix_sums(case):
+    # 2 years of month bins plus the undated one, written straight into (prefix, undated)
+    grid, xy, counts, _ = case
+    bins = np.random.default_rng(1).integers(0, 25, size=len(xy))
+    expected = month_prefix(untiled(grid, xy, counts, 2500, "disc", bins, 25), 2)
+
+    out = (np.full((len(grid), 3, 13), np.nan), np.full(len(grid), np.nan))
+    tiled_kernel_sum(xy, counts, grid, 2500, bins=bins, num_bins=25, tile_cells=8, num_workers=1,
+                     out=out, reduce=lambda cube: month_prefix(cube, 2))
+    for part, want in zip(out, expected):
+        np.testing.assert_allclose(part, want, rtol=1e-12, atol=1e-12)
+
+    out = (np.full((len(grid), 3, 13), np.nan), np.full(len(grid), np.nan))
+    tiled_centre_kernel_sum(xy, counts, grid.centroids, grid.size, 2500, bins=bins, num_bins=25, tile_size=5000,
+                            out=out, reduce=lambda cube: month_prefix(cube, 2))
+    for part, want in zip(out, expected):
+        np.testing.assert_allclose(part, want, rtol=1e-12, atol=1e-12)
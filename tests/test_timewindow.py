@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from core.timewindow import month_prefix, window_sum
+
+
+NUM_YEARS = 3
+
+
+def brute_force(cube: np.ndarray, first_year: int, last_year: int, first_month: int, last_month: int) -> np.ndarray:
+    ''' Adds up the matching bins one by one '''
+    months = range(first_month, last_month + 1) if first_month <= last_month else [*range(first_month, 12), *range(last_month + 1)]
+    total = np.zeros(cube.shape[:-1])
+    for year in range(max(first_year, 0), min(last_year, NUM_YEARS - 1) + 1):
+        for month in months:
+            total += cube[..., year * 12 + month]
+    return total
+
+
+@pytest.fixture
+def cube():
+    return np.random.default_rng(0).random((5, 2, NUM_YEARS * 12 + 1))
+
+
+def test_prefix_keeps_totals_and_undated_bin(cube):
+    prefix, undated = month_prefix(cube, NUM_YEARS)
+    assert prefix.shape == (5, 2, NUM_YEARS + 1, 13)
+    np.testing.assert_allclose(prefix[..., -1, -1], cube[..., :-1].sum(axis=-1))
+    np.testing.assert_array_equal(undated, cube[..., -1])
+
+
+@pytest.mark.parametrize("first_month", range(12))
+@pytest.mark.parametrize("last_month", range(12))
+def test_every_month_window_matches_brute_force(cube, first_month, last_month):
+    # first_month > last_month wraps around new year
+    prefix, _ = month_prefix(cube, NUM_YEARS)
+    for first_year, last_year in [(0, NUM_YEARS - 1), (1, 1), (0, 1), (2, 2)]:
+        np.testing.assert_allclose(window_sum(prefix, first_year, last_year, first_month, last_month),
+                                   brute_force(cube, first_year, last_year, first_month, last_month), atol=1e-12)
+
+
+@pytest.mark.parametrize("first_year, last_year", [(-2, 1), (1, 10), (-5, 10), (4, 6), (-3, -1), (2, 1)])
+def test_years_outside_the_data_are_clipped(cube, first_year, last_year):
+    prefix, _ = month_prefix(cube, NUM_YEARS)
+    np.testing.assert_allclose(window_sum(prefix, first_year, last_year, 10, 1),
+                               brute_force(cube, first_year, last_year, 10, 1), atol=1e-12)
+
+
+def test_fills_a_preallocated_output(cube, tmp_path):
+    out = np.lib.format.open_memmap(tmp_path / "prefix.npy", mode="w+", shape=(5, 2, NUM_YEARS + 1, 13))
+    out[:] = np.nan
+    prefix, _ = month_prefix(cube, NUM_YEARS, out=out)
+    assert prefix is out
+    np.testing.assert_allclose(out, month_prefix(cube, NUM_YEARS)[0])
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from shapely.geometry import Polygon
+
+from benchmarks.synthetic import make_sightings, make_wind_raster
+from core.grid import Grid
+from core.map import Map
+from data_prep.process_data import process_wind_speed_data
+
+
+REGION = [49.0, 49.8, -110.5, -108.5]  # east of the UTM zone 12 central meridian, so the cells are skewed
+
+
+@pytest.fixture(scope="module")
+def inputs(tmp_path_factory):
+    ''' Sightings and a processed wind raster (.parquet points and the .tif next to them) over REGION '''
+    folder = tmp_path_factory.mktemp("wind")
+    sightings = make_sightings(500, str(folder / "sightings.parquet"), coord_range=REGION, num_hotspots=5)
+    raw = make_wind_raster(str(folder / "raw.tif"), coord_range=REGION, resolution=0.005)
+    wind = str(folder / "wind.parquet")
+    process_wind_speed_data(raw, wind, coord_range=REGION)
+    return sightings, wind
+
+
+def test_lattice_covers_a_crossed_boundary():
+    # Corners in Map's order, which isn't ring order, so the polygon crosses itself
+    lat_min, lat_max, lon_min, lon_max = [49.0, 52.833333, -114.0, -110.0]
+    boundary = Polygon([(lon_max, lat_min), (lon_min, lat_min), (lon_max, lat_max), (lon_min, lat_max), (lon_min, lat_min)])
+    grid = Grid.from_boundary(boundary, 1000)
+
+    lon, lat = np.meshgrid(np.linspace(lon_min, lon_max, 41), np.linspace(lat_min, lat_max, 41))
+    _, _, index = grid.cell_of(lat.ravel(), lon.ravel())
+    assert np.all(index >= 0)
+
+
+@pytest.mark.parametrize("grid_size, max_diff", [(5000, 5e-3), (1000, None)])
+def test_raster_matches_sjoin(inputs, grid_size, max_diff):
+    sightings, wind = inputs
+    maps = [Map(REGION, grid_size, sightings, wind, wind_speed_mode=mode, profile_hooks=[]) for mode in ("raster", "sjoin")]
+    raster, sjoin = (m.gdf['windSpeed'].to_numpy() for m in maps)
+
+    # Only pixel centres within a few cm of a cell edge can land on different sides (the sjoin polygons
+    # have straight WGS84 edges, and the .parquet stores float32 coordinates), so nearly every cell agrees.
+    # A 1 km cell has only a couple of pixels, so one of them switching sides can move it a lot
+    diff = np.abs(raster - sjoin)
+    assert np.mean(diff > 1e-6) < 0.01
+    assert diff.mean() < 1e-3
+    if max_diff is not None:
+        assert diff.max() < max_diff